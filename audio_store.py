@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+コンテンツアドレス方式の音声ストア
+合成したWAVを内容のハッシュをファイル名にしてディスクに保存し、同じリクエストには
+保存済みの音声を返す。ハッシュをURLと強いETagに使うため、変わらない内容として
+HTTPキャッシュ・CDNにそのままキャッシュさせられる
+
+ファイル構成（KOKORO_AUDIO_STORE_DIR 以下）:
+    <内容のハッシュ>.wav        音声
+    index/<リクエストのハッシュ>  リクエスト（テキスト・音声・速度など）→ 内容のハッシュ
+
+- 書き込みは一時ファイル + os.replace のため、複数プロセスで共有できる
+- 合計サイズが上限を超えたら最終アクセスの古いものから削除する
+  （他のプロセスの書き込みも反映するため、合計サイズは定期的にディスクから数え直す）
+- 過負荷で切り下げた音声（サンプルレートを下げた・高速バックエンドで合成した）は保存しない（呼び出し側で判断）
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from flask import send_file
+
+# 有効化（既定は無効）
+AUDIO_STORE = os.environ.get('KOKORO_AUDIO_STORE', '0') == '1'
+AUDIO_STORE_DIR = os.environ.get('KOKORO_AUDIO_STORE_DIR', 'audio_store')
+AUDIO_STORE_MB = float(os.environ.get('KOKORO_AUDIO_STORE_MB', '512'))
+# 内容が変わらないため長期間キャッシュさせる（1年）
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# 上限を超えたときにこの割合まで削除する
+EVICT_TARGET = 0.9
+# 合計サイズをディスクから数え直す間隔（秒）
+RESCAN_INTERVAL = 10
+
+_HASH_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def request_key(text, voice, speed, language=None, first_segment=None):
+    """合成結果が同じになるリクエストのキー"""
+    payload = json.dumps([text, voice, float(speed), language, first_segment], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+class AudioStore:
+    """内容のハッシュで音声を保存・取得"""
+
+    def __init__(self, directory=AUDIO_STORE_DIR, max_mb=AUDIO_STORE_MB):
+        self.directory = os.path.abspath(directory)
+        self.index_dir = os.path.join(self.directory, 'index')
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = self._disk_bytes()
+        self._scanned_at = time.time()
+        self.hits = 0
+        self.stored = 0
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith('.wav')]
+
+    def _disk_bytes(self):
+        total = 0
+        for entry in self._entries():
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def path(self, content_hash):
+        """保存済みの音声のパス（なければNone）"""
+        if not _HASH_PATTERN.match(content_hash or ''):
+            return None
+        path = os.path.join(self.directory, f'{content_hash}.wav')
+        return path if os.path.exists(path) else None
+
+    def lookup(self, key):
+        """リクエストのキーから保存済みの音声の内容ハッシュを取得（なければNone）"""
+        try:
+            with open(os.path.join(self.index_dir, key), encoding='ascii') as f:
+                content_hash = f.read().strip()
+        except OSError:
+            return None
+        path = self.path(content_hash)
+        if path is None or not self.touch(path):
+            return None
+        self.hits += 1
+        return content_hash
+
+    def touch(self, path):
+        """最終アクセス時刻を更新（削除順に使う。削除済みならFalse）"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            pass
+        return True
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, key, wav_bytes):
+        """
+        WAVを保存してリクエストのキーと対応付ける
+
+        Returns:
+            str: 内容のハッシュ（URL・ETagに使う）
+        """
+        content_hash = hashlib.sha256(wav_bytes).hexdigest()[:32]
+        path = os.path.join(self.directory, f'{content_hash}.wav')
+        if not os.path.exists(path):
+            self._write(path, wav_bytes)
+            with self._lock:
+                self._bytes += len(wav_bytes)
+                self.stored += 1
+        self._write(os.path.join(self.index_dir, key), content_hash.encode('ascii'))
+        # 自プロセスの書き込み分だけでは他のプロセスの書き込みが見えないため、定期的に数え直す
+        with self._lock:
+            if self._bytes > self.max_bytes or time.time() - self._scanned_at >= RESCAN_INTERVAL:
+                self._bytes = self._disk_bytes()
+                self._scanned_at = time.time()
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict()
+        return content_hash
+
+    def _evict(self):
+        """最終アクセスの古い音声から上限の EVICT_TARGET まで削除し、削除した音声を指すインデックスも消す"""
+        with self._lock:
+            entries = []
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICT_TARGET:
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._bytes = total
+            self._scanned_at = time.time()
+        self._remove_dangling_index()
+
+    def _remove_dangling_index(self):
+        """音声が削除済みのインデックスを削除"""
+        for entry in os.scandir(self.index_dir):
+            try:
+                with open(entry.path, encoding='ascii') as f:
+                    content_hash = f.read().strip()
+                if self.path(content_hash) is None:
+                    os.unlink(entry.path)
+            except (OSError, ValueError):
+                pass
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "mb": round(self._bytes / 1024 / 1024, 1),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "hits": self.hits,
+                "stored": self.stored
+            }
+
+def rendition_response(content_hash, download_name=None):
+    """
+    保存済みの音声のレスポンス（なければNone）
+
+    内容のハッシュを強いETagにし、GET/HEADでは If-None-Match への304と
+    Range への206（部分取得）を send_file(conditional=True) で返す
+    """
+    path = audio_store.path(content_hash) if audio_store else None
+    if path is None or not audio_store.touch(path):
+        return None
+    # 確認の後に他のプロセスが削除した場合も見つからないとして扱う
+    try:
+        response = send_file(
+            path,
+            mimetype='audio/wav',
+            as_attachment=download_name is not None,
+            download_name=download_name or f'{content_hash}.wav',
+            conditional=True,
+            etag=content_hash,
+            max_age=IMMUTABLE_MAX_AGE
+        )
+    except FileNotFoundError:
+        return None
+    response.cache_control.immutable = True
+    return response
+
+audio_store = AudioStore() if AUDIO_STORE else None
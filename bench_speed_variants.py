@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+速度変換ベンチマーク
+1.0倍で合成した音声をタイムストレッチした場合と、各速度で再合成した場合の
+CPU時間・経過時間・品質スコアを比較する
+"""
+
+import sys
+import time
+import numpy as np
+from kokoro_core import (
+    generate_audio_stream,
+    warm_up,
+    SAMPLE_RATE
+)
+from speed_variants import time_stretch, STRETCH_MIN_QUALITY
+
+BENCH_TEXTS = {
+    'af_heart': (
+        "Accessibility settings let every listener choose a comfortable pace. "
+        "Some prefer a slower voice for dense material, while others speed through familiar passages."
+    ),
+    'jf_alpha': (
+        "読み上げの速さは利用者ごとに好みが分かれます。"
+        "難しい内容はゆっくり、慣れた内容は速めに聞きたいという声が多く寄せられています。"
+    )
+}
+
+SPEEDS = [0.8, 0.9, 1.1, 1.25, 1.5]
+ROUNDS = 3
+
+def measure(func):
+    """関数を ROUNDS 回実行し、CPU時間・経過時間の中央値と最後の結果を返す"""
+    cpu_times, wall_times = [], []
+    for _ in range(ROUNDS):
+        cpu_start, wall_start = time.process_time(), time.time()
+        result = func()
+        cpu_times.append(time.process_time() - cpu_start)
+        wall_times.append(time.time() - wall_start)
+    return sorted(cpu_times)[ROUNDS // 2], sorted(wall_times)[ROUNDS // 2], result
+
+def synthesize(text, voice, speed):
+    return list(generate_audio_stream(text, voice, speed))
+
+def main():
+    voices = sys.argv[1:] or list(BENCH_TEXTS)
+    print("🧪 速度変換ベンチマーク開始...")
+    warm_up(sorted({'j' if v.startswith('j') else 'a' for v in voices}), voices=voices)
+
+    print(f"{'音声':<10} {'速度':>5} {'再合成CPU(s)':>13} {'伸縮CPU(s)':>11} {'再合成(s)':>10} {'伸縮(s)':>9} "
+          f"{'CPU比':>7} {'品質':>6}")
+    for voice in voices:
+        text = BENCH_TEXTS.get(voice, BENCH_TEXTS['af_heart'])
+        base = np.concatenate(synthesize(text, voice, 1.0))
+        for speed in SPEEDS:
+            synth_cpu, synth_wall, _ = measure(lambda: synthesize(text, voice, speed))
+            stretch_cpu, stretch_wall, (_, quality) = measure(lambda: time_stretch(base, speed))
+            fallback = " (再合成)" if quality < STRETCH_MIN_QUALITY else ""
+            print(f"{voice:<10} {speed:>5.2f} {synth_cpu:>13.3f} {stretch_cpu:>11.3f} {synth_wall:>10.3f} "
+                  f"{stretch_wall:>9.3f} {synth_cpu / max(stretch_cpu, 1e-6):>6.1f}x {quality:>6.3f}{fallback}")
+        print(f"{voice:<10} 基準音声: {len(base) / SAMPLE_RATE:.2f}秒")
+
+    print("🧪 ベンチマーク完了")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+最初の音声までの時間（TTFA）ベンチマーク
+分割方針ごとにTTFAと全体のリアルタイム係数（RTF = 合成時間 / 音声長）を計測する
+"""
+
+import sys
+import time
+from kokoro_core import (
+    generate_audio_stream,
+    warm_up,
+    FIRST_SEGMENT_POLICIES,
+    SAMPLE_RATE
+)
+
+# 計測用テキスト（最初の文を長めにしてTTFAの差が出るようにする）
+BENCH_TEXTS = {
+    'af_heart': (
+        "When the committee finally reconvened after the long winter recess, the chair opened "
+        "the session by reviewing every outstanding proposal in considerable detail. "
+        "Several members raised concerns about the budget. Others asked for more time. "
+        "In the end, the vote was postponed until the following month."
+    ),
+    'jf_alpha': (
+        "長い冬休みが明けて委員会がようやく再開されると、議長はまず未処理の提案をひとつひとつ"
+        "丁寧に確認するところから会議を始めた。何人かの委員は予算について懸念を示した。"
+        "ほかの委員はもう少し時間が欲しいと求めた。結局、採決は翌月に延期された。"
+    )
+}
+
+ROUNDS = 3
+
+def run_once(text, voice, policy):
+    """1回分のTTFA・合成時間・音声長を計測"""
+    start = time.time()
+    ttfa = None
+    samples = 0
+    for chunk in generate_audio_stream(text, voice, first_segment=policy):
+        if ttfa is None:
+            ttfa = time.time() - start
+        samples += len(chunk)
+    return ttfa, time.time() - start, samples / SAMPLE_RATE
+
+def main():
+    voices = sys.argv[1:] or list(BENCH_TEXTS)
+    print("🧪 TTFAベンチマーク開始...")
+    warm_up(sorted({'j' if v.startswith('j') else 'a' for v in voices}), voices=voices)
+
+    print(f"{'音声':<10} {'方針':<13} {'TTFA(ms)':>10} {'合成(s)':>9} {'音声(s)':>9} {'RTF':>7}")
+    for voice in voices:
+        text = BENCH_TEXTS.get(voice, BENCH_TEXTS['af_heart'])
+        for policy in FIRST_SEGMENT_POLICIES:
+            results = [run_once(text, voice, policy) for _ in range(ROUNDS)]
+            ttfa = sorted(r[0] for r in results)[ROUNDS // 2]
+            total = sorted(r[1] for r in results)[ROUNDS // 2]
+            duration = results[0][2]
+            print(f"{voice:<10} {policy:<13} {ttfa * 1000:>10.0f} {total:>9.2f} {duration:>9.2f} "
+                  f"{total / duration:>7.3f}")
+
+    print("🧪 ベンチマーク完了")
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,76 @@ Gradio UI付きKokoro-82M TTS
 音声テストが超簡単！
 """
 
+import os
 import gradio as gr
 from kokoro_core import (
-    generate_audio_file, 
+    generate_audio_stream,
+    generate_audio_batch,
+    validate_text,
     get_voice_info, 
     get_system_info,
     VOICES, 
     ALL_VOICES,
-    SAMPLE_TEXTS
+    SAMPLE_TEXTS,
+    SAMPLE_RATE
 )
+from request_log import log_exception
 
-def generate_audio(text, voice, speed):
-    """Gradio用音声生成関数"""
-    file_path, success, message = generate_audio_file(text, voice, speed)
-    return file_path if success else None, message
+# 同時に実行する生成処理の数（バッチモードでは同時に処理するバッチの数）
+GRADIO_CONCURRENCY = int(os.environ.get('KOKORO_GRADIO_CONCURRENCY', '1'))
+# キューで待てるリクエスト数の上限（超えると受け付けない）
+GRADIO_QUEUE_SIZE = int(os.environ.get('KOKORO_GRADIO_QUEUE_SIZE', '64'))
+# 待機中のクリックを1回の呼び出しでまとめて合成する最大数
+# 既定の1ではチャンクごとのストリーミング再生。2以上にすると混雑時のスループットは上がるが、
+# Gradioのバッチモードはジェネレーターを使えないため、音声は合成がすべて終わってから再生される
+GRADIO_BATCH_SIZE = int(os.environ.get('KOKORO_GRADIO_BATCH_SIZE', '1'))
+
+def generate_audio(text, voice, speed, mixed_language=False):
+    """
+    Gradio用音声生成関数
+    
+    一時ファイルを使わず、文ごとの音声チャンクを (サンプルレート, ndarray) で
+    ストリーミング出力に直接渡す
+    """
+    error = validate_text(text)
+    if error:
+        yield None, error
+        return
+    
+    try:
+        for index, chunk in enumerate(generate_audio_stream(text, voice, speed, mixed_language=mixed_language), start=1):
+            yield (SAMPLE_RATE, chunk), f"🔊 生成中... ({index}チャンク目)"
+    except Exception as e:
+        log_exception("Gradio音声生成エラー")
+        yield None, f"❌ エラー: {str(e)}"
+        return
+    
+    yield gr.update(), "✅ 音声生成完了！"
+
+def generate_audio_batch_ui(texts, voices, speeds, mixed_languages):
+    """
+    Gradio用バッチ音声生成関数（batch=True）
+    
+    キューで待機中のクリックをまとめて受け取り、kokoro_core.generate_audio_batch で
+    言語ごとにまとめて合成する（バッチモードではストリーミング出力は使えない）
+    """
+    items = [
+        {"text": text, "voice": voice, "speed": speed, "mixed_language": mixed_language}
+        for text, voice, speed, mixed_language in zip(texts, voices, speeds, mixed_languages)
+    ]
+    try:
+        results = generate_audio_batch(items)
+    except Exception as e:
+        log_exception("Gradioバッチ音声生成エラー")
+        return [[None] * len(items), [f"❌ エラー: {str(e)}"] * len(items)]
+    
+    audios, statuses = [], []
+    for audio_data, success, message in results:
+        audios.append((SAMPLE_RATE, audio_data) if success else None)
+        if success and len(items) > 1:
+            message = f"{message}（{len(items)}件をまとめて生成）"
+        statuses.append(message)
+    return [audios, statuses]
 
 def create_interface():
     """Gradio UIを作成"""
@@ -59,6 +115,11 @@ def create_interface():
                         label="⚡ 速度"
                     )
                 
+                mixed_language_check = gr.Checkbox(
+                    value=False,
+                    label="🌐 多言語混在テキスト（文字種ごとに言語を切り替え）"
+                )
+                
                 generate_btn = gr.Button("🎵 音声生成", variant="primary", size="lg")
                 
                 # 言語別サンプルテキスト
@@ -79,21 +140,35 @@ def create_interface():
                 
                 audio_output = gr.Audio(
                     label="🔊 生成音声",
-                    type="filepath"
+                    type="numpy",
+                    streaming=GRADIO_BATCH_SIZE <= 1,
+                    autoplay=True
                 )
         
-        # イベントハンドラー
-        generate_btn.click(
-            fn=generate_audio,
-            inputs=[text_input, voice_select, speed_slider],
-            outputs=[audio_output, status_output]
-        )
+        # イベントハンドラー（キューの待ち順・予想時間はGradioが表示する）
+        if GRADIO_BATCH_SIZE > 1:
+            generate_btn.click(
+                fn=generate_audio_batch_ui,
+                inputs=[text_input, voice_select, speed_slider, mixed_language_check],
+                outputs=[audio_output, status_output],
+                batch=True,
+                max_batch_size=GRADIO_BATCH_SIZE,
+                show_progress="full"
+            )
+        else:
+            generate_btn.click(
+                fn=generate_audio,
+                inputs=[text_input, voice_select, speed_slider, mixed_language_check],
+                outputs=[audio_output, status_output],
+                show_progress="full"
+            )
         
         # サンプルテキストボタン
         for btn, text in sample_buttons:
             btn.click(
                 fn=lambda t=text: t,
-                outputs=text_input
+                outputs=text_input,
+                queue=False
             )
         
         gr.Markdown("""
@@ -136,10 +211,16 @@ if __name__ == '__main__':
     print("- パイプラインキャッシュ: 有効")
     print(f"- 対応言語: 9言語")
     print(f"- 対応音声: {len(ALL_VOICES)}種類")
+    print(f"- キュー: 同時実行{GRADIO_CONCURRENCY}・最大{GRADIO_QUEUE_SIZE}件待機")
+    print(f"- バッチ: {'最大' + str(GRADIO_BATCH_SIZE) + '件をまとめて合成' if GRADIO_BATCH_SIZE > 1 else '無効（ストリーミング再生）'}")
     print()
     
-    # Gradio UI起動
+    # Gradio UI起動（キュー経由で同時実行数を制限）
     demo = create_interface()
+    demo.queue(
+        default_concurrency_limit=GRADIO_CONCURRENCY,
+        max_size=GRADIO_QUEUE_SIZE
+    )
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
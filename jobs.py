@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+非同期ジョブキュー
+長文の音声合成をSQLiteに永続化したキューで処理する
+
+- POSTでジョブを登録してIDを返し、状態・進捗の確認と結果のダウンロードは別リクエストで行う
+- キューはSQLiteに保存するため、再起動しても未完了のジョブは再実行される
+- ワーカー数は対話リクエストとは別に制限し、対話リクエストで処理枠が埋まっている間は
+  ジョブの合成を一時停止する
+"""
+
+import os
+import re
+import time
+import uuid
+import socket
+import sqlite3
+import ipaddress
+import threading
+from urllib.parse import urlparse
+from contextlib import contextmanager
+import requests
+import soundfile as sf
+from kokoro_core import (
+    generate_audio_stream,
+    get_load_info,
+    increment_metric,
+    observe_latency,
+    SynthesisCancelled,
+    SAMPLE_RATE,
+    CAPACITY
+)
+from overload import overload_controller, LEVEL_SHED_BULK
+
+JOBS_DIR = os.environ.get('KOKORO_JOBS_DIR', 'jobs')
+# ワーカースレッド数（プロセスごと）
+JOB_WORKERS = int(os.environ.get('KOKORO_JOB_WORKERS', '1'))
+JOB_MAX_CHARS = int(os.environ.get('KOKORO_JOB_MAX_CHARS', '100000'))
+# 1回の合成に渡す最大文字数（kokoro_coreの入力上限以下）
+JOB_PIECE_CHARS = 800
+POLL_INTERVAL = 1.0
+# 終了したジョブ（完了・失敗・キャンセル）と音声を保持する時間（時間、0なら削除しない）
+JOB_TTL = float(os.environ.get('KOKORO_JOB_TTL', '24')) * 3600
+# 保持期間を過ぎたジョブを削除する間隔（秒）
+CLEANUP_INTERVAL = 600
+# drain の待機時間を過ぎたジョブを中断させてから終了を待つ最大時間（秒）
+ABORT_WAIT = 10
+CALLBACK_RETRIES = 3
+# コールバックを許可するホスト（カンマ区切り、空なら制限なし）
+CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.environ.get('KOKORO_CALLBACK_ALLOWED_HOSTS', '').split(',')
+                          if host.strip()}
+# プライベート・ループバック等のアドレスへのコールバックを許可（ローカル開発用、既定は拒否）
+CALLBACK_ALLOW_PRIVATE = os.environ.get('KOKORO_CALLBACK_ALLOW_PRIVATE', '0') == '1'
+
+STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    text TEXT NOT NULL,
+    voice TEXT NOT NULL,
+    speed REAL NOT NULL,
+    language TEXT,
+    callback_url TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    duration REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+_PUBLIC_FIELDS = ('id', 'status', 'voice', 'speed', 'language', 'progress', 'error', 'duration',
+                  'created_at', 'started_at', 'finished_at')
+
+# 文末（ラテン文字の句読点は直後に空白がある場合のみ）
+_SENTENCE_PATTERN = re.compile(r'(?<=[。！？\n])|(?<=[.!?])(?=\s)')
+
+def split_job_text(text, max_chars=JOB_PIECE_CHARS):
+    """長文を文単位で詰めて max_chars 以下の断片に分割"""
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_PATTERN.split(text):
+        # 1文が長すぎる場合は空白（なければ文字数）で切る
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if len(current) + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current += sentence
+    if current:
+        pieces.append(current)
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+def validate_callback_url(url):
+    """
+    コールバックURLを検証（問題があればエラーメッセージ）
+
+    サーバーから任意の宛先へリクエストさせないよう、http(s) のみ・許可ホストのみとし、
+    名前解決した結果がプライベート・ループバック等のアドレスなら拒否する
+    """
+    if not isinstance(url, str):
+        return "callback_urlは文字列です"
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return "callback_urlは http(s):// のURLです"
+    host = parsed.hostname.lower()
+    if CALLBACK_ALLOWED_HOSTS and host not in CALLBACK_ALLOWED_HOSTS:
+        return f"callback_urlのホストは許可されていません: {host}"
+    if CALLBACK_ALLOW_PRIVATE:
+        return None
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, ValueError):
+        return f"callback_urlのホストを解決できません: {host}"
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            return f"callback_urlのアドレスは許可されていません: {address}"
+    return None
+
+class JobQueue:
+    """SQLiteに永続化したジョブキュー"""
+
+    def __init__(self, directory=JOBS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'jobs.db')
+        self._workers = []
+        self._stopping = threading.Event()
+        self._abort = threading.Event()
+        self._running = {}  # ジョブID → started_at（実行中の試行）
+        self._next_cleanup = 0.0
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """自動コミットの接続（スレッド・プロセスごとに都度作成）"""
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            yield db
+        finally:
+            db.close()
+
+    def audio_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.wav")
+
+    def submit(self, text, voice='af_heart', speed=1.0, language=None, callback_url=None):
+        """ジョブを登録してIDを返す"""
+        job_id = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, text, voice, speed, language, callback_url, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, text, voice, float(speed), language, callback_url, time.time())
+            )
+        increment_metric('jobs_submitted')
+        return job_id
+
+    def get(self, job_id):
+        """ジョブの状態を取得（存在しなければNone）"""
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {field: row[field] for field in _PUBLIC_FIELDS}
+        if row['status'] == 'queued':
+            with self._connect() as db:
+                job['queue_position'] = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at <= ?",
+                    (row['created_at'],)
+                ).fetchone()[0]
+        return job
+
+    def cancel(self, job_id):
+        """待機中・実行中のジョブをキャンセル"""
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id)
+            )
+        return cursor.rowcount > 0
+
+    def counts(self):
+        """状態ごとのジョブ数"""
+        with self._connect() as db:
+            rows = db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def recover(self):
+        """前回の実行中に停止したジョブを待機状態に戻す"""
+        with self._connect() as db:
+            cursor = db.execute("UPDATE jobs SET status = 'queued', progress = 0 WHERE status = 'running'")
+        if cursor.rowcount:
+            print(f"ジョブ再開: {cursor.rowcount}件を待機状態に戻しました")
+
+    def cleanup(self, ttl=JOB_TTL):
+        """保持期間を過ぎた終了済みのジョブを音声ファイルごと削除（削除した件数を返す）"""
+        if ttl <= 0:
+            return 0
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            job_ids = [row['id'] for row in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?",
+                (time.time() - ttl,)
+            ).fetchall()]
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+            db.execute("COMMIT")
+        for job_id in job_ids:
+            try:
+                os.remove(self.audio_path(job_id))
+            except FileNotFoundError:
+                pass
+        if job_ids:
+            print(f"ジョブ削除: 保持期間を過ぎた{len(job_ids)}件")
+        return len(job_ids)
+
+    def _claim(self):
+        """最も古い待機中ジョブを取得して実行中にする（複数プロセスでも1回だけ取得される）"""
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            started_at = time.time()
+            db.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (started_at, row['id']))
+            db.execute("COMMIT")
+        # started_at で試行を区別する（待機状態に戻して再取得された後の古い試行の更新を無視するため）
+        return {**dict(row), 'status': 'running', 'started_at': started_at}
+
+    def _update(self, row, **values):
+        """実行中の試行のジョブを更新（キャンセル・再取得等で実行中でなくなっていればFalse）"""
+        assignments = ", ".join(f"{key} = ?" for key in values)
+        with self._connect() as db:
+            cursor = db.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status = 'running' AND started_at = ?",
+                (*values.values(), row['id'], row['started_at'])
+            )
+        return cursor.rowcount > 0
+
+    def _complete(self, row, tmp_path, **values):
+        """実行中の試行なら音声を配置して完了にする（判定と配置の間に他の試行が割り込まないよう排他）"""
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            current = db.execute("SELECT status, started_at FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+            if current is None or current['status'] != 'running' or current['started_at'] != row['started_at']:
+                db.execute("COMMIT")
+                return False
+            os.replace(tmp_path, self.audio_path(row['id']))
+            assignments = ", ".join(f"{key} = ?" for key in values)
+            db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*values.values(), row['id']))
+            db.execute("COMMIT")
+        return True
+
+    def _requeue(self, job_id, started_at):
+        """実行中の試行を待機状態に戻し、他のワーカー・プロセスで最初から実行させる"""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', progress = 0 WHERE id = ? AND status = 'running' AND started_at = ?",
+                (job_id, started_at)
+            )
+        print(f"ジョブを待機状態に戻しました: {job_id}")
+
+    def _is_cancelled(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or row['status'] == 'cancelled'
+
+    def _wait_for_interactive(self):
+        """対話リクエストで処理枠が埋まっている間・過負荷で一括処理を止めている間は待機"""
+        while get_load_info()['queue_depth'] >= CAPACITY or overload_controller.at_least(LEVEL_SHED_BULK):
+            if self._abort.is_set():
+                raise SynthesisCancelled('drain')
+            time.sleep(0.1)
+
+    def _run(self, row):
+        job_id = row['id']
+        pieces = split_job_text(row['text'])
+        total_chars = sum(len(piece) for piece in pieces) or 1
+        done_chars = 0
+        samples = 0
+        start = time.time()
+        # 試行ごとに別の一時ファイルにする（中断した試行と次の試行が同じファイルに書かないように）
+        tmp_path = f"{self.audio_path(job_id)}.{uuid.uuid4().hex[:8]}.tmp"
+        print(f"ジョブ開始: {job_id} ({len(row['text'])}文字, {len(pieces)}断片)")
+        try:
+            # 音声はメモリに溜めずに断片ごとにファイルへ書き出す
+            with sf.SoundFile(tmp_path, 'w', samplerate=SAMPLE_RATE, channels=1, format='WAV') as output:
+                for piece in pieces:
+                    self._wait_for_interactive()
+                    stream = generate_audio_stream(
+                        piece, row['voice'], row['speed'], row['language'],
+                        should_cancel=lambda: self._abort.is_set() or self._is_cancelled(job_id)
+                    )
+                    for chunk in stream:
+                        output.write(chunk)
+                        samples += len(chunk)
+                    done_chars += len(piece)
+                    self._update(row, progress=round(done_chars / total_chars, 3))
+        except SynthesisCancelled:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self._abort.is_set():
+                self._requeue(job_id, row['started_at'])
+                return
+            print(f"ジョブキャンセル: {job_id}")
+            increment_metric('jobs_cancelled')
+            return
+        except Exception as e:
+            print(f"ジョブ失敗: {job_id}: {e}")
+            increment_metric('jobs_failed')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self._update(row, status='failed', error=str(e), finished_at=time.time()):
+                self._notify(job_id, row['callback_url'])
+            return
+
+        # 最後の断片の後に届いたキャンセル・再取得を完了で上書きしない
+        if not self._complete(row, tmp_path, status='done', progress=1.0, duration=round(samples / SAMPLE_RATE, 2),
+                              finished_at=time.time()):
+            print(f"ジョブキャンセル: {job_id}")
+            increment_metric('jobs_cancelled')
+            os.remove(tmp_path)
+            return
+        observe_latency('job', time.time() - start)
+        increment_metric('jobs_done')
+        print(f"ジョブ完了: {job_id} ({samples / SAMPLE_RATE:.1f}秒, {time.time() - start:.1f}秒で合成)")
+        self._notify(job_id, row['callback_url'])
+
+    def _notify(self, job_id, callback_url):
+        """完了・失敗をコールバックURLに通知"""
+        if not callback_url:
+            return
+        # 登録後に名前解決の結果が変わっている場合もあるため送信前にも検証する
+        error = validate_callback_url(callback_url)
+        if error:
+            print(f"⚠️  コールバックを送信しません: {error}")
+            return
+        payload = self.get(job_id)
+        for attempt in range(CALLBACK_RETRIES):
+            try:
+                requests.post(callback_url, json=payload, timeout=10, allow_redirects=False).raise_for_status()
+                return
+            except Exception as e:
+                print(f"⚠️  コールバック失敗 ({attempt + 1}/{CALLBACK_RETRIES}): {callback_url}: {e}")
+                time.sleep(2 ** attempt)
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            # 他のプロセス・スレッドと重なっても削除済みの行・ファイルは無視される
+            if time.time() >= self._next_cleanup:
+                self._next_cleanup = time.time() + CLEANUP_INTERVAL
+                try:
+                    self.cleanup()
+                except sqlite3.Error as e:
+                    print(f"⚠️  ジョブ削除エラー: {e}")
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"⚠️  ジョブ取得エラー: {e}")
+                row = None
+            if row is None:
+                self._stopping.wait(POLL_INTERVAL)
+                continue
+            self._running[row['id']] = row['started_at']
+            try:
+                self._run(row)
+            finally:
+                self._running.pop(row['id'], None)
+
+    def start(self, workers=JOB_WORKERS, recover=True):
+        """
+        ワーカースレッドを起動（fork後のプロセスで呼ぶ）
+
+        複数プロセスで共有する場合は recover=False にし、起動時の回復は親で1回だけ行う
+        （他のプロセスで実行中のジョブを待機状態に戻さないため）
+        """
+        if self._workers:
+            return
+        if recover:
+            self.recover()
+        for _ in range(workers):
+            worker = threading.Thread(target=self._worker_loop, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        print(f"ジョブワーカー起動: {workers}スレッド ({self.db_path})")
+
+    def drain(self, timeout):
+        """
+        新しいジョブの取得をやめ、実行中のジョブの完了を待つ
+
+        timeout 秒以内に終わらなかったジョブは中断して待機状態に戻し、他のプロセスで最初から実行させる
+
+        Returns:
+            bool: 実行中のジョブがすべて完了した場合True
+        """
+        self._stopping.set()
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.time()))
+        if not self._running:
+            return True
+        # 中断させて（合成は次のセグメントの前に止まる）ワーカー自身に待機状態へ戻させる
+        self._abort.set()
+        deadline = time.time() + ABORT_WAIT
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.time()))
+        # それでも止まらない試行は待機状態に戻す（以降の更新・完了は started_at が違うため無視される）
+        for job_id, started_at in list(self._running.items()):
+            self._requeue(job_id, started_at)
+        return False
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """ジョブキューを取得（初回アクセス時に作成）"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
@@ -5,12 +5,57 @@ Kokoro-82M TTS コア機能
 """
 
 import os
+import re
 import gc
+import json
+import time
+import queue
 import threading
 import multiprocessing
 import tempfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 import soundfile as sf
+from memory_guard import (
+    MemoryTracker,
+    admission_guard,
+    estimate_request_mb,
+    get_rss_mb,
+    REJECTED_MESSAGE as MEMORY_REJECTED_MESSAGE
+)
+from phrase_bank import lookup_phrase, phrase_bank
+from voices import (
+    LANGUAGES,
+    VOICES,
+    ALL_VOICES,
+    VOICES_DIR,
+    detect_language,
+    get_saved_voices,
+    is_voice_blend,
+    normalize_voice,
+    parse_voice_blend,
+    primary_voice,
+    validate_voice
+)
+import request_log
+from request_log import log_exception
+from speed_variants import (
+    rendition_cache,
+    time_stretch,
+    SPEED_VARIANTS,
+    STRETCH_MIN_QUALITY
+)
+from overload import (
+    overload_controller,
+    resample,
+    DEGRADED_FIRST_SEGMENT_MAX_CHARS,
+    DEGRADED_SAMPLE_RATE,
+    LEVEL_SHORT_FIRST,
+    LEVEL_FAST_BACKEND,
+    LEVEL_LOW_SAMPLE_RATE
+)
 
 # CPUコア数を自動検出して最大活用
 cpu_count = multiprocessing.cpu_count()
@@ -57,68 +102,34 @@ def setup_mecab_environment():
 setup_mecab_environment()
 
 try:
-    from kokoro import KPipeline
+    import torch
+    from kokoro import KPipeline, KModel
 except ImportError:
     print("kokoroライブラリが必要です。pip install kokoro>=0.9.4")
     exit(1)
 
+# モデル設定
+REPO_ID = 'hexgrad/Kokoro-82M'
+SAMPLE_RATE = 24000
+# チェックポイントをmmapで読み込み、重みをページキャッシュ上で共有する
+MMAP_WEIGHTS = os.environ.get('KOKORO_MMAP_WEIGHTS', '1') != '0'
+
+# 全言語で共有するモデル
+_model = None
+_model_lock = threading.Lock()
+
 # 言語別パイプラインキャッシュ
 _pipelines = {}
 _pipeline_lock = threading.Lock()
 
-# 言語と音声の定義
-LANGUAGES = {
-    'a': 'American English',
-    'b': 'British English', 
-    'j': 'Japanese',
-    'z': 'Mandarin Chinese',
-    'e': 'Spanish',
-    'f': 'French',
-    'h': 'Hindi',
-    'i': 'Italian',
-    'p': 'Brazilian Portuguese'
-}
-
-VOICES = {
-    "🇺🇸 American English": [
-        'af_heart', 'af_alloy', 'af_aoede', 'af_bella', 'af_jessica', 'af_kore', 
-        'af_nicole', 'af_nova', 'af_river', 'af_sarah', 'af_sky',
-        'am_adam', 'am_echo', 'am_eric', 'am_fenrir', 'am_liam', 
-        'am_michael', 'am_onyx', 'am_puck', 'am_santa'
-    ],
-    "🇬🇧 British English": [
-        'bf_alice', 'bf_emma', 'bf_isabella', 'bf_lily',
-        'bm_daniel', 'bm_fable', 'bm_george', 'bm_lewis'
-    ],
-    "🇯🇵 Japanese": [
-        'jf_alpha', 'jf_gongitsune', 'jf_nezumi', 'jf_tebukuro',
-        'jm_kumo'
-    ],
-    "🇨🇳 Mandarin Chinese": [
-        'zf_xiaobei', 'zf_xiaoni', 'zf_xiaoxiao', 'zf_xiaoyi',
-        'zm_yunjian', 'zm_yunxi', 'zm_yunxia', 'zm_yunyang'
-    ],
-    "🇪🇸 Spanish": [
-        'ef_dora', 'em_alex', 'em_santa'
-    ],
-    "🇫🇷 French": [
-        'ff_siwis'
-    ],
-    "🇮🇳 Hindi": [
-        'hf_alpha', 'hf_beta', 'hm_omega', 'hm_psi'
-    ],
-    "🇮🇹 Italian": [
-        'if_sara', 'im_nicola'
-    ],
-    "🇧🇷 Brazilian Portuguese": [
-        'pf_dora', 'pm_alex', 'pm_santa'
-    ]
-}
+# 同時に処理できるリクエスト数（推定待ち時間の計算に使用）
+CAPACITY = int(os.environ.get('KOKORO_CAPACITY', str(cpu_count)))
 
-# フラットな音声リスト
-ALL_VOICES = []
-for voice_list in VOICES.values():
-    ALL_VOICES.extend(voice_list)
+# メトリクス（カウンターとレイテンシ履歴）
+_counters = {}
+_latencies = {}
+_metrics_lock = threading.Lock()
+LATENCY_WINDOW = 1000
 
 # 多言語サンプルテキスト
 SAMPLE_TEXTS = {
@@ -165,28 +176,71 @@ SAMPLE_TEXTS = {
     ]
 }
 
-def detect_language(text, voice):
-    """テキストと音声から言語を自動検出"""
-    # 音声名のプレフィックスから言語を検出
-    voice_prefix = voice.split('_')[0]
-    if voice_prefix.startswith('j'):
-        return 'j'  # Japanese
-    elif voice_prefix.startswith('z'):
-        return 'z'  # Mandarin Chinese
-    elif voice_prefix.startswith('b'):
-        return 'b'  # British English
-    elif voice_prefix.startswith('e'):
-        return 'e'  # Spanish
-    elif voice_prefix.startswith('f'):
-        return 'f'  # French
-    elif voice_prefix.startswith('h'):
-        return 'h'  # Hindi
-    elif voice_prefix.startswith('i'):
-        return 'i'  # Italian
-    elif voice_prefix.startswith('p'):
-        return 'p'  # Brazilian Portuguese
-    else:
-        return 'a'  # American English (default)
+def _remap_weights(model):
+    """
+    チェックポイントをmmapで読み直し、パラメータをファイルのページに差し替える
+    
+    ヒープ上の重みを解放し、同じチェックポイントを読む全プロセスで
+    ページキャッシュを共有できるようにする
+    """
+    from huggingface_hub import hf_hub_download
+    checkpoint = hf_hub_download(repo_id=REPO_ID, filename=KModel.MODEL_NAMES[REPO_ID])
+    state = torch.load(checkpoint, map_location='cpu', weights_only=True, mmap=True)
+    for key, state_dict in state.items():
+        module = getattr(model, key)
+        try:
+            module.load_state_dict(state_dict, assign=True)
+        except Exception:
+            # KModelと同様に "module." プレフィックスを除去して再試行
+            state_dict = {k[7:]: v for k, v in state_dict.items()}
+            module.load_state_dict(state_dict, strict=False, assign=True)
+
+def get_model():
+    """全言語パイプラインで共有するモデルを取得"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+                print(f"Kokoroモデル読み込み中... (デバイス: {device})")
+                model = KModel(repo_id=REPO_ID)
+                if MMAP_WEIGHTS and device == 'cpu':
+                    try:
+                        _remap_weights(model)
+                        print("モデル重み: mmap共有")
+                    except Exception as e:
+                        print(f"⚠️  mmap読み込みに失敗、通常読み込みを使用: {e}")
+                _model = model.to(device).eval()
+    return _model
+
+# 過負荷時に使う高速バックエンド（'quantized': 線形層・LSTMをint8に動的量子化したモデル）
+# 量子化しない層は複製されるため、mmap共有分とは別にメモリを使う
+FAST_BACKEND = os.environ.get('KOKORO_FAST_BACKEND', '')
+_fast_model = None
+
+def get_fast_model():
+    """高速バックエンドのモデルを取得（未設定・CPU以外ではNone）"""
+    global _fast_model
+    if FAST_BACKEND != 'quantized':
+        return None
+    if _fast_model is None:
+        model = get_model()
+        with _model_lock:
+            if _fast_model is None and model.device.type == 'cpu':
+                print("高速バックエンド作成中... (int8動的量子化)")
+                _fast_model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8
+                ).eval()
+    return _fast_model
+
+if not FAST_BACKEND:
+    overload_controller.skip(LEVEL_FAST_BACKEND)
+
+def _synthesis_model():
+    """合成に使うモデル（過負荷時は高速バックエンド、Noneはパイプライン既定のモデル）"""
+    if FAST_BACKEND and overload_controller.at_least(LEVEL_FAST_BACKEND):
+        return get_fast_model()
+    return None
 
 def get_pipeline(lang_code='a'):
     """言語別パイプラインをキャッシュして再利用"""
@@ -195,126 +249,884 @@ def get_pipeline(lang_code='a'):
         with _pipeline_lock:
             if lang_code not in _pipelines:
                 print(f"Kokoroパイプライン初期化中... (言語: {lang_code})")
-                _pipelines[lang_code] = KPipeline(lang_code=lang_code)
+                pipeline = KPipeline(lang_code=lang_code, repo_id=REPO_ID, model=get_model())
+                if lang_code == 'j':
+                    # 共有されるTaggerをスレッドごとに使い分けるプールに差し替える
+                    pipeline.g2p = TaggerPool(pipeline.g2p)
+                _pipelines[lang_code] = pipeline
                 print(f"言語 {lang_code} の初期化完了")
     return _pipelines[lang_code]
 
-def generate_audio_data(text, voice="af_heart", speed=1.0, language=None):
+# 日本語G2P（MeCab/fugashi Tagger）のプールサイズ（ウォームアップ時に作成する数）
+TAGGER_POOL_SIZE = int(os.environ.get('KOKORO_TAGGER_POOL_SIZE', str(cpu_count)))
+# 日本語の長文を1回の解析パスで音素化する（0で無効、kokoroの文ごとの処理を使う）
+JA_BATCH_ANALYSIS = os.environ.get('KOKORO_JA_BATCH_ANALYSIS', '1') != '0'
+# モデルに1回で渡せる音素数の上限
+MAX_PHONEMES = 510
+
+class TaggerPool:
+    """
+    日本語G2P（misaki JAG2P）のプール
+    
+    KPipelineは1つのG2P（内部に1つのfugashi Tagger）を全スレッドで共有するが、
+    Taggerはスレッドセーフではない。呼び出しごとにプールから専用のインスタンスを貸し出し、
+    足りなければ追加で作成する（辞書の読み込みを伴うため、通常はウォームアップで作っておく）。
+    """
+    
+    def __init__(self, base):
+        self._base = base
+        self._idle = [base]
+        self._lock = threading.Lock()
+        self.created = 1
+    
+    def _create(self):
+        g2p = type(self._base)(version=getattr(self._base, 'version', 'cutlet'),
+                               unk=getattr(self._base, 'unk', '❓'))
+        with self._lock:
+            self.created += 1
+        return g2p
+    
+    def fill(self, size):
+        """Taggerを size 個まで事前に作成"""
+        while self.created < size:
+            g2p = self._create()
+            with self._lock:
+                self._idle.append(g2p)
+    
+    @contextmanager
+    def checkout(self):
+        """G2Pを1つ借りる（返却するまで他のスレッドは使わない）"""
+        with self._lock:
+            g2p = self._idle.pop() if self._idle else None
+        if g2p is None:
+            increment_metric('tagger_pool_misses')
+            g2p = self._create()
+        try:
+            yield g2p
+        finally:
+            with self._lock:
+                self._idle.append(g2p)
+    
+    def __call__(self, text):
+        with self.checkout() as g2p:
+            return g2p(text)
+    
+    def get_status(self):
+        with self._lock:
+            return {"size": self.created, "idle": len(self._idle)}
+
+def get_tagger_pool():
+    """日本語パイプラインのTaggerプール（未初期化ならNone）"""
+    pipeline = _pipelines.get('j')
+    g2p = getattr(pipeline, 'g2p', None)
+    return g2p if isinstance(g2p, TaggerPool) else None
+
+def split_phonemes(phonemes, max_len=MAX_PHONEMES, separators=(r'(?<=[.!?…])\s*', r'(?<=[,;:])\s*', r'\s+')):
+    """音素列を文末（長すぎる文は読点・空白）で区切り、max_len 以下に詰める"""
+    if len(phonemes) <= max_len:
+        return [phonemes] if phonemes.strip() else []
+    if not separators:
+        return [phonemes[i:i + max_len] for i in range(0, len(phonemes), max_len)]
+    chunks = []
+    current = ""
+    for part in re.split(separators[0], phonemes):
+        if not part:
+            continue
+        if len(part) > max_len:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(split_phonemes(part, max_len, separators[1:]))
+            continue
+        candidate = f"{current} {part}" if current else part
+        if len(candidate) > max_len:
+            chunks.append(current)
+            current = part
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _iter_japanese_results(pipeline, text, voice, speed, model=None):
+    """
+    日本語テキストを1回の解析パスで音素化してから合成
+    
+    文・チャンクごとにG2Pを呼ぶ代わりに、プールから借りた1つのTaggerで全行をまとめて解析し、
+    音素列を MAX_PHONEMES 以下に詰めて generate_from_tokens に渡す
+    （kokoroの既定処理のように長い文の音素を切り捨てない）
+    """
+    pieces = text if isinstance(text, list) else [text]
+    lines = [line for piece in pieces for line in re.split(r'\n+', piece) if line.strip()]
+    with pipeline.g2p.checkout() as g2p:
+        phonemes = [g2p(line)[0] for line in lines]
+    for line_phonemes in phonemes:
+        for chunk in split_phonemes(line_phonemes):
+            yield from pipeline.generate_from_tokens(chunk, voice=voice, speed=speed, model=model)
+
+# ブレンド音声（"af_heart:0.7,af_bella:0.3" のような重み付き混合）
+VOICE_BLEND_CACHE_SIZE = int(os.environ.get('KOKORO_VOICE_BLEND_CACHE', '32'))
+_VOICE_NAME_PATTERN = re.compile(r'^[a-z0-9_]{1,64}$')
+
+# 正規化した式（保存済み音声は 名前=式）→ 合成済みスタイルテンソル
+_blend_cache = OrderedDict()
+_blend_lock = threading.Lock()
+
+def _compute_blend(components):
+    """各音声パックを重み付きで合成（音声パックはパイプラインがキャッシュ済み）"""
+    pipeline = get_pipeline(detect_language('', components[0][0]))
+    return sum(pipeline.load_single_voice(name) * weight for name, weight in components)
+
+def resolve_voice(voice):
+    """
+    パイプラインに渡す音声を取得
+
+    単一音声は名前のまま（kokoroが音声パックをキャッシュする）、
+    ブレンド音声・保存済み音声は合成済みスタイルテンソルをLRUキャッシュから返す
+    """
+    saved = get_saved_voices().get(voice)
+    if saved is not None:
+        key = f"{voice}={saved}"
+    elif is_voice_blend(voice):
+        key = normalize_voice(voice)
+        if not is_voice_blend(key):
+            return key
+    else:
+        return voice
+
+    with _blend_lock:
+        pack = _blend_cache.get(key)
+        if pack is not None:
+            _blend_cache.move_to_end(key)
+    if pack is not None:
+        increment_metric('voice_blend_hits')
+        return pack
+
+    if saved is not None:
+        pack = torch.load(os.path.join(VOICES_DIR, f"{voice}.pt"), map_location='cpu', weights_only=True)
+    else:
+        pack = _compute_blend(parse_voice_blend(key))
+    increment_metric('voice_blend_computed')
+    with _blend_lock:
+        _blend_cache[key] = pack
+        _blend_cache.move_to_end(key)
+        while len(_blend_cache) > VOICE_BLEND_CACHE_SIZE:
+            _blend_cache.popitem(last=False)
+    return pack
+
+def save_voice(name, expression):
+    """
+    ブレンド音声に名前を付けて保存
+
+    スタイルテンソルを VOICES_DIR/<name>.pt に保存し、以降は name を音声として指定できる
+    （.pt はkokoroの KPipeline.load_voice にもそのまま渡せる）
+
+    Returns:
+        tuple: (file_path: str, success: bool, message: str)
+    """
+    if not isinstance(name, str) or not _VOICE_NAME_PATTERN.match(name):
+        return None, False, "❌ 音声名は英小文字・数字・_ の64文字以内です"
+    if name in ALL_VOICES:
+        return None, False, f"❌ 標準音声と同じ名前は使えません: {name}"
+    error = validate_voice(expression)
+    if error:
+        return None, False, error
+    if not is_voice_blend(normalize_voice(expression)):
+        return None, False, "❌ 2つ以上の音声を混合してください"
+
+    try:
+        normalized = normalize_voice(expression)
+        pack = _compute_blend(parse_voice_blend(normalized))
+        os.makedirs(VOICES_DIR, exist_ok=True)
+        path = os.path.join(VOICES_DIR, f"{name}.pt")
+        torch.save(pack, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+        # 一覧は一時ファイル経由で置き換え、読み込み中のプロセスが途中の内容を見ないようにする
+        with _blend_lock:
+            saved = dict(get_saved_voices())
+            saved[name] = normalized
+            manifest = os.path.join(VOICES_DIR, 'blends.json')
+            with open(manifest + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(saved, f, ensure_ascii=False, indent=2)
+            os.replace(manifest + '.tmp', manifest)
+        print(f"ブレンド音声を保存: {name} = {normalized}")
+        return path, True, f"✅ 音声 {name} を保存しました"
+    except Exception as e:
+        print(f"ブレンド音声保存エラー: {str(e)}")
+        return None, False, f"❌ ブレンド音声保存エラー: {str(e)}"
+
+# ウォームアップ用の短文
+WARMUP_TEXTS = {
+    'a': "Hello.",
+    'b': "Hello.",
+    'j': "こんにちは。",
+    'z': "你好。",
+    'e': "Hola.",
+    'f': "Bonjour.",
+    'h': "नमस्ते।",
+    'i': "Ciao.",
+    'p': "Olá."
+}
+
+def warm_up(languages=('a',), voices=None):
+    """
+    パイプラインと音声パックを事前に読み込む
+    
+    Args:
+        languages (iterable): 初期化する言語コード
+        voices (iterable): 読み込む音声（Noneの場合は各言語の全音声）
+    """
+    for lang_code in languages:
+        pipeline = get_pipeline(lang_code)
+        if voices is None:
+            lang_voices = [v for v in ALL_VOICES if detect_language('', v) == lang_code]
+        else:
+            lang_voices = [v for v in voices if detect_language('', v) == lang_code]
+        for voice in lang_voices:
+            # ブレンド音声はresolve_voiceで合成済みテンソルをキャッシュする
+            pack = resolve_voice(voice)
+            if isinstance(pack, str):
+                pipeline.load_voice(pack)
+        # 日本語はスレッド数分のTaggerを作っておき、リクエスト中に辞書を読み込まない
+        if isinstance(pipeline.g2p, TaggerPool):
+            pipeline.g2p.fill(TAGGER_POOL_SIZE)
+            print(f"MeCab Taggerプール: {pipeline.g2p.created}個")
+        # 過負荷になってから量子化しないように事前に作成する
+        if FAST_BACKEND:
+            get_fast_model()
+        # 初回推論で遅延初期化されるG2P辞書等を読み込む
+        if lang_voices:
+            for _ in pipeline(WARMUP_TEXTS.get(lang_code, "Hello."), voice=resolve_voice(lang_voices[0])):
+                pass
+        print(f"言語 {lang_code} のウォームアップ完了 (音声: {len(lang_voices)})")
+
+def increment_metric(name, value=1):
+    """カウンターを加算"""
+    with _metrics_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def observe_latency(name, seconds):
+    """レイテンシを記録（直近LATENCY_WINDOW件を保持）"""
+    with _metrics_lock:
+        if name not in _latencies:
+            _latencies[name] = deque(maxlen=LATENCY_WINDOW)
+        _latencies[name].append(seconds)
+
+def get_metrics():
+    """カウンターとレイテンシ統計（ミリ秒）を取得"""
+    with _metrics_lock:
+        counters = dict(_counters)
+        samples = {name: np.array(values) for name, values in _latencies.items() if values}
+    latencies = {}
+    for name, values in samples.items():
+        latencies[name] = {
+            "count": int(values.size),
+            "avg_ms": round(float(values.mean()) * 1000, 1),
+            "p50_ms": round(float(np.percentile(values, 50)) * 1000, 1),
+            "p95_ms": round(float(np.percentile(values, 95)) * 1000, 1)
+        }
+    return {"counters": counters, "latencies": latencies, "overload": overload_controller.get_status()}
+
+def to_pcm16(audio_data):
+    """float32音声を16bitリトルエンディアンPCMのバイト列に変換"""
+    return (np.clip(audio_data, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+# 文・節の区切り文字
+SENTENCE_END_CJK = '。！？\n'
+SENTENCE_END_LATIN = '.!?'
+CLAUSE_END_CJK = '、，；：'
+CLAUSE_END_LATIN = ',;:'
+
+class IncrementalSegmenter:
+    """
+    逐次入力されるテキストから文・節の区切りを検出する
+    
+    LLMのトークンストリームなどを feed() で受け取り、確定した区切りから
+    順に合成用セグメントを返す。ラテン文字の句読点は直後の空白を確認
+    してから区切るため、"3.14" のような途中の記号では分割しない。
+    """
+    
+    def __init__(self, min_clause_chars=40, max_chars=300):
+        """
+        Args:
+            min_clause_chars (int): 節区切り（読点など）で分割する最小文字数
+            max_chars (int): 区切りがなくても強制的に分割する文字数
+        """
+        self.min_clause_chars = min_clause_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+    
+    def feed(self, delta):
+        """テキスト差分を追加し、確定したセグメントのリストを返す"""
+        self._buffer += delta
+        segments = []
+        while True:
+            cut = self._find_boundary()
+            if cut is None:
+                break
+            segment = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+        return segments
+    
+    def flush(self):
+        """残りのテキストをすべてセグメントとして返す"""
+        segment = self._buffer.strip()
+        self._buffer = ""
+        return [segment] if segment else []
+    
+    def reset(self):
+        """バッファを破棄"""
+        self._buffer = ""
+    
+    def _find_boundary(self):
+        buf = self._buffer
+        length = len(buf)
+        for i, ch in enumerate(buf):
+            if ch in SENTENCE_END_CJK:
+                return i + 1
+            if ch in SENTENCE_END_LATIN or ch in CLAUSE_END_LATIN:
+                # 次の文字が来るまで確定しない
+                if i + 1 >= length:
+                    break
+                if not buf[i + 1].isspace():
+                    continue
+                if ch in SENTENCE_END_LATIN or i + 1 >= self.min_clause_chars:
+                    return i + 1
+            elif ch in CLAUSE_END_CJK and i + 1 >= self.min_clause_chars:
+                return i + 1
+        
+        if length >= self.max_chars:
+            # 区切りがない長文は最後の空白で分割
+            space = buf.rfind(' ', 0, self.max_chars)
+            return space + 1 if space > 0 else self.max_chars
+        return None
+
+def validate_text(text):
+    """入力テキストを検証し、問題があればエラーメッセージを返す"""
+    if not text.strip():
+        return "テキストを入力してください"
+    if len(text) > 1000:
+        return "テキストが長すぎます（1000文字以下）"
+    return None
+
+def _chunk_to_numpy(chunk):
+    """パイプライン出力チャンクを1次元のnumpy配列に変換"""
+    # KPipeline.Resultオブジェクトから音声データを取得
+    if hasattr(chunk, 'audio'):
+        audio_data_chunk = chunk.audio
+    elif hasattr(chunk, 'data'):
+        audio_data_chunk = chunk.data
+    else:
+        audio_data_chunk = chunk
+    
+    if audio_data_chunk is None:
+        return None
+    
+    # テンソルの場合はnumpy配列に変換
+    if hasattr(audio_data_chunk, 'detach'):
+        audio_data_chunk = audio_data_chunk.detach().cpu().numpy()
+    elif hasattr(audio_data_chunk, 'numpy'):
+        audio_data_chunk = audio_data_chunk.numpy()
+    
+    return audio_data_chunk
+
+# 文字種（Unicodeブロック）の分類
+SCRIPT_NEUTRAL = 0      # 空白・数字・記号
+SCRIPT_LATIN = 1
+SCRIPT_KANA = 2
+SCRIPT_HAN = 3
+SCRIPT_CJK_PUNCT = 4    # 全角句読点・記号
+SCRIPT_DEVANAGARI = 5
+
+_SCRIPT_RANGES = [
+    (0x0041, 0x005A, SCRIPT_LATIN),
+    (0x0061, 0x007A, SCRIPT_LATIN),
+    (0x00C0, 0x024F, SCRIPT_LATIN),
+    (0x0900, 0x097F, SCRIPT_DEVANAGARI),
+    (0x3000, 0x303F, SCRIPT_CJK_PUNCT),
+    (0x3040, 0x30FF, SCRIPT_KANA),
+    (0x31F0, 0x31FF, SCRIPT_KANA),
+    (0x3400, 0x4DBF, SCRIPT_HAN),
+    (0x4E00, 0x9FFF, SCRIPT_HAN),
+    (0xF900, 0xFAFF, SCRIPT_HAN),
+    (0xFF00, 0xFF65, SCRIPT_CJK_PUNCT),
+    (0xFF66, 0xFF9F, SCRIPT_KANA),
+]
+
+# 分割後のセグメントを言語別に並列合成するスレッドプール
+MIXED_LANGUAGE_WORKERS = int(os.environ.get('KOKORO_MIXED_LANGUAGE_WORKERS', '4'))
+_segment_executor = ThreadPoolExecutor(max_workers=MIXED_LANGUAGE_WORKERS)
+
+def _script_language_table(lang_code, has_kana):
+    """文字種 → 言語コードの対応表（Noneは前後に合わせる）"""
+    latin = lang_code if lang_code in 'abefip' else 'a'
+    if lang_code in 'jz':
+        han = lang_code
+    else:
+        # 仮名を含む文の漢字は日本語、それ以外は中国語として扱う
+        han = 'j' if has_kana else 'z'
+    return {
+        SCRIPT_NEUTRAL: None,
+        SCRIPT_LATIN: latin,
+        SCRIPT_KANA: 'j' if lang_code != 'z' else 'z',
+        SCRIPT_HAN: han,
+        SCRIPT_CJK_PUNCT: lang_code if lang_code in 'jz' else None,
+        SCRIPT_DEVANAGARI: 'h',
+    }
+
+def split_by_script(text, lang_code, min_chars=2):
+    """
+    文字種の連続区間でテキストを言語別セグメントに分割する
+    
+    コードポイント配列に対してUnicodeブロック判定をベクトル化して行い、
+    空白・数字・記号は直前の区間に含める。
+    
+    Args:
+        text (str): 分割するテキスト
+        lang_code (str): 基本の言語コード（音声から検出したもの）
+        min_chars (int): これより短い区間は直前のセグメントに結合
+    
+    Returns:
+        list: [(lang_code, segment_text), ...]
+    """
+    if not text:
+        return []
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    scripts = np.full(codepoints.shape, SCRIPT_NEUTRAL, dtype=np.int8)
+    for low, high, script in _SCRIPT_RANGES:
+        scripts[(codepoints >= low) & (codepoints <= high)] = script
+    
+    table = _script_language_table(lang_code, bool((scripts == SCRIPT_KANA).any()))
+    lang_order = list(LANGUAGES)
+    lookup = np.full(max(table) + 1, -1, dtype=np.int8)
+    for script, lang in table.items():
+        if lang is not None:
+            lookup[script] = lang_order.index(lang)
+    langs = lookup[scripts]
+    
+    # 言語未定の文字は直前の言語で埋める（先頭は最初に確定した言語）
+    known = langs >= 0
+    if not known.any():
+        return [(lang_code, text)]
+    positions = np.where(known, np.arange(langs.size), 0)
+    np.maximum.accumulate(positions, out=positions)
+    langs = langs[positions]
+    langs[:np.argmax(known)] = langs[np.argmax(known)]
+    
+    boundaries = np.flatnonzero(np.diff(langs)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [langs.size]))
+    
+    segments = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        segment = text[start:end]
+        lang = lang_order[langs[start]]
+        if segments and (segments[-1][0] == lang or len(segment.strip()) < min_chars):
+            segments[-1] = (segments[-1][0], segments[-1][1] + segment)
+        else:
+            segments.append((lang, segment))
+    return segments
+
+# 最初のセグメントの分割方針
+#   default:      パイプライン既定の分割（改行単位）
+#   first_clause: 最初の節だけを短く切り出し、残りは既定の分割
+#   adaptive:     最初の節を短く切り出し、以降のセグメントを徐々に大きくする
+FIRST_SEGMENT_POLICIES = ('default', 'first_clause', 'adaptive')
+FIRST_SEGMENT_POLICY = os.environ.get('KOKORO_FIRST_SEGMENT', 'default')
+FIRST_SEGMENT_MAX_CHARS = int(os.environ.get('KOKORO_FIRST_SEGMENT_MAX_CHARS', '60'))
+SEGMENT_GROWTH = 2.0
+SEGMENT_MAX_CHARS = 400
+
+# 節・文の区切り（ラテン文字の句読点は直後に空白がある場合のみ）
+_UNIT_PATTERN = re.compile(r'(?<=[。！？、，；：\n])|(?<=[.!?,;:])(?=\s)')
+
+def _cut_first_segment(unit, max_chars):
+    """最初の節が長すぎる場合は空白（なければ文字数）で切る"""
+    if len(unit) <= max_chars:
+        return unit, ""
+    space = unit.rfind(' ', 0, max_chars)
+    cut = space if space > 0 else max_chars
+    return unit[:cut].strip(), unit[cut:].strip()
+
+def plan_segments(text, policy='default', first_max_chars=FIRST_SEGMENT_MAX_CHARS):
+    """
+    最初の音声を早く返すためにテキストを合成単位に分割する
+    
+    Args:
+        text (str): 分割するテキスト
+        policy (str): FIRST_SEGMENT_POLICIES のいずれか
+        first_max_chars (int): 最初のセグメントの最大文字数
+    
+    Returns:
+        list: セグメントのリスト（defaultの場合はNone）
+    """
+    if policy not in FIRST_SEGMENT_POLICIES:
+        raise ValueError(f"不明な分割方針: {policy}")
+    if policy == 'default':
+        return None
+    
+    units = [unit.strip() for unit in _UNIT_PATTERN.split(text) if unit.strip()]
+    if not units:
+        return None
+    first, remainder = _cut_first_segment(units[0], first_max_chars)
+    rest = ([remainder] if remainder else []) + units[1:]
+    # 日中文は区切りを詰めて連結、それ以外は空白で連結
+    joiner = "" if re.search(r'[\u3000-\u9fff]', text) else " "
+    if policy == 'first_clause':
+        rest_text = joiner.join(rest)
+        return [first] + ([rest_text] if rest_text else [])
+    
+    # adaptive: 以降のセグメントは目標サイズを倍々に増やしながら節を詰める
+    segments = [first]
+    target = first_max_chars * SEGMENT_GROWTH
+    current = ""
+    for unit in rest:
+        candidate = f"{current}{joiner}{unit}" if current else unit
+        if current and len(candidate) > target:
+            segments.append(current)
+            target = min(target * SEGMENT_GROWTH, SEGMENT_MAX_CHARS)
+            current = unit
+        else:
+            current = candidate
+    if current:
+        segments.append(current)
+    return segments
+
+def _iter_pipeline_audio(lang_code, text, voice, speed, model=None):
+    """
+    指定言語のパイプラインで合成し、1次元の音声チャンクを順に返す
+    
+    text にリストを渡した場合は各要素を1つの合成単位として扱う。
+    model は高速バックエンド（Noneはパイプライン既定のモデル）
+    """
+    pipeline = get_pipeline(lang_code)
+    if lang_code == 'j' and JA_BATCH_ANALYSIS:
+        results = _iter_japanese_results(pipeline, text, voice, speed, model)
+    else:
+        results = pipeline(text, voice=voice, speed=speed, model=model)
+    for chunk in results:
+        if chunk is None:
+            continue
+        audio_data_chunk = _chunk_to_numpy(chunk)
+        if audio_data_chunk is None:
+            continue
+        yield np.asarray(audio_data_chunk, dtype=np.float32).reshape(-1)
+
+def _synthesize_language_segments(lang_code, segments, futures, voice, speed, cancelled, model=None):
+    """同一言語のセグメントを順番に合成し、結果を各Futureに設定"""
+    for index, text in segments:
+        # 呼び出し側が中断した場合は残りのセグメントを合成しない
+        if cancelled.is_set():
+            return
+        try:
+            futures[index].set_result(list(_iter_pipeline_audio(lang_code, text, voice, speed, model)))
+        except Exception as e:
+            futures[index].set_exception(e)
+
+def _iter_mixed_language_audio(segments, voice, speed, model=None):
+    """
+    言語ごとにセグメントを並列合成し、元の順序で音声チャンクを返す
+    
+    同じ言語のセグメントは1スレッドで順番に処理し、同一パイプラインを
+    リクエスト内で同時に使わないようにする
+    """
+    futures = [Future() for _ in segments]
+    cancelled = threading.Event()
+    by_language = {}
+    for index, (lang_code, text) in enumerate(segments):
+        by_language.setdefault(lang_code, []).append((index, text))
+    for lang_code, lang_segments in by_language.items():
+        _segment_executor.submit(_synthesize_language_segments, lang_code, lang_segments, futures, voice, speed,
+                                 cancelled, model)
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        cancelled.set()
+
+class SynthesisCancelled(Exception):
+    """クライアント切断または期限切れによる合成の中断"""
+    
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+def _check_cancelled(should_cancel, deadline):
+    """中断条件を確認し、満たしていればSynthesisCancelledを送出"""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise SynthesisCancelled('deadline')
+    if should_cancel is not None and should_cancel():
+        raise SynthesisCancelled('disconnected')
+
+def _iter_with_cancellation(source, should_cancel, deadline):
+    """チャンク間で中断条件を確認し、中断時は合成ジェネレーターを閉じる"""
+    try:
+        _check_cancelled(should_cancel, deadline)
+        for chunk in source:
+            yield chunk
+            _check_cancelled(should_cancel, deadline)
+    finally:
+        source.close()
+
+def generate_audio_stream(text, voice="af_heart", speed=1.0, language=None, mixed_language=False,
+                          first_segment=None, should_cancel=None, deadline=None, fast_backend=None):
+    """
+    音声データを文ごとに生成するジェネレーター
+    
+    Args:
+        text (str): 音声化するテキスト
+        voice (str): 使用する音声（"af_heart:0.7,af_bella:0.3" 形式のブレンドも可）
+        speed (float): 再生速度
+        language (str): 言語コード（Noneの場合は自動検出）
+        mixed_language (bool): 文字種で言語を判定し、区間ごとに対応するパイプラインで合成
+        first_segment (str): 最初のセグメントの分割方針（Noneの場合はKOKORO_FIRST_SEGMENT）
+        should_cancel (callable): Trueを返すと合成を中断する（クライアント切断の確認など）
+        deadline (float): time.monotonic() 基準の期限
+        fast_backend (bool): 高速バックエンドで合成するか（Noneの場合は開始時の過負荷レベルで判断）
+    
+    Yields:
+        np.ndarray: 1次元の音声チャンク（SAMPLE_RATE Hz）
+    
+    Raises:
+        ValueError: テキスト・音声指定が不正な場合
+        SynthesisCancelled: チャンク間の確認で中断条件を満たした場合
+    """
+    error = validate_text(text) or validate_voice(voice)
+    if error:
+        raise ValueError(error)
+    policy = first_segment or FIRST_SEGMENT_POLICY
+    first_max_chars = FIRST_SEGMENT_MAX_CHARS
+    # 過負荷時は（明示指定がなければ）最初のセグメントを短くして最初の音声を早く返す
+    if first_segment is None and overload_controller.at_least(LEVEL_SHORT_FIRST):
+        policy = 'adaptive'
+        first_max_chars = min(first_max_chars, DEGRADED_FIRST_SEGMENT_MAX_CHARS)
+    segments = plan_segments(text, policy, first_max_chars)
+    
+    # 言語自動検出または手動指定
+    lang_code = language if language is not None else detect_language(text, voice)
+    request_log.annotate(lang=lang_code, voice=voice, speed=speed, **request_log.text_fields(text))
+    # ブレンド音声は合成済みスタイルテンソルを使う
+    voice_pack = resolve_voice(voice)
+    # 1リクエスト内は同じモデルで合成する（途中で音質が変わらないように）
+    if fast_backend is None:
+        model = _synthesis_model()
+    else:
+        model = get_fast_model() if fast_backend else None
+    
+    source = None
+    if mixed_language:
+        script_segments = split_by_script(text, lang_code)
+        if len(script_segments) > 1:
+            request_log.annotate(segments=[lang for lang, _ in script_segments])
+            source = _iter_mixed_language_audio(script_segments, voice_pack, speed, model)
+    if source is None:
+        source = _iter_pipeline_audio(lang_code, segments or text, voice_pack, speed, model)
+    
+    if should_cancel is None and deadline is None:
+        yield from source
+    else:
+        yield from _iter_with_cancellation(source, should_cancel, deadline)
+
+# 中断理由ごとのメッセージとHTTPステータス
+# 高速バックエンド（過負荷時の切り下げ）で合成した場合の完了メッセージ
+DEGRADED_MESSAGE = "✅ 音声生成完了！（高速バックエンド）"
+
+def is_degraded(message):
+    """generate_audio_data の結果が切り下げた品質か（キャッシュ・保存しない）"""
+    return message == DEGRADED_MESSAGE
+
+CANCELLED_MESSAGES = {
+    'deadline': "❌ タイムアウト: 指定時間内に音声生成が完了しませんでした",
+    'disconnected': "❌ クライアントが切断したため音声生成を中断しました"
+}
+
+def get_error_status(message):
+    """generate_audio_data の失敗メッセージに対応するHTTPステータス"""
+    if message == MEMORY_REJECTED_MESSAGE:
+        return 503
+    if message == CANCELLED_MESSAGES['deadline']:
+        return 504
+    if message == CANCELLED_MESSAGES['disconnected']:
+        return 499
+    return 500
+
+def _derive_speed_variant(rendition_key, speed):
+    """キャッシュ済みのレンディションを伸縮して指定速度の音声を作る（作れなければNone）"""
+    cached = rendition_cache.nearest(rendition_key, speed)
+    if cached is None:
+        return None
+    source_speed, source_audio = cached
+    if source_speed == speed:
+        increment_metric('rendition_hits')
+        return source_audio
+    
+    start = time.time()
+    audio_data, quality = time_stretch(source_audio, speed / source_speed)
+    request_log.annotate(stretch_quality=round(quality, 3))
+    if quality < STRETCH_MIN_QUALITY:
+        increment_metric('speed_variant_fallbacks')
+        return None
+    increment_metric('speed_variant_hits')
+    observe_latency('speed_variant', time.time() - start)
+    return audio_data
+
+def generate_audio_data(text, voice="af_heart", speed=1.0, language=None, mixed_language=False,
+                        first_segment=None, should_cancel=None, deadline=None):
     """
     音声データを生成する（コア機能）
     
     Args:
         text (str): 音声化するテキスト
-        voice (str): 使用する音声
+        voice (str): 使用する音声（ブレンド式・保存済みブレンド音声名も可）
         speed (float): 再生速度
         language (str): 言語コード（Noneの場合は自動検出）
+        mixed_language (bool): 文字種ごとに言語別パイプラインで合成
+        first_segment (str): 最初のセグメントの分割方針（FIRST_SEGMENT_POLICIES）
+        should_cancel (callable): Trueを返すと合成を中断する（クライアント切断の確認など）
+        deadline (float): time.monotonic() 基準の期限（超過時はチャンク間で中断）
     
     Returns:
         tuple: (audio_data: np.ndarray, success: bool, message: str)
     """
+    # HTTPハンドラー外（Gradio・ベンチマーク等）から呼ばれた場合もここで1行のログにまとめる
+    with request_log.request_context('synthesis') as log:
+        audio_data, success, message = _generate_audio_data(
+            text, voice, speed, language, mixed_language, first_segment, should_cancel, deadline
+        )
+        log.annotate(success=success)
+        if not success:
+            log.annotate(message=message)
+        return audio_data, success, message
+
+def _deadline_exceeded(received, queue_wait):
+    """合成を始める前に期限を過ぎたリクエストの結果"""
+    increment_metric('cancelled_deadline')
+    request_log.annotate(cancelled='deadline')
+    overload_controller.observe(time.time() - received, max(queue_wait, time.time() - received), failed=True)
+    return None, False, CANCELLED_MESSAGES['deadline']
+
+def _generate_audio_data(text, voice, speed, language, mixed_language, first_segment, should_cancel, deadline):
+    received = time.time()
+    error = validate_text(text) or validate_voice(voice)
+    if error:
+        return None, False, error
+    # フレーズバンク・レンディションの検索より前に速度を数値にそろえる
+    if isinstance(speed, bool):
+        return None, False, "❌ speedは数値です"
     try:
-        if not text.strip():
-            return None, False, "テキストを入力してください"
-        
-        if len(text) > 1000:
-            return None, False, "テキストが長すぎます（1000文字以下）"
-        
-        # 言語自動検出または手動指定
-        if language is None:
-            lang_code = detect_language(text, voice)
-        else:
-            lang_code = language
-            
-        print(f"TTS生成中: {text[:50]}... (言語: {lang_code}, 音声: {voice})")
-        
-        # パイプライン取得
-        pipeline = get_pipeline(lang_code)
-        
-        # 音声生成
-        audio_generator = pipeline(text, voice=voice, speed=speed)
-        
-        # 音声チャンクを収集
+        speed = float(speed)
+    except (TypeError, ValueError):
+        return None, False, "❌ speedは数値です"
+    if not np.isfinite(speed) or speed <= 0:
+        return None, False, "❌ speedは正の数値です"
+    # 同じ混合のブレンド音声は同じキャッシュ・フレーズを使う
+    voice = normalize_voice(voice)
+    
+    # 事前レンダリング済みフレーズバンクに完全一致があればモデルを使わない
+    pcm = lookup_phrase(text, voice, speed)
+    if pcm is not None:
+        increment_metric('phrase_bank_hits')
+        request_log.annotate(source='phrase_bank', **request_log.text_fields(text))
+        return pcm.astype(np.float32) / 32767, True, "✅ 音声生成完了！（フレーズバンク）"
+    
+    lang_code = language if language is not None else detect_language(text, voice)
+    
+    # 別の速度で合成済みの音声があればタイムストレッチで作る（品質が低ければ通常の合成）
+    # 最初のセグメントの分割方針でも音声が変わるため、省略時は既定の方針としてキーに含める
+    rendition_key = (text, voice, lang_code, mixed_language, first_segment or FIRST_SEGMENT_POLICY)
+    if SPEED_VARIANTS:
+        audio_data = _derive_speed_variant(rendition_key, speed)
+        if audio_data is not None:
+            request_log.annotate(source='rendition', **request_log.text_fields(text))
+            return audio_data, True, "✅ 音声生成完了！（合成済み音声を再利用）"
+    
+    # メモリ見積もりに基づくアドミッション制御
+    estimate_mb = estimate_request_mb(text, lang_code)
+    # 過負荷制御の待ち時間: 前に並んでいるリクエストからの推定とアドミッションの待機の大きい方
+    queue_wait = get_load_info()['estimated_wait_ms'] / 1000
+    # 期限切れはメモリ不足（503）ではなく期限切れ（504）として返す
+    if deadline is not None and time.monotonic() >= deadline:
+        return _deadline_exceeded(received, queue_wait)
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    admitted = admission_guard.acquire(estimate_mb, timeout)
+    request_log.stage('admission')
+    if not admitted and deadline is not None and time.monotonic() >= deadline:
+        return _deadline_exceeded(received, queue_wait)
+    if not admitted:
+        increment_metric('admission_rejected')
+        request_log.annotate(estimate_mb=round(estimate_mb))
+        overload_controller.observe(time.time() - received, max(queue_wait, time.time() - received), failed=True)
+        return None, False, MEMORY_REJECTED_MESSAGE
+    
+    tracker = MemoryTracker(lang_code, len(text))
+    request_start = time.time()
+    queue_wait = max(queue_wait, request_start - received)
+    success = False
+    deadline_exceeded = False
+    # 過負荷で高速バックエンドを使う場合は、劣化した音声をキャッシュしない
+    degraded = _synthesis_model() is not None
+    try:
+        # 音声チャンクを収集（チャンク間でピークRSSを計測）
         audio_chunks = []
-        for chunk in audio_generator:
-            if chunk is not None:
-                # KPipeline.Resultオブジェクトから音声データを取得
-                if hasattr(chunk, 'audio'):
-                    audio_data_chunk = chunk.audio
-                elif hasattr(chunk, 'data'):
-                    audio_data_chunk = chunk.data
-                else:
-                    audio_data_chunk = chunk
-                
-                # テンソルの場合はnumpy配列に変換
-                if hasattr(audio_data_chunk, 'numpy'):
-                    audio_data_chunk = audio_data_chunk.numpy()
-                elif hasattr(audio_data_chunk, 'detach'):
-                    audio_data_chunk = audio_data_chunk.detach().cpu().numpy()
-                
-                audio_chunks.append(audio_data_chunk)
+        for chunk in generate_audio_stream(text, voice, speed, lang_code, mixed_language, first_segment,
+                                           should_cancel, deadline, fast_backend=degraded):
+            audio_chunks.append(chunk)
+            if len(audio_chunks) == 1:
+                tracker.stage('first_chunk')
+                request_log.stage('first_chunk')
+            else:
+                tracker.sample()
+        tracker.stage('synthesis')
+        request_log.stage('synthesis')
         
         if not audio_chunks:
             return None, False, "音声生成に失敗しました"
         
-        print(f"音声チャンク数: {len(audio_chunks)}")
-        
         # チャンクを結合
         if len(audio_chunks) == 1:
             audio_data = audio_chunks[0]
         else:
-            # 各チャンクが同じ次元か確認
-            try:
-                audio_data = np.concatenate(audio_chunks, axis=0)
-            except ValueError as e:
-                print(f"結合エラー: {e}")
-                # 1次元に変換してから結合
-                flattened_chunks = []
-                for chunk in audio_chunks:
-                    if hasattr(chunk, 'flatten'):
-                        flattened_chunks.append(chunk.flatten())
-                    else:
-                        flattened_chunks.append(np.array(chunk).flatten())
-                audio_data = np.concatenate(flattened_chunks)
-        
-        # numpy配列に正規化
-        if not isinstance(audio_data, np.ndarray):
-            try:
-                audio_data = np.array(audio_data, dtype=np.float32)
-            except ValueError as e:
-                print(f"配列変換エラー: {e}")
-                # より安全な変換
-                if hasattr(audio_data, '__iter__'):
-                    try:
-                        # ネストされたリストを平坦化
-                        flat_data = []
-                        def flatten(lst):
-                            for item in lst:
-                                if hasattr(item, '__iter__') and not isinstance(item, (str, np.ndarray)):
-                                    flatten(item)
-                                else:
-                                    flat_data.append(float(item))
-                        flatten(audio_data)
-                        audio_data = np.array(flat_data, dtype=np.float32)
-                    except:
-                        return None, False, f"音声データの変換に失敗: {e}"
-                else:
-                    return None, False, f"音声データが不正: {type(audio_data)}"
-        
-        # 1次元配列に変換
-        if audio_data.ndim > 1:
-            audio_data = audio_data.flatten()
-        
-        print(f"音声データ形状: {audio_data.shape}, データ型: {audio_data.dtype}")
+            audio_data = np.concatenate(audio_chunks)
+        tracker.stage('concat')
+        request_log.stage('concat')
+        request_log.annotate(chunks=len(audio_chunks), audio_seconds=round(len(audio_data) / SAMPLE_RATE, 2))
         
         # メモリ解放
         del audio_chunks
         gc.collect()
         
+        success = True
+        if degraded:
+            request_log.annotate(degraded='fast_backend')
+            return audio_data, True, DEGRADED_MESSAGE
+        if SPEED_VARIANTS:
+            rendition_cache.put(rendition_key, speed, audio_data)
         return audio_data, True, "✅ 音声生成完了！"
         
+    except SynthesisCancelled as e:
+        # 受け取る相手のいない合成は途中で打ち切る
+        increment_metric(f'cancelled_{e.reason}')
+        request_log.annotate(cancelled=e.reason)
+        deadline_exceeded = e.reason == 'deadline'
+        return None, False, CANCELLED_MESSAGES[e.reason]
+        
     except Exception as e:
-        print(f"エラー: {str(e)}")
+        log_exception("音声生成エラー")
         return None, False, f"❌ エラー: {str(e)}"
+    
+    finally:
+        admission_guard.release(estimate_mb)
+        if success:
+            observe_latency('request', time.time() - request_start)
+            observe_latency('queue_wait', queue_wait)
+            overload_controller.observe(time.time() - received, queue_wait)
+        elif deadline_exceeded:
+            overload_controller.observe(time.time() - received, queue_wait, failed=True)
+        record = tracker.finish(success)
+        request_log.annotate(memory_peak_delta_mb=record['peak_delta_mb'])
 
 def generate_audio_file(text, voice="af_heart", speed=1.0, language=None, output_path=None):
     """
@@ -341,11 +1153,11 @@ def generate_audio_file(text, voice="af_heart", speed=1.0, language=None, output
         if output_path is None:
             # 一時ファイル
             with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-                sf.write(tmp_file.name, audio_data, 24000)
+                sf.write(tmp_file.name, audio_data, SAMPLE_RATE)
                 file_path = tmp_file.name
         else:
             # 指定パス
-            sf.write(output_path, audio_data, 24000)
+            sf.write(output_path, audio_data, SAMPLE_RATE)
             file_path = output_path
         
         # メモリ解放
@@ -358,20 +1170,136 @@ def generate_audio_file(text, voice="af_heart", speed=1.0, language=None, output
         print(f"ファイル保存エラー: {str(e)}")
         return None, False, f"❌ ファイル保存エラー: {str(e)}"
 
+# バッチ合成で言語ごとのグループを並列に処理するスレッドプール
+# （言語別セグメントの合成で _segment_executor を使うため、別のプールにして待ち合わせでの枯渇を防ぐ）
+BATCH_WORKERS = int(os.environ.get('KOKORO_BATCH_WORKERS', '2'))
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+
+def _batch_language(item):
+    """バッチ項目の言語コード（指定がなければ自動検出）"""
+    voice = item.get('voice', 'af_heart')
+    if item.get('language'):
+        return item['language']
+    if not isinstance(voice, str) or not isinstance(item.get('text'), str):
+        return 'a'
+    return detect_language(item['text'], voice)
+
+def iter_audio_batch(items):
+    """
+    複数の音声をまとめて生成し、完了した順に返す
+    
+    項目を言語ごとにまとめ、グループ内は1つのパイプラインで順に、グループ同士は
+    BATCH_WORKERS の範囲で並列に合成する。KModelは1発話ずつ推論するため、
+    まとめる効果は同時実行数を抑えてCPUの取り合いを避けることと、
+    パイプライン・音声パック・Taggerを連続して使い回すことにある。
+    
+    Args:
+        items (list): {"text", "voice", "speed", "language", "mixed_language"} の辞書のリスト
+    
+    Yields:
+        tuple: (index, (audio_data, success, message))
+    """
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(_batch_language(item), []).append(index)
+    increment_metric('batch_requests')
+    increment_metric('batch_items', len(items))
+    
+    results = queue.Queue()
+    cancelled = threading.Event()
+    
+    def run_group(lang_code, indices):
+        for index in indices:
+            if cancelled.is_set():
+                return
+            item = items[index]
+            try:
+                result = generate_audio_data(
+                    item.get('text', ''), item.get('voice', 'af_heart'), item.get('speed', 1.0),
+                    lang_code, item.get('mixed_language', False)
+                )
+            except Exception as e:
+                log_exception("バッチ音声生成エラー")
+                result = (None, False, f"❌ エラー: {str(e)}")
+            results.put((index, result))
+    
+    for lang_code, indices in groups.items():
+        _batch_executor.submit(run_group, lang_code, indices)
+    try:
+        for _ in range(len(items)):
+            yield results.get()
+    finally:
+        # 受け取り側が途中でやめた場合は残りの項目を合成しない
+        cancelled.set()
+
+def generate_audio_batch(items):
+    """
+    複数の音声をまとめて生成する（iter_audio_batch の結果を入力順に並べる）
+    
+    Returns:
+        list: 各項目の (audio_data, success, message)
+    """
+    results = [None] * len(items)
+    for index, result in iter_audio_batch(items):
+        results[index] = result
+    return results
+
+def output_audio(audio_data):
+    """
+    レスポンスに書き出す音声とサンプルレート（過負荷時は DEGRADED_SAMPLE_RATE に下げる）
+    
+    Returns:
+        tuple: (audio_data: np.ndarray, sample_rate: int)
+    """
+    if DEGRADED_SAMPLE_RATE < SAMPLE_RATE and overload_controller.at_least(LEVEL_LOW_SAMPLE_RATE):
+        increment_metric('degraded_sample_rate')
+        return resample(audio_data, SAMPLE_RATE, DEGRADED_SAMPLE_RATE), DEGRADED_SAMPLE_RATE
+    return audio_data, SAMPLE_RATE
+
 def get_voice_info():
     """音声情報を取得"""
     return {
         "languages": LANGUAGES,
         "voices": VOICES,
         "all_voices": ALL_VOICES,
+        "saved_voices": get_saved_voices(),
         "sample_texts": SAMPLE_TEXTS
     }
 
+def get_load_info():
+    """
+    負荷情報を取得（ルーターが混雑したノードを避けるために使用）
+    
+    Returns:
+        dict: queue_depth（処理中 + 待機中）, capacity, estimated_wait_ms, degradation_level, loaded_languages
+    """
+    admission = admission_guard.get_status()
+    queue_depth = admission["in_flight"] + admission["waiting"]
+    with _metrics_lock:
+        recent = list(_latencies.get('request', ()))[-50:]
+    avg_latency = sum(recent) / len(recent) if recent else 0.0
+    # 空きスロットがなければ、前に並んでいるリクエストが捌けるまで待つ
+    queued_ahead = max(0, queue_depth - CAPACITY + 1)
+    return {
+        "queue_depth": queue_depth,
+        "capacity": CAPACITY,
+        "estimated_wait_ms": round(avg_latency * queued_ahead / CAPACITY * 1000, 1),
+        "degradation_level": overload_controller.level,
+        "loaded_languages": list(_pipelines.keys())
+    }
+
 def get_system_info():
     """システム情報を取得"""
     return {
         "cpu_cores": cpu_count,
         "omp_threads": os.environ.get('OMP_NUM_THREADS'),
         "mkl_threads": os.environ.get('MKL_NUM_THREADS'),
-        "loaded_languages": list(_pipelines.keys())
+        "loaded_languages": list(_pipelines.keys()),
+        "rss_mb": round(get_rss_mb(), 1),
+        "admission": admission_guard.get_status(),
+        "phrase_bank": phrase_bank.get_status() if phrase_bank else None,
+        "voice_blend_cache": len(_blend_cache),
+        "tagger_pool": get_tagger_pool().get_status() if get_tagger_pool() else None,
+        "rendition_cache": rendition_cache.get_status() if SPEED_VARIANTS else None,
+        "batch_workers": BATCH_WORKERS
     }
\ No newline at end of file
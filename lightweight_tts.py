@@ -7,49 +7,59 @@
 import os
 import io
 import gc
-import threading
-from functools import lru_cache
-from flask import Flask, request, jsonify, send_file
+import time
+from flask import Flask, request, jsonify, send_file, url_for
 import soundfile as sf
-
-# CPUコア数を自動検出して最大活用
-import multiprocessing
-cpu_count = multiprocessing.cpu_count()
-os.environ['OMP_NUM_THREADS'] = str(cpu_count)
-os.environ['MKL_NUM_THREADS'] = str(cpu_count)
-
-try:
-    from kokoro import KPipeline
-except ImportError:
-    print("kokoroライブラリが必要です。pip install kokoro>=0.9.4")
-    exit(1)
+from kokoro_core import (
+    generate_audio_data,
+    get_error_status,
+    is_degraded,
+    get_metrics,
+    get_load_info,
+    get_saved_voices,
+    normalize_voice,
+    output_audio,
+    save_voice,
+    validate_voice,
+    cpu_count,
+    FIRST_SEGMENT_POLICIES,
+    SAMPLE_RATE
+)
+from phrase_bank import lookup_phrase_wav
+from audio_store import audio_store, rendition_response, request_key
+import request_log
+import traffic_recorder
+from request_log import log_exception
+from memory_guard import get_memory_report, set_tracemalloc
+from jobs import get_job_queue, validate_callback_url, JOB_MAX_CHARS
 
 app = Flask(__name__)
-
-# グローバル変数でパイプラインをキャッシュ
-_pipeline = None
-_pipeline_lock = threading.Lock()
-
-@lru_cache(maxsize=1)
-def get_pipeline(lang_code='a'):
-    """パイプラインをキャッシュして再利用"""
-    global _pipeline
-    if _pipeline is None:
-        with _pipeline_lock:
-            if _pipeline is None:
-                print(f"Kokoroパイプライン初期化中... (言語: {lang_code})")
-                _pipeline = KPipeline(lang_code=lang_code)
-                print("初期化完了")
-    return _pipeline
+request_log.init_app(app)
+traffic_recorder.init_app(app)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """ヘルスチェック"""
-    return jsonify({"status": "ok", "model": "Kokoro-82M"})
+    return jsonify({"status": "ok", "model": "Kokoro-82M", **get_load_info()})
+
+def stored_audio_response(content_hash, return_url):
+    """保存済み音声のレスポンス（return_url なら内容ハッシュのURLのみ、なければNone）"""
+    audio_url = url_for('stored_audio', content_hash=content_hash)
+    if return_url:
+        return jsonify({"audio_url": audio_url, "etag": f'"{content_hash}"'})
+    response = rendition_response(content_hash, download_name='output.wav')
+    if response is not None:
+        response.headers['Content-Location'] = audio_url
+    return response
 
 @app.route('/tts', methods=['POST'])
 def text_to_speech():
-    """テキスト音声変換エンドポイント"""
+    """
+    テキスト音声変換エンドポイント
+    
+    音声ストア有効時（KOKORO_AUDIO_STORE=1）は "return_url": true で音声の代わりに
+    内容ハッシュのURL（/audio/<hash>.wav）を返す
+    """
     try:
         data = request.get_json()
         if not data or 'text' not in data:
@@ -58,53 +68,76 @@ def text_to_speech():
         text = data['text']
         voice = data.get('voice', 'af_heart')  # デフォルト音声
         speed = data.get('speed', 1.0)  # 速度調整
+        first_segment = data.get('first_segment')  # 最初のセグメントの分割方針
+        timeout_ms = data.get('timeout_ms')  # 期限（ミリ秒）
+        return_url = bool(data.get('return_url'))  # 音声の代わりにURLを返す
         
         if len(text) > 1000:  # 長いテキストを制限
             return jsonify({"error": "テキストが長すぎます（1000文字以下）"}), 400
         
-        print(f"TTS生成中: {text[:50]}...")
-        
-        # パイプライン取得
-        pipeline = get_pipeline()
+        error = validate_voice(voice)
+        if error:
+            return jsonify({"error": error}), 400
+        voice = normalize_voice(voice)
         
-        # 音声生成
-        audio_generator = pipeline(text, voice=voice, speed=speed)
+        if first_segment is not None and first_segment not in FIRST_SEGMENT_POLICIES:
+            return jsonify({"error": f"first_segmentは {', '.join(FIRST_SEGMENT_POLICIES)} のいずれかです"}), 400
         
-        # 音声チャンクを収集
-        audio_chunks = []
-        for chunk in audio_generator:
-            if chunk is not None:
-                audio_chunks.append(chunk)
+        if not isinstance(speed, (int, float)) or isinstance(speed, bool):
+            return jsonify({"error": "speedは数値です"}), 400
         
-        if not audio_chunks:
-            return jsonify({"error": "音声生成に失敗しました"}), 500
+        if timeout_ms is not None and (not isinstance(timeout_ms, (int, float)) or timeout_ms <= 0):
+            return jsonify({"error": "timeout_msは正の数値です"}), 400
+        deadline = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+        # Waitressのchannel_request_lookahead有効時のみ切断を検知できる
+        client_disconnected = request.environ.get('waitress.client_disconnected')
         
-        # 音声データを結合
-        import numpy as np
-        if len(audio_chunks) == 1:
-            audio_data = audio_chunks[0]
-        else:
-            audio_data = np.concatenate(audio_chunks, axis=0)
+        if return_url and audio_store is None:
+            return jsonify({"error": "return_urlには音声ストアの有効化（KOKORO_AUDIO_STORE=1）が必要です"}), 400
+        # 同じリクエストの音声が保存済みなら合成しない
+        store_key = request_key(text, voice, speed, first_segment=first_segment) if audio_store else None
+        if store_key:
+            content_hash = audio_store.lookup(store_key)
+            response = stored_audio_response(content_hash, return_url) if content_hash else None
+            if response is not None:
+                return response
         
-        # numpy配列であることを確認
-        if not isinstance(audio_data, np.ndarray):
-            audio_data = np.array(audio_data, dtype=np.float32)
+        # フレーズバンクに完全一致があればモデルを使わずにPCMスライスを返す
+        wav = lookup_phrase_wav(text, voice, speed)
+        if wav is not None and not return_url:
+            return send_file(
+                io.BytesIO(wav),
+                mimetype='audio/wav',
+                as_attachment=True,
+                download_name='output.wav'
+            )
         
-        # 1次元配列に変換（必要に応じて）
-        if audio_data.ndim > 1:
-            audio_data = audio_data.flatten()
-        
-        print(f"音声データ形状: {audio_data.shape}, データ型: {audio_data.dtype}")
+        # 音声生成（言語別パイプラインはkokoro_coreで共有）
+        audio_data, success, message = generate_audio_data(
+            text, voice, speed,
+            first_segment=first_segment,
+            should_cancel=client_disconnected,
+            deadline=deadline
+        )
+        if not success:
+            return jsonify({"error": message}), get_error_status(message)
         
-        # メモリ上でWAVファイル作成
+        # メモリ上でWAVファイル作成（過負荷時はサンプルレートを下げる）
+        audio_data, sample_rate = output_audio(audio_data)
         buffer = io.BytesIO()
-        sf.write(buffer, audio_data, 24000, format='WAV')
+        sf.write(buffer, audio_data, sample_rate, format='WAV')
         buffer.seek(0)
         
         # メモリ解放
-        del audio_data, audio_chunks
+        del audio_data
         gc.collect()
         
+        # 切り下げていない（通常のサンプルレート・通常のモデルの）音声だけを保存して内容ハッシュのURLで返す
+        if store_key and sample_rate == SAMPLE_RATE and not is_degraded(message):
+            response = stored_audio_response(audio_store.put(store_key, buffer.getvalue()), return_url)
+            if response is not None:
+                return response
+        
         return send_file(
             buffer,
             mimetype='audio/wav',
@@ -113,9 +146,109 @@ def text_to_speech():
         )
         
     except Exception as e:
-        print(f"エラー: {str(e)}")
+        log_exception("リクエスト処理エラー")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/audio/<content_hash>.wav', methods=['GET'])
+def stored_audio(content_hash):
+    """保存済みの音声（内容ハッシュのURL。ETagによる304・Rangeによる部分取得に対応）"""
+    response = rendition_response(content_hash)
+    if response is None:
+        return jsonify({"error": "音声が見つかりません"}), 404
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """長文合成ジョブを登録（IDを返し、結果は /jobs/<id>/audio で取得）"""
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('text'), str) or not data['text'].strip():
+        return jsonify({"error": "textフィールドが必要です"}), 400
+    if len(data['text']) > JOB_MAX_CHARS:
+        return jsonify({"error": f"テキストが長すぎます（{JOB_MAX_CHARS}文字以下）"}), 400
+    voice = data.get('voice', 'af_heart')
+    error = validate_voice(voice)
+    if error:
+        return jsonify({"error": error}), 400
+    speed = data.get('speed', 1.0)
+    if not isinstance(speed, (int, float)) or isinstance(speed, bool):
+        return jsonify({"error": "speedは数値です"}), 400
+    if data.get('callback_url') is not None:
+        error = validate_callback_url(data['callback_url'])
+        if error:
+            return jsonify({"error": error}), 400
+    
+    job_id = get_job_queue().submit(
+        data['text'],
+        voice=normalize_voice(voice),
+        speed=speed,
+        language=data.get('language'),
+        callback_url=data.get('callback_url')
+    )
+    return jsonify({
+        "id": job_id,
+        "status": "queued",
+        "status_url": url_for('job_status', job_id=job_id),
+        "audio_url": url_for('job_audio', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """ジョブの状態・進捗"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """待機中・実行中のジョブをキャンセル"""
+    if not get_job_queue().cancel(job_id):
+        return jsonify({"error": "キャンセルできるジョブが見つかりません"}), 404
+    return jsonify({"id": job_id, "status": "cancelled"})
+
+@app.route('/jobs/<job_id>/audio', methods=['GET'])
+def job_audio(job_id):
+    """完了したジョブの音声をダウンロード"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    if job['status'] != 'done':
+        return jsonify({"error": f"ジョブは完了していません（{job['status']}）"}), 409
+    return send_file(
+        os.path.abspath(queue.audio_path(job_id)),
+        mimetype='audio/wav',
+        as_attachment=True,
+        download_name=f'job_{job_id}.wav'
+    )
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """リクエスト・中断数などのメトリクス"""
+    return jsonify({**get_metrics(), "jobs": get_job_queue().counts(), "logging": request_log.get_status(),
+                    "traffic": traffic_recorder.get_status(),
+                    "audio_store": audio_store.get_status() if audio_store else None})
+
+@app.route('/memory', methods=['GET'])
+def memory_report():
+    """メモリ使用状況（リクエスト・ステージ別のRSS増分、tracemalloc上位）"""
+    recent = request.args.get('recent', 20, type=int)
+    top = request.args.get('top', 10, type=int)
+    return jsonify(get_memory_report(recent=recent, top=top))
+
+@app.route('/memory/tracemalloc', methods=['POST'])
+def memory_tracemalloc():
+    """tracemallocサンプリングの開始・停止"""
+    data = request.get_json(silent=True) or {}
+    frames = data.get('frames', 1)
+    if not isinstance(frames, int) or isinstance(frames, bool) or frames < 1:
+        return jsonify({"error": "framesは1以上の整数です"}), 400
+    try:
+        tracing = set_tracemalloc(bool(data.get('enabled', True)), frames)
+    except ValueError as e:
+        return jsonify({"error": f"framesが不正です: {e}"}), 400
+    return jsonify({"tracing": tracing})
+
 @app.route('/voices', methods=['GET'])
 def list_voices():
     """利用可能な音声一覧"""
@@ -123,7 +256,17 @@ def list_voices():
         'af_heart', 'af_sky', 'af_grace', 'af_heaven',
         'am_adam', 'am_mike', 'bf_iris', 'bf_rose'
     ]
-    return jsonify({"voices": voices})
+    return jsonify({"voices": voices, "saved_voices": get_saved_voices()})
+
+@app.route('/voices', methods=['POST'])
+def create_voice():
+    """ブレンド音声に名前を付けて保存（例: {"name": "warm_mix", "voice": "af_heart:0.7,af_bella:0.3"}）"""
+    data = request.get_json(silent=True) or {}
+    _, success, message = save_voice(data.get('name'), data.get('voice'))
+    if not success:
+        # 入力の誤りは400、ファイル保存の失敗は500
+        return jsonify({"error": message}), 500 if "保存エラー" in message else 400
+    return jsonify({"name": data['name'], "voice": get_saved_voices()[data['name']], "message": message}), 201
 
 if __name__ == '__main__':
     print("Kokoro-82M軽量TTSサーバー起動中...")
@@ -133,5 +276,8 @@ if __name__ == '__main__':
     print("- メモリ最適化: 有効")
     print("- パイプラインキャッシュ: 有効")
     
+    # 非同期ジョブのワーカーを起動
+    get_job_queue().start()
+    
     # 開発用サーバー（本番ではwaitress使用推奨）
     app.run(host='0.0.0.0', port=8000, debug=False, threaded=True)
\ No newline at end of file
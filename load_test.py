@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+過負荷時の切り下げ（overload.py）の負荷テスト
+起動中のサーバー（server_prod.py / lightweight_tts.py）に対し、通常 → 過負荷 → 回復 の
+順に同時接続数を変えて /tts を送り続け、フェーズごとのレイテンシ・SLO達成率と
+/health の切り下げレベルの推移を表示する
+
+使い方:
+    KOKORO_OVERLOAD_CONTROL=1 ./run_production.sh   # 別端末でサーバーを起動
+    python load_test.py                             # http://localhost:8000
+    python load_test.py http://localhost:8001 16    # URLと過負荷時の同時接続数を指定
+
+KOKORO_OVERLOAD_CONTROL=0 で起動したサーバーと結果を比べると効果がわかる
+"""
+
+import os
+import sys
+import time
+import threading
+import requests
+import numpy as np
+
+# クライアント側で判定するSLO（サーバーの KOKORO_SLO_P95_MS と合わせる）
+SLO_P95_MS = float(os.environ.get('KOKORO_SLO_P95_MS', '3000'))
+PHASE_SECONDS = {
+    'normal': 20,
+    'overload': 60,
+    'recovery': 40
+}
+
+LOAD_TEXTS = [
+    ("Thank you for calling. Your order has shipped and will arrive on Thursday.", "af_heart"),
+    ("The meeting has been moved to three o'clock. Please update your calendar accordingly.", "am_adam"),
+    ("ご注文の商品は本日発送されました。到着まで今しばらくお待ちください。", "jf_alpha"),
+    ("Please hold while we connect you to the next available representative.", "af_sky")
+]
+
+class LoadTest:
+    """フェーズごとに同時接続数を変えてリクエストを送り、結果を記録"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.results = []  # (phase, 送信時刻, レイテンシ秒, ステータス, サンプルレート)
+        self.levels = []   # (時刻, 切り下げレベル)
+        self.phase = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._start = time.time()
+
+    def _client(self, index, active):
+        session = requests.Session()
+        while not self._stop.is_set():
+            if index >= active():
+                time.sleep(0.1)
+                continue
+            text, voice = LOAD_TEXTS[index % len(LOAD_TEXTS)]
+            phase = self.phase
+            sent = time.time()
+            try:
+                response = session.post(f"{self.base_url}/tts", json={"text": text, "voice": voice}, timeout=120)
+                status = response.status_code
+                # WAVヘッダーのサンプルレート（切り下げレベル3以上で下がる）
+                sample_rate = int.from_bytes(response.content[24:28], 'little') if status == 200 else None
+            except requests.RequestException:
+                status, sample_rate = None, None
+            with self._lock:
+                self.results.append((phase, sent - self._start, time.time() - sent, status, sample_rate))
+
+    def _watch_health(self):
+        while not self._stop.is_set():
+            try:
+                level = requests.get(f"{self.base_url}/health", timeout=5).json().get('degradation_level')
+            except (requests.RequestException, ValueError):
+                level = None
+            if level is not None and (not self.levels or self.levels[-1][1] != level):
+                self.levels.append((time.time() - self._start, level))
+                print(f"  [{time.time() - self._start:6.1f}s] 切り下げレベル: {level}")
+            time.sleep(1)
+
+    def run(self, overload_clients):
+        schedule = [('normal', 1), ('overload', overload_clients), ('recovery', 1)]
+        concurrency = {'value': 0}
+        threads = [threading.Thread(target=self._watch_health, daemon=True)]
+        threads += [
+            threading.Thread(target=self._client, args=(i, lambda: concurrency['value']), daemon=True)
+            for i in range(overload_clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for phase, clients in schedule:
+            print(f"▶ {phase}: 同時接続 {clients} ({PHASE_SECONDS[phase]}秒)")
+            self.phase = phase
+            concurrency['value'] = clients
+            time.sleep(PHASE_SECONDS[phase])
+        self._stop.set()
+        for thread in threads[1:]:
+            thread.join(timeout=120)
+
+    def report(self):
+        print(f"\n{'フェーズ':<10} {'件数':>6} {'成功':>6} {'503':>5} {'p50(ms)':>9} {'p95(ms)':>9} "
+              f"{'SLO達成':>8} {'req/s':>7} {'16kHz':>6}")
+        for phase, seconds in PHASE_SECONDS.items():
+            rows = [r for r in self.results if r[0] == phase]
+            ok = [r for r in rows if r[3] == 200]
+            if not rows:
+                continue
+            latencies = np.array([r[2] for r in ok]) * 1000 if ok else np.array([0.0])
+            within_slo = sum(1 for r in ok if r[2] * 1000 <= SLO_P95_MS) / len(rows) * 100
+            downsampled = sum(1 for r in ok if r[4] and r[4] < 24000)
+            print(f"{phase:<10} {len(rows):>6} {len(ok):>6} {sum(1 for r in rows if r[3] == 503):>5} "
+                  f"{np.percentile(latencies, 50):>9.0f} {np.percentile(latencies, 95):>9.0f} "
+                  f"{within_slo:>7.1f}% {len(ok) / seconds:>7.2f} {downsampled:>6}")
+        print(f"\n切り下げレベルの推移: {' → '.join(f'{level}({t:.0f}s)' for t, level in self.levels) or 'なし'}")
+
+def main():
+    base_url = sys.argv[1].rstrip('/') if len(sys.argv) > 1 else "http://localhost:8000"
+    overload_clients = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 4) * 2
+    print(f"🧪 過負荷テスト開始: {base_url} (SLO p95 {SLO_P95_MS:.0f}ms)")
+    try:
+        requests.get(f"{base_url}/health", timeout=5).raise_for_status()
+    except requests.RequestException as e:
+        print(f"❌ サーバーに接続できません: {e}")
+        return
+    test = LoadTest(base_url)
+    test.run(overload_clients)
+    test.report()
+    print("🧪 過負荷テスト完了")
+
+if __name__ == "__main__":
+    main()
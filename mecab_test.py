@@ -1,12 +1,35 @@
 #!/usr/bin/env python3
 """
-MeCab動作テストスクリプト
+MeCab動作テスト・スループットベンチマーク
+各Taggerの動作確認に加え、Taggerの作成コストと、スレッド間での使い方
+（共有+ロック / 呼び出しごとに作成 / スレッドごとのプール）ごとの解析スループットを比較する
+
+使い方:
+    python mecab_test.py            # 動作テスト + ベンチマーク（4スレッド）
+    python mecab_test.py 8          # 8スレッドでベンチマーク
 """
 
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 解析対象の文（長文をこの文で構成する）
+BENCH_SENTENCES = [
+    "吾輩は猫である。",
+    "名前はまだ無い。",
+    "どこで生れたかとんと見当がつかぬ。",
+    "何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。",
+    "美しい夕日が山の向こうに沈んでいく。",
+    "日本語の音声合成のテストを行っています。"
+]
+# 1スレッドあたりの解析回数
+ITERATIONS = 200
+
 def test_mecab():
     """MeCab/Fugashiの動作テスト"""
     print("🧪 MeCab動作テスト開始...")
-    
+
     # MeCab-python3テスト
     try:
         import MeCab
@@ -16,7 +39,7 @@ def test_mecab():
         print(f"   結果: {result.strip()}")
     except Exception as e:
         print(f"❌ MeCab-python3: {e}")
-    
+
     # Fugashiテスト
     try:
         import fugashi
@@ -26,7 +49,7 @@ def test_mecab():
         print(f"   結果: {result.strip()}")
     except Exception as e:
         print(f"❌ Fugashi GenericTagger: {e}")
-    
+
     # Fugashi通常Taggerテスト
     try:
         import fugashi
@@ -36,8 +59,111 @@ def test_mecab():
         print(f"   結果: {result.strip()}")
     except Exception as e:
         print(f"❌ Fugashi Tagger: {e}")
-    
+
     print("🧪 MeCabテスト完了")
 
+def tagger_factories():
+    """利用可能なTaggerの作成関数 {名前: (作成関数, 解析関数)}"""
+    factories = {}
+    try:
+        import fugashi
+        fugashi.Tagger()
+        factories['fugashi.Tagger'] = (fugashi.Tagger, lambda tagger, text: tagger(text))
+    except Exception:
+        pass
+    try:
+        import MeCab
+        MeCab.Tagger()
+        factories['MeCab.Tagger'] = (MeCab.Tagger, lambda tagger, text: tagger.parse(text))
+    except Exception:
+        pass
+    try:
+        from misaki.ja import JAG2P
+        JAG2P()
+        factories['misaki JAG2P'] = (JAG2P, lambda g2p, text: g2p(text))
+    except Exception:
+        pass
+    return factories
+
+def measure_construction(create, rounds=5):
+    """Tagger作成（辞書読み込み）の所要時間の中央値（ミリ秒）"""
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        create()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[rounds // 2] * 1000
+
+def run_threads(threads, work):
+    """threads 個のスレッドで work(thread_index) を実行し、経過時間を返す"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, range(threads)))
+    return time.perf_counter() - start
+
+def bench_setups(create, parse, threads):
+    """
+    Taggerの使い方ごとのスループット（文字/秒）
+
+    - shared+lock: 1つのTaggerをロックで排他して共有
+    - per-call: 解析ごとにTaggerを作成
+    - pool: スレッドごとに事前作成したTagger（kokoro_core.TaggerPool と同じ方式）
+    - pool+batch: プールのTaggerで、文ごとではなく全文を1回で解析
+    """
+    text_chars = sum(len(s) for s in BENCH_SENTENCES)
+    total_chars = text_chars * ITERATIONS * threads
+    results = {}
+
+    shared = create()
+    lock = threading.Lock()
+    def shared_work(_):
+        for _ in range(ITERATIONS):
+            for sentence in BENCH_SENTENCES:
+                with lock:
+                    parse(shared, sentence)
+    results['shared+lock'] = run_threads(threads, shared_work)
+
+    # 作成コストが大きいため回数を減らして換算する
+    per_call_iterations = max(1, ITERATIONS // 20)
+    def per_call_work(_):
+        for _ in range(per_call_iterations):
+            for sentence in BENCH_SENTENCES:
+                parse(create(), sentence)
+    results['per-call'] = run_threads(threads, per_call_work) * ITERATIONS / per_call_iterations
+
+    pool = [create() for _ in range(threads)]
+    def pool_work(index):
+        for _ in range(ITERATIONS):
+            for sentence in BENCH_SENTENCES:
+                parse(pool[index], sentence)
+    results['pool'] = run_threads(threads, pool_work)
+
+    batch_text = "".join(BENCH_SENTENCES)
+    def batch_work(index):
+        for _ in range(ITERATIONS):
+            parse(pool[index], batch_text)
+    results['pool+batch'] = run_threads(threads, batch_work)
+
+    return {name: total_chars / elapsed for name, elapsed in results.items()}
+
+def bench_mecab(threads=4):
+    """Tagger作成コストと解析スループットのベンチマーク"""
+    print(f"🧪 MeCabスループットベンチマーク開始... ({threads}スレッド)")
+    factories = tagger_factories()
+    if not factories:
+        print("❌ 利用可能なTaggerがありません")
+        return
+
+    print(f"{'Tagger':<16} {'作成(ms)':>9} {'shared+lock':>12} {'per-call':>10} {'pool':>10} {'pool+batch':>11}  (文字/秒)")
+    for name, (create, parse) in factories.items():
+        construction_ms = measure_construction(create)
+        throughput = bench_setups(create, parse, threads)
+        print(f"{name:<16} {construction_ms:>9.1f} {throughput['shared+lock']:>12.0f} {throughput['per-call']:>10.0f} "
+              f"{throughput['pool']:>10.0f} {throughput['pool+batch']:>11.0f}")
+
+    print("🧪 ベンチマーク完了")
+
 if __name__ == "__main__":
-    test_mecab()
\ No newline at end of file
+    test_mecab()
+    print()
+    bench_mecab(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+メモリ計測とアドミッション制御
+リクエスト・ステージ単位のRSS増分を記録し、メモリ上限に近い場合は
+新しいリクエストを待機または拒否する
+"""
+
+import os
+import time
+import threading
+import tracemalloc
+from collections import deque
+
+# メモリ上限（MB、0で無効）と待機タイムアウト（秒）
+MEMORY_LIMIT_MB = float(os.environ.get('KOKORO_MEMORY_LIMIT_MB', '0'))
+ADMISSION_TIMEOUT = float(os.environ.get('KOKORO_ADMISSION_TIMEOUT', '10'))
+
+# リクエストのメモリ見積もり（MB）: 基本量 + 1文字あたりの量（言語別）
+BASE_REQUEST_MB = 40.0
+PER_CHAR_MB = {
+    'j': 0.25,
+    'z': 0.25,
+    'h': 0.2
+}
+DEFAULT_PER_CHAR_MB = 0.15
+
+# 直近のリクエスト記録数
+HISTORY_SIZE = 200
+
+REJECTED_MESSAGE = "❌ サーバーのメモリが不足しています。しばらくしてから再試行してください"
+
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_history = deque(maxlen=HISTORY_SIZE)
+_stage_peaks = {}
+_history_lock = threading.Lock()
+
+def get_rss_mb():
+    """現在のRSS（MB）を取得"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _page_size / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # /procがない環境ではピークRSSで代用（macOSはバイト単位）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+def estimate_request_mb(text, lang_code):
+    """テキスト長と言語からリクエストのメモリ使用量を見積もる"""
+    return BASE_REQUEST_MB + len(text) * PER_CHAR_MB.get(lang_code, DEFAULT_PER_CHAR_MB)
+
+class MemoryTracker:
+    """1リクエスト分のRSS増分をステージごとに記録する"""
+
+    def __init__(self, lang_code, text_length):
+        self.lang_code = lang_code
+        self.text_length = text_length
+        self.start_time = time.time()
+        self.start_mb = get_rss_mb()
+        self.peak_mb = self.start_mb
+        self._last_mb = self.start_mb
+        self.stages = {}
+
+    def sample(self):
+        """ピークRSSを更新（チャンク間などで呼ぶ）"""
+        rss = get_rss_mb()
+        if rss > self.peak_mb:
+            self.peak_mb = rss
+        return rss
+
+    def stage(self, name):
+        """直前のステージからのRSS増分を記録"""
+        rss = self.sample()
+        self.stages[name] = round(rss - self._last_mb, 2)
+        self._last_mb = rss
+
+    def finish(self, success):
+        """記録を履歴に保存"""
+        record = {
+            "time": self.start_time,
+            "language": self.lang_code,
+            "text_length": self.text_length,
+            "success": success,
+            "rss_start_mb": round(self.start_mb, 1),
+            "peak_delta_mb": round(self.peak_mb - self.start_mb, 2),
+            "stages": self.stages
+        }
+        with _history_lock:
+            _history.append(record)
+            for name, delta in self.stages.items():
+                _stage_peaks[name] = max(_stage_peaks.get(name, 0.0), delta)
+        return record
+
+class AdmissionGuard:
+    """
+    メモリ上限に基づくアドミッション制御
+
+    実行中リクエストの使用量は、見積もりの予約（アイドル時のRSS + 予約合計）と
+    現在のRSS（実際の使用量）の大きい方で数え、新しいリクエストの見積もりを
+    加えて上限を超える場合は、他のリクエストの完了を待つ。タイムアウトした
+    場合は拒否する。実行中のリクエストがなければ常に受け付ける。
+    """
+
+    def __init__(self, limit_mb=MEMORY_LIMIT_MB, timeout=ADMISSION_TIMEOUT):
+        self.limit_mb = limit_mb
+        self.timeout = timeout
+        self.reserved_mb = 0.0
+        self.in_flight = 0
+        self.waiting = 0
+        # 実行中のリクエストがないときのRSS（予約分はこれに上乗せして数える）
+        self.baseline_mb = 0.0
+        self._condition = threading.Condition()
+
+    def _fits(self, estimate_mb):
+        if self.in_flight == 0:
+            self.baseline_mb = get_rss_mb()
+            return True
+        # 実行中のリクエストのメモリは現在のRSSにも予約にも含まれるため、二重に数えない
+        return max(get_rss_mb(), self.baseline_mb + self.reserved_mb) + estimate_mb <= self.limit_mb
+
+    def acquire(self, estimate_mb, timeout=None):
+        """見積もり分を予約（受け付けた場合True、timeoutを省略した場合は既定の待機時間）"""
+        with self._condition:
+            if self.limit_mb > 0 and not self._fits(estimate_mb):
+                deadline = time.time() + (self.timeout if timeout is None else min(timeout, self.timeout))
+                self.waiting += 1
+                try:
+                    while not self._fits(estimate_mb):
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return False
+                        # RSSは他スレッドの解放でも下がるので定期的に再確認
+                        self._condition.wait(min(remaining, 0.5))
+                finally:
+                    self.waiting -= 1
+            self.reserved_mb += estimate_mb
+            self.in_flight += 1
+            return True
+
+    def release(self, estimate_mb):
+        """予約を解放して待機中のリクエストを起こす"""
+        with self._condition:
+            self.reserved_mb = max(0.0, self.reserved_mb - estimate_mb)
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def get_status(self):
+        with self._condition:
+            return {
+                "limit_mb": self.limit_mb,
+                "reserved_mb": round(self.reserved_mb, 1),
+                "in_flight": self.in_flight,
+                "waiting": self.waiting
+            }
+
+admission_guard = AdmissionGuard()
+
+def set_tracemalloc(enabled, frames=1):
+    """tracemallocによる割り当てサンプリングを開始・停止"""
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return tracemalloc.is_tracing()
+
+def get_tracemalloc_top(limit=10):
+    """割り当て量の多い箇所を取得（tracemalloc有効時のみ）"""
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot()
+    top = []
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        top.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count
+        })
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "current_mb": round(current / (1024 * 1024), 2),
+        "peak_mb": round(peak / (1024 * 1024), 2),
+        "top": top
+    }
+
+def get_memory_report(recent=20, top=10):
+    """メモリ状況のレポートを取得"""
+    with _history_lock:
+        history = list(_history)[-recent:] if recent else []
+        stage_peaks = dict(_stage_peaks)
+    return {
+        "rss_mb": round(get_rss_mb(), 1),
+        "admission": admission_guard.get_status(),
+        "stage_peak_delta_mb": stage_peaks,
+        "recent_requests": history,
+        "tracemalloc": get_tracemalloc_top(top)
+    }
+
+# 起動時からtracemallocを有効にする場合はフレーム数を指定
+if int(os.environ.get('KOKORO_TRACEMALLOC', '0')) > 0:
+    set_tracemalloc(True, int(os.environ['KOKORO_TRACEMALLOC']))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+過負荷時の段階的な品質切り下げ（グレースフルデグラデーション）
+直近のリクエストのp95レイテンシと待ち時間をSLOと比べ、超えている間は
+一定間隔ごとに切り下げレベルを上げ、余裕が戻れば1段ずつ元に戻す
+
+レベル:
+    0 normal          通常
+    1 short_first     最初のセグメントを短くする（最初の音声を早く返す）
+    2 fast_backend    高速なバックエンド（量子化モデル）で合成する（設定時のみ）
+    3 low_sample_rate 出力サンプルレートを下げる
+    4 shed_bulk       バッチ・ジョブ等の一括処理を受け付けない・停止する
+"""
+
+import os
+import time
+import threading
+from collections import deque
+import numpy as np
+
+# 有効化（既定は無効）
+OVERLOAD_CONTROL = os.environ.get('KOKORO_OVERLOAD_CONTROL', '0') == '1'
+# SLO: リクエスト全体のp95レイテンシと待ち時間（ミリ秒）
+SLO_P95_MS = float(os.environ.get('KOKORO_SLO_P95_MS', '3000'))
+SLO_QUEUE_WAIT_MS = float(os.environ.get('KOKORO_SLO_QUEUE_WAIT_MS', '500'))
+# 許容する失敗（アドミッション拒否・期限切れ）の割合
+SLO_ERROR_RATE = float(os.environ.get('KOKORO_SLO_ERROR_RATE', '0.05'))
+# 上げるレベルの上限（例: 3ならバッチ・ジョブは止めない）
+MAX_LEVEL = int(os.environ.get('KOKORO_OVERLOAD_MAX_LEVEL', '4'))
+# 判定に使う直近の期間（秒）と、レベルを変えるまでの最短間隔（秒）
+WINDOW_SECONDS = float(os.environ.get('KOKORO_OVERLOAD_WINDOW', '30'))
+ESCALATE_INTERVAL = 5.0
+RECOVER_INTERVAL = 15.0
+# SLOに対する負荷の割合がこれ未満になったら1段戻す（上げ下げを繰り返さないように間を空ける）
+RECOVER_RATIO = 0.7
+MIN_SAMPLES = 5
+# リクエストが途絶えた後の回復判定で、読み出し時に再評価する最短間隔（秒）
+IDLE_EVALUATE_INTERVAL = 1.0
+
+LEVELS = ('normal', 'short_first', 'fast_backend', 'low_sample_rate', 'shed_bulk')
+LEVEL_SHORT_FIRST = 1
+LEVEL_FAST_BACKEND = 2
+LEVEL_LOW_SAMPLE_RATE = 3
+LEVEL_SHED_BULK = 4
+
+# レベル1以上で使う最初のセグメントの最大文字数
+DEGRADED_FIRST_SEGMENT_MAX_CHARS = int(os.environ.get('KOKORO_DEGRADED_FIRST_SEGMENT_MAX_CHARS', '24'))
+# レベル3以上の出力サンプルレート
+DEGRADED_SAMPLE_RATE = int(os.environ.get('KOKORO_DEGRADED_SAMPLE_RATE', '16000'))
+
+SHED_MESSAGE = "❌ サーバーが混雑しているため一括処理を受け付けていません。しばらくしてから再試行してください"
+
+class OverloadController:
+    """
+    SLOに基づく切り下げレベルの制御
+
+    負荷（p95レイテンシ / SLO、待ち時間p95 / SLO、失敗率 / 許容失敗率 の最大）が1を超えている間は
+    ESCALATE_INTERVAL ごとに1段上げ、RECOVER_RATIO 未満の状態が RECOVER_INTERVAL 続けば
+    1段戻す。リクエストがなくなれば記録が期間外になり、自然に通常へ戻る。
+    """
+
+    def __init__(self, enabled=OVERLOAD_CONTROL, slo_p95_ms=SLO_P95_MS, slo_queue_wait_ms=SLO_QUEUE_WAIT_MS,
+                 max_level=MAX_LEVEL, window=WINDOW_SECONDS, slo_error_rate=SLO_ERROR_RATE):
+        self.enabled = enabled
+        self.slo_p95 = slo_p95_ms / 1000
+        self.slo_queue_wait = slo_queue_wait_ms / 1000
+        self.slo_error_rate = slo_error_rate
+        self.max_level = max(0, min(max_level, len(LEVELS) - 1))
+        self.window = window
+        self._level = 0
+        self._skipped = set()
+        self._changed_at = time.monotonic()
+        self._evaluated_at = self._changed_at
+        self._samples = deque()
+        self._pressure = 0.0
+        self._lock = threading.Lock()
+
+    def skip(self, level):
+        """使えないレベルを飛ばす（高速バックエンド未設定時など）"""
+        self._skipped.add(level)
+
+    def observe(self, latency, queue_wait, failed=False):
+        """
+        リクエストのレイテンシと待ち時間（秒）を記録
+
+        過負荷で拒否・期限切れになったリクエストも failed=True で記録する
+        （成功したものだけでは、最も混雑している間に記録が減って負荷を低く見積もるため）
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, queue_wait, failed))
+            self._evaluate()
+
+    def _evaluate(self):
+        now = time.monotonic()
+        self._evaluated_at = now
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+        if len(self._samples) >= MIN_SAMPLES:
+            latencies = np.array([s[1] for s in self._samples])
+            waits = np.array([s[2] for s in self._samples])
+            failure_rate = sum(1 for s in self._samples if s[3]) / len(self._samples)
+            self._pressure = max(float(np.percentile(latencies, 95)) / self.slo_p95,
+                                 float(np.percentile(waits, 95)) / self.slo_queue_wait,
+                                 failure_rate / self.slo_error_rate if self.slo_error_rate > 0 else 0.0)
+        else:
+            self._pressure = 0.0
+
+        elapsed = now - self._changed_at
+        if self._pressure > 1.0 and elapsed >= ESCALATE_INTERVAL:
+            self._step(1, now)
+        elif self._pressure < RECOVER_RATIO and elapsed >= RECOVER_INTERVAL:
+            self._step(-1, now)
+
+    def _step(self, direction, now):
+        level = self._level + direction
+        while level in self._skipped:
+            level += direction
+        if 0 <= level <= self.max_level:
+            self._set_level(level, now)
+
+    def _set_level(self, level, now):
+        print(f"⚠️  過負荷制御: レベル {self._level}({LEVELS[self._level]}) → {level}({LEVELS[level]}) "
+              f"負荷 {self._pressure:.2f}")
+        self._level = level
+        self._changed_at = now
+
+    @property
+    def level(self):
+        """
+        現在の切り下げレベル
+
+        判定は observe() で行い、読み出しは判定済みのレベルを返す。
+        リクエストが途絶えても戻れるよう、切り下げ中で IDLE_EVALUATE_INTERVAL 以上
+        判定していなければ読み出し時にも判定する
+        """
+        if not self.enabled:
+            return 0
+        if self._level == 0 or time.monotonic() - self._evaluated_at < IDLE_EVALUATE_INTERVAL:
+            return self._level
+        with self._lock:
+            if time.monotonic() - self._evaluated_at >= IDLE_EVALUATE_INTERVAL:
+                self._evaluate()
+            return self._level
+
+    def at_least(self, level):
+        return self.level >= level
+
+    def get_status(self):
+        level = self.level
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "level": level,
+                "name": LEVELS[level],
+                "pressure": round(self._pressure, 2),
+                "samples": len(self._samples),
+                "slo_p95_ms": self.slo_p95 * 1000,
+                "slo_queue_wait_ms": self.slo_queue_wait * 1000,
+                "slo_error_rate": self.slo_error_rate
+            }
+
+def resample(audio, source_rate, target_rate):
+    """帯域制限したFFTリサンプリング（ダウンサンプリング用）"""
+    if source_rate == target_rate or len(audio) == 0:
+        return audio
+    length = int(round(len(audio) * target_rate / source_rate))
+    spectrum = np.fft.rfft(audio)[:length // 2 + 1]
+    return (np.fft.irfft(spectrum, length) * (length / len(audio))).astype(np.float32)
+
+overload_controller = OverloadController()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+事前レンダリング済みフレーズバンク
+定型文（IVRプロンプト等）を音声・速度ごとに事前合成してパックファイルに格納し、
+メモリマップしたハッシュインデックスで完全一致検索する
+
+ファイル構成（<path> はバンクのパス接頭辞）:
+    <path>.json                 現在のバージョンを指すマニフェスト（最後に置き換える）
+    <path>-<version>.pcm        16bit PCM音声を連結したパックファイル
+    <path>-<version>.index.npy  キーのハッシュでソートしたインデックス
+
+使い方:
+    python phrase_bank.py build --phrases prompts.txt --voices af_heart,jf_alpha \\
+        --speeds 1.0,1.2 --output banks/ivr
+    KOKORO_PHRASE_BANK=banks/ivr python server_prod.py
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import struct
+import hashlib
+import argparse
+import threading
+import numpy as np
+
+PHRASE_BANK_PATH = os.environ.get('KOKORO_PHRASE_BANK')
+# マニフェストの更新確認間隔（秒）
+RELOAD_CHECK_INTERVAL = float(os.environ.get('KOKORO_PHRASE_BANK_RELOAD_INTERVAL', '5'))
+
+INDEX_DTYPE = np.dtype([('key', '<u8'), ('offset', '<u8'), ('length', '<u8')])
+
+def phrase_key(text, voice, speed):
+    """(テキスト, 音声, 速度) の64bitハッシュキー"""
+    payload = f"{voice}\0{float(speed):.2f}\0{text.strip()}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), 'little')
+
+def wav_header(num_samples, sample_rate, bits=16, channels=1):
+    """PCM WAVヘッダー（44バイト）を作成"""
+    block_align = channels * bits // 8
+    data_size = num_samples * block_align
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits,
+        b'data', data_size
+    )
+
+class PhraseBank:
+    """メモリマップしたフレーズバンク（マニフェスト更新時に自動再読み込み）"""
+
+    def __init__(self, path, check_interval=RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._state = None
+        self._manifest_mtime = None
+        self._last_check = 0.0
+        self.reload()
+
+    @property
+    def manifest_path(self):
+        return f"{self.path}.json"
+
+    def reload(self):
+        """マニフェストを読み、新しいバージョンのファイルをマップする"""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            directory = os.path.dirname(self.path)
+            index = np.load(os.path.join(directory, manifest['index']), mmap_mode='r')
+            audio_path = os.path.join(directory, manifest['audio'])
+            if os.path.getsize(audio_path) > 0:
+                audio = np.memmap(audio_path, dtype='<i2', mode='r')
+            else:
+                audio = np.zeros(0, dtype='<i2')
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  フレーズバンクの読み込みに失敗: {e}")
+            return False
+        # 参照の差し替えのみで切り替える（使用中の古いマップはGCまで有効）
+        self._state = (index, audio, manifest)
+        self._manifest_mtime = mtime
+        print(f"フレーズバンク読み込み: {self.path} (バージョン: {manifest['version']}, {len(index)}件)")
+        return True
+
+    def _maybe_reload(self):
+        now = time.time()
+        if now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            try:
+                mtime = os.stat(self.manifest_path).st_mtime
+            except OSError:
+                return
+            if mtime != self._manifest_mtime:
+                self.reload()
+
+    def lookup(self, text, voice, speed):
+        """
+        完全一致するフレーズを検索
+
+        Returns:
+            np.ndarray: パックファイル上の16bit PCMスライス（コピーなし）、見つからなければNone
+        """
+        self._maybe_reload()
+        state = self._state
+        if state is None:
+            return None
+        index, audio, _ = state
+        key = phrase_key(text, voice, speed)
+        position = int(np.searchsorted(index['key'], key))
+        if position >= len(index) or int(index['key'][position]) != key:
+            return None
+        entry = index[position]
+        offset = int(entry['offset'])
+        return audio[offset:offset + int(entry['length'])]
+
+    def get_status(self):
+        state = self._state
+        if state is None:
+            return {"path": self.path, "loaded": False}
+        index, audio, manifest = state
+        return {
+            "path": self.path,
+            "loaded": True,
+            "version": manifest['version'],
+            "entries": len(index),
+            "audio_mb": round(audio.nbytes / (1024 * 1024), 1)
+        }
+
+phrase_bank = PhraseBank(PHRASE_BANK_PATH) if PHRASE_BANK_PATH else None
+
+def lookup_phrase(text, voice, speed):
+    """設定済みのフレーズバンクから16bit PCMスライスを検索"""
+    if phrase_bank is None:
+        return None
+    return phrase_bank.lookup(text, voice, speed)
+
+def lookup_phrase_wav(text, voice, speed, sample_rate=24000):
+    """フレーズバンクのヒットをWAVバイト列で返す（ヘッダー + PCMスライス）"""
+    pcm = lookup_phrase(text, voice, speed)
+    if pcm is None:
+        return None
+    return wav_header(len(pcm), sample_rate) + pcm.tobytes()
+
+def build_phrase_bank(phrases, voices, speeds, output):
+    """
+    フレーズ一覧を合成してバンクを作成
+
+    Args:
+        phrases (list): フレーズ一覧
+        voices (list): 音声一覧
+        speeds (list): 速度一覧
+        output (str): 出力パス接頭辞
+    """
+    # generate_audio_data は既存のフレーズバンク・速度違いのキャッシュを先に参照するため、
+    # 古い音声や伸縮した音声を取り込まないよう毎回合成する generate_audio_stream を使う
+    from kokoro_core import generate_audio_stream, normalize_voice, to_pcm16
+
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    directory = os.path.dirname(output) or '.'
+    os.makedirs(directory, exist_ok=True)
+    audio_name = f"{os.path.basename(output)}-{version}.pcm"
+    index_name = f"{os.path.basename(output)}-{version}.index.npy"
+
+    entries = []
+    offset = 0
+    total = len(phrases) * len(voices) * len(speeds)
+    start = time.time()
+    with open(os.path.join(directory, audio_name), 'wb') as audio_file:
+        for voice in voices:
+            for speed in speeds:
+                for phrase in phrases:
+                    try:
+                        chunks = list(generate_audio_stream(phrase, voice, speed))
+                    except Exception as e:
+                        print(f"⚠️  スキップ: {phrase[:30]} ({voice}, {speed}): {e}")
+                        continue
+                    if not chunks:
+                        print(f"⚠️  スキップ: {phrase[:30]} ({voice}, {speed}): 音声が生成されませんでした")
+                        continue
+                    pcm = to_pcm16(np.concatenate(chunks))
+                    audio_file.write(pcm)
+                    length = len(pcm) // 2
+                    # 検索時と同じく正規化した音声指定をキーにする（ブレンド音声の書き方の違いを吸収）
+                    entries.append((phrase_key(phrase, normalize_voice(voice), speed), offset, length))
+                    offset += length
+                    print(f"[{len(entries)}/{total}] {voice} x{speed}: {phrase[:40]}")
+
+    index = np.array(entries, dtype=INDEX_DTYPE)
+    index.sort(order='key')
+    duplicates = np.flatnonzero(np.diff(index['key']) == 0)
+    if duplicates.size:
+        print(f"⚠️  重複フレーズ: {duplicates.size}件（先頭のものを使用）")
+    np.save(os.path.join(directory, index_name), index)
+
+    # マニフェストを原子的に置き換えてサーバーに新バージョンを通知
+    manifest = {"version": version, "audio": audio_name, "index": index_name,
+                "voices": voices, "speeds": speeds, "entries": len(index)}
+    tmp_manifest = f"{output}.json.tmp"
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_manifest, f"{output}.json")
+
+    # 古いバージョンを削除（マップ中のサーバーはファイルを開いたまま使い続けられる）
+    for old in glob.glob(f"{output}-*.pcm") + glob.glob(f"{output}-*.index.npy"):
+        if os.path.basename(old) not in (audio_name, index_name):
+            os.remove(old)
+
+    print(f"✅ フレーズバンク作成完了: {output} ({len(index)}件, "
+          f"{offset * 2 / (1024 * 1024):.1f}MB, {time.time() - start:.1f}秒)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Kokoroフレーズバンク")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='フレーズ一覧からバンクを作成')
+    build.add_argument('--phrases', required=True, help='1行1フレーズのテキストファイル')
+    build.add_argument('--voices', default='af_heart', help='カンマ区切りの音声一覧')
+    build.add_argument('--speeds', default='1.0', help='カンマ区切りの速度一覧')
+    build.add_argument('--output', required=True, help='出力パス接頭辞（例: banks/ivr）')
+    info = subparsers.add_parser('info', help='バンクの情報を表示')
+    info.add_argument('path', help='バンクのパス接頭辞')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        with open(args.phrases, encoding='utf-8') as f:
+            phrases = [line.strip() for line in f if line.strip()]
+        voices = [v.strip() for v in args.voices.split(',') if v.strip()]
+        speeds = [float(s) for s in args.speeds.split(',') if s.strip()]
+        build_phrase_bank(phrases, voices, speeds, args.output)
+    elif args.command == 'info':
+        bank = PhraseBank(args.path)
+        print(json.dumps(bank.get_status(), ensure_ascii=False, indent=2))
+        if bank.get_status()["loaded"]:
+            return 0
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
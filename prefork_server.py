@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Pre-fork本番サーバー
+親プロセスでモデル・音声パックを読み込みウォームアップしてからワーカーをforkし、
+重みをコピーオンライトで共有する
+
+長時間の運用でワーカーのRSSが増え続ける（アロケーターの断片化など）対策として、
+一定数のリクエストを処理したワーカーや、RSSが上限を超えたワーカーを入れ替える。
+入れ替えは 代わりのワーカーを起動・ウォームアップ → 古いワーカーの受付停止 →
+処理中のリクエストの完了を待って終了 の順に行い、処理枠を減らさない。
+"""
+
+import os
+import gc
+import sys
+import time
+import atexit
+import random
+import signal
+import socket
+import threading
+
+# ワーカー設定（環境変数で上書き可能）
+HOST = os.environ.get('KOKORO_HOST', '0.0.0.0')
+PORT = int(os.environ.get('KOKORO_PORT', '8000'))
+WORKERS = int(os.environ.get('KOKORO_WORKERS', '2'))
+WARMUP_LANGUAGES = os.environ.get('KOKORO_WARMUP_LANGUAGES', 'a,j').split(',')
+MEMORY_REPORT_INTERVAL = int(os.environ.get('KOKORO_MEMORY_REPORT_INTERVAL', '300'))
+# ワーカーの入れ替え条件（0で無効）: 処理したリクエスト数、RSS（MB）
+MAX_REQUESTS = int(os.environ.get('KOKORO_MAX_REQUESTS', '0'))
+MAX_WORKER_RSS_MB = float(os.environ.get('KOKORO_MAX_WORKER_RSS_MB', '0'))
+# 全ワーカーが同時に入れ替わらないようにリクエスト数の上限をばらつかせる割合
+MAX_REQUESTS_JITTER = 0.1
+# 入れ替え・停止時に処理中のリクエスト・ジョブの完了を待つ最大時間（秒）
+DRAIN_TIMEOUT = float(os.environ.get('KOKORO_DRAIN_TIMEOUT', '120'))
+RSS_CHECK_INTERVAL = 10
+# 代わりのワーカーのウォームアップを待つ最大時間（秒）
+READY_TIMEOUT = 120
+
+def read_memory_stats(pid):
+    """
+    /proc/<pid>/smaps_rollup からメモリ使用量を取得（KB単位）
+
+    Returns:
+        dict: rss, pss, uss（プロセス固有: Private_Clean + Private_Dirty）, shared
+    """
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        "rss": fields.get('Rss', 0),
+        "pss": fields.get('Pss', 0),
+        "uss": fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        "shared": fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    }
+
+def report_memory(parent_pid, worker_pids):
+    """親・ワーカーのRSS/PSS/USSを表示"""
+    print("メモリ使用量 (MB):")
+    print(f"  {'PID':>8} {'役割':<6} {'RSS':>8} {'PSS':>8} {'USS':>8} {'共有':>8}")
+    total_pss = 0
+    for pid, role in [(parent_pid, '親')] + [(p, 'worker') for p in worker_pids]:
+        stats = read_memory_stats(pid)
+        if stats is None:
+            continue
+        total_pss += stats['pss']
+        print(f"  {pid:>8} {role:<6} {stats['rss'] / 1024:>8.1f} {stats['pss'] / 1024:>8.1f} "
+              f"{stats['uss'] / 1024:>8.1f} {stats['shared'] / 1024:>8.1f}")
+    print(f"  合計PSS: {total_pss / 1024:.1f} MB")
+
+def create_listen_socket():
+    """全ワーカーで共有するリッスンソケットを作成"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+class DrainingApp:
+    """
+    処理中のリクエスト数を数えるWSGIラッパー
+
+    処理したリクエスト数が max_requests に達したら on_limit を1回呼ぶ。
+    受付停止後のレスポンスには Connection: close を付け、keep-aliveの接続を閉じさせる。
+    """
+
+    def __init__(self, app, max_requests=0, on_limit=None):
+        self.app = app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self.in_flight = 0
+        self.handled = 0
+        self.draining = False
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.in_flight += 1
+
+        def _start_response(status, headers, exc_info=None):
+            if self.draining:
+                headers = [(k, v) for k, v in headers if k.lower() != 'connection'] + [('Connection', 'close')]
+            return start_response(status, headers, exc_info)
+
+        try:
+            return _TrackedBody(self.app(environ, _start_response), self._finished)
+        except BaseException:
+            self._finished()
+            raise
+
+    def _finished(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.handled += 1
+            reached = self.max_requests and self.handled == self.max_requests
+        if reached and self.on_limit:
+            self.on_limit()
+
+class _TrackedBody:
+    """レスポンス本体を送り終えて close されたら完了を通知する"""
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.on_close()
+
+def _listening_servers(server):
+    """waitressのサーバーからリッスン中のディスパッチャーを取得"""
+    from waitress.server import BaseWSGIServer
+    # ソケットが1つならサーバー自体、複数なら MultiSocketServer の map に含まれる
+    if isinstance(server, BaseWSGIServer):
+        return [server]
+    return [d for d in list(server.map.values()) if isinstance(d, BaseWSGIServer)]
+
+def drain_worker(server, wsgi, timeout):
+    """
+    受付を止め、処理中のリクエスト・ジョブの完了を待ってから終了する
+
+    リッスンソケットは他のワーカーと共有しているため、このワーカーが受け付けなくなっても
+    新しい接続は他のワーカーが受け取る
+    """
+    from jobs import get_job_queue
+
+    wsgi.draining = True
+    for listener in _listening_servers(server):
+        listener.accepting = False
+        # 待機中のkeep-alive接続は閉じる（処理中の接続はレスポンス後に閉じる）
+        for channel in list(listener.active_channels.values()):
+            if not channel.requests:
+                channel.will_close = True
+
+    def _wait_and_exit():
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            open_channels = sum(len(listener.active_channels) for listener in _listening_servers(server))
+            if wsgi.in_flight == 0 and open_channels == 0:
+                break
+            time.sleep(0.1)
+        else:
+            print(f"⚠️  ワーカー {os.getpid()}: 待機時間内に完了しなかったリクエスト {wsgi.in_flight}件")
+        get_job_queue().drain(max(0.0, deadline - time.time()))
+        print(f"ワーカー {os.getpid()} 終了 (処理したリクエスト: {wsgi.handled})")
+        # os._exit では atexit が呼ばれないため、ログの書き出し等を先に行う
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        os._exit(0)
+
+    threading.Thread(target=_wait_and_exit, daemon=True).start()
+
+def send_control(fd, message):
+    """親プロセスへ通知（1行のメッセージ）"""
+    try:
+        os.write(fd, f"{message}\n".encode())
+    except OSError:
+        pass
+
+def run_worker(app, sock, threads, control_fd):
+    """ワーカープロセス本体（fork後に実行）"""
+    import torch
+    from waitress.server import create_server
+    from jobs import get_job_queue
+    from kokoro_core import warm_up
+
+    # 親ではOpenMPスレッドプールを起動していないので、ここで初めて設定する
+    torch.set_num_threads(threads)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # このプロセスで一度推論してOpenMPスレッドプール等を初期化してから受け付ける
+    # （入れ替え直後のリクエストがコールドスタートにならないように）
+    warm_up(WARMUP_LANGUAGES)
+
+    # 上限をばらつかせて、同時に起動したワーカーが一斉に入れ替わらないようにする
+    max_requests = int(MAX_REQUESTS * (1 + random.uniform(0, MAX_REQUESTS_JITTER))) if MAX_REQUESTS else 0
+    wsgi = DrainingApp(app, max_requests, lambda: send_control(control_fd, "recycle requests"))
+    server = create_server(
+        wsgi,
+        sockets=[sock],
+        threads=threads,
+        connection_limit=50,
+        cleanup_interval=30,
+        channel_request_lookahead=5
+    )
+    # SIGTERMで受付を止め、処理中のリクエストを終えてから終了する
+    signal.signal(signal.SIGTERM, lambda *_: drain_worker(server, wsgi, DRAIN_TIMEOUT))
+
+    # ジョブワーカーはスレッドを使うのでfork後に起動する（回復は親で起動時に1回だけ行う）
+    get_job_queue().start(recover=False)
+
+    send_control(control_fd, "ready")
+    server.run()
+
+class Worker:
+    """親プロセスから見たワーカーの状態"""
+
+    def __init__(self, pid, control_fd):
+        self.pid = pid
+        self.control_fd = control_fd
+        self.started = time.time()
+        self.ready = False
+        self.recycle_reason = None
+        self.replacement = None
+        self.draining = False
+        self._buffer = b""
+
+    def read_messages(self):
+        """ワーカーからの通知を読み出す"""
+        try:
+            data = os.read(self.control_fd, 4096)
+        except BlockingIOError:
+            return []
+        except OSError:
+            data = b""
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        return [line.decode() for line in lines if line]
+
+    def close(self):
+        try:
+            os.close(self.control_fd)
+        except OSError:
+            pass
+
+def spawn_worker(app, sock, threads, workers=()):
+    """ワーカーをforkして Worker を返す"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            for worker in workers:
+                worker.close()
+            run_worker(app, sock, threads, write_fd)
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    os.set_blocking(read_fd, False)
+    return Worker(pid, read_fd)
+
+def main():
+    import multiprocessing
+    import torch
+
+    cpu_count = multiprocessing.cpu_count()
+    threads = max(1, cpu_count // WORKERS)
+
+    print("Kokoro-82M Pre-forkサーバー起動中...")
+    print(f"- ワーカー数: {WORKERS}")
+    print(f"- ワーカーあたりスレッド数: {threads}")
+    print(f"- ウォームアップ言語: {', '.join(WARMUP_LANGUAGES)}")
+    print(f"- 入れ替え: {MAX_REQUESTS or '無効'} リクエスト / RSS {MAX_WORKER_RSS_MB or '無効'} MB")
+
+    # fork後の子でOpenMPが固まらないよう、親ではスレッドプールを起動しない
+    torch.set_num_threads(1)
+
+    # 親プロセスでアプリ・モデル・音声パックを読み込む
+    from lightweight_tts import app
+    from kokoro_core import warm_up
+    warm_up(WARMUP_LANGUAGES)
+
+    # 読み込み済みオブジェクトをGC対象外にし、fork後のGC走査による
+    # ページへの書き込み（コピー発生）を防ぐ
+    gc.collect()
+    gc.freeze()
+
+    # 中断されたジョブの回復は親で1回だけ行う（各ワーカーで行うと他のワーカーの実行中ジョブを戻してしまう）
+    from jobs import get_job_queue
+    get_job_queue().recover()
+
+    sock = create_listen_socket()
+    parent_pid = os.getpid()
+    workers = {}
+
+    def add_worker():
+        worker = spawn_worker(app, sock, threads, workers.values())
+        workers[worker.pid] = worker
+        return worker
+
+    def recycle(worker, reason):
+        """代わりのワーカーを起動（準備完了後に古いワーカーを停止する）"""
+        if worker.recycle_reason or worker.draining:
+            return
+        worker.recycle_reason = reason
+        worker.replacement = add_worker().pid
+        print(f"♻️  ワーカー {worker.pid} を入れ替えます ({reason})、代わりのワーカー {worker.replacement} を準備中...")
+
+    def stop_worker(worker):
+        worker.draining = True
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    for _ in range(WORKERS):
+        add_worker()
+    print(f"🌐 http://{HOST}:{PORT}/ で待ち受け中")
+
+    running = True
+    def shutdown(signum, frame):
+        nonlocal running
+        running = False
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # ワーカーが初期化を終えた頃に一度メモリを報告
+    time.sleep(5)
+    report_memory(parent_pid, sorted(workers))
+    last_report = time.time()
+    last_rss_check = time.time()
+
+    while running:
+        # ワーカーからの通知（準備完了・入れ替え要求）
+        for worker in list(workers.values()):
+            for message in worker.read_messages():
+                if message == 'ready':
+                    worker.ready = True
+                elif message.startswith('recycle'):
+                    recycle(worker, message.split(' ', 1)[-1])
+
+        # 代わりのワーカーの準備ができたら古いワーカーを停止（処理中のリクエストは完了させる）
+        for worker in list(workers.values()):
+            if not worker.recycle_reason or worker.draining:
+                continue
+            replacement = workers.get(worker.replacement)
+            if replacement is None:
+                # 代わりのワーカーが起動に失敗した場合はやり直す
+                worker.recycle_reason = None
+                recycle(worker, "retry")
+            elif replacement.ready or time.time() - replacement.started >= READY_TIMEOUT:
+                print(f"♻️  ワーカー {worker.pid} を停止中 (代わり: {replacement.pid})")
+                stop_worker(worker)
+
+        # RSSが上限を超えたワーカーを入れ替える
+        if MAX_WORKER_RSS_MB and time.time() - last_rss_check >= RSS_CHECK_INTERVAL:
+            last_rss_check = time.time()
+            for worker in list(workers.values()):
+                stats = read_memory_stats(worker.pid)
+                if worker.ready and stats and stats['rss'] / 1024 > MAX_WORKER_RSS_MB:
+                    recycle(worker, f"RSS {stats['rss'] / 1024:.0f}MB")
+
+        # 終了したワーカーを片付け、想定外の終了なら再起動
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if not pid:
+                break
+            worker = workers.pop(pid, None)
+            if worker is None:
+                continue
+            worker.close()
+            if worker.draining:
+                print(f"♻️  ワーカー {pid} の入れ替え完了")
+            elif worker.recycle_reason and worker.replacement in workers:
+                # 入れ替え待ちのワーカーが停止前に終了した場合は、準備中の代わりのワーカーで補う
+                print(f"⚠️  入れ替え中のワーカー {pid} が終了しました (status={status})、"
+                      f"代わりのワーカー {worker.replacement} で継続")
+            elif running and not any(w.replacement == pid for w in workers.values()):
+                # 代わりのワーカーの起動失敗は入れ替え側でやり直す
+                print(f"⚠️  ワーカー {pid} が終了しました (status={status})、再起動中...")
+                add_worker()
+
+        if MEMORY_REPORT_INTERVAL and time.time() - last_report >= MEMORY_REPORT_INTERVAL:
+            report_memory(parent_pid, sorted(workers))
+            last_report = time.time()
+        time.sleep(1)
+
+    # 各ワーカーは受付を止め、処理中のリクエスト・ジョブを終えてから終了する
+    print("🛑 ワーカー停止中...")
+    for worker in workers.values():
+        stop_worker(worker)
+    deadline = time.time() + DRAIN_TIMEOUT + 10
+    while workers and time.time() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            worker = workers.pop(pid, None)
+            if worker:
+                worker.close()
+        else:
+            time.sleep(0.2)
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    sock.close()
+    print("✅ 停止完了")
+
+if __name__ == '__main__':
+    if not hasattr(os, 'fork'):
+        print("❌ Pre-forkモードはfork対応OS（Linux/macOS）のみ対応です")
+        sys.exit(1)
+    main()
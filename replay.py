@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+記録したトラフィック（traffic_recorder.py）の再生
+記録どおりの到着間隔（または倍率をかけた間隔）で、HTTPサーバー（server_prod.py など）か
+kokoro_core に直接リクエストを送り、レイテンシ・スループットを記録する。
+2つのビルドの結果を比較して差分を表示できる。
+
+テキストを記録していない場合は、記録された言語・文字数の代替テキストを使う
+（同じ記録からは常に同じテキストになるため、ビルド間で同じ負荷を再現できる）
+
+使い方:
+    python replay.py run traffic.jsonl --target http://localhost:8000 --output before.json
+    python replay.py run traffic.jsonl --target core --rate 2 --output after.json
+    python replay.py compare before.json after.json
+"""
+
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# 代替テキストの元になる文（言語コードごと）
+FILLER_SENTENCES = {
+    'a': ["Your order has shipped and will arrive soon.", "Please hold while we connect your call.",
+          "The meeting has been moved to three o'clock.", "Thank you for your patience today."],
+    'b': ["The train to London will depart from platform four.", "Please mind the gap when leaving the train."],
+    'j': ["ご注文の商品は本日発送されました。", "担当者におつなぎしますので少々お待ちください。",
+          "会議は午後三時に変更になりました。", "本日はご利用いただきありがとうございます。"],
+    'z': ["您的订单已经发货。", "请稍候，我们正在为您转接。", "会议改到下午三点。"],
+    'e': ["Su pedido ha sido enviado.", "Por favor espere mientras lo conectamos."],
+    'f': ["Votre commande a été expédiée.", "Veuillez patienter pendant que nous vous connectons."],
+    'h': ["आपका ऑर्डर भेज दिया गया है।", "कृपया प्रतीक्षा करें।"],
+    'i': ["Il suo ordine è stato spedito.", "La preghiamo di attendere in linea."],
+    'p': ["Seu pedido foi enviado.", "Por favor, aguarde enquanto conectamos sua chamada."]
+}
+
+def load_traffic(path, limit=None):
+    """
+    記録を読み込み到着順に並べる
+
+    path はワイルドカード可（ワーカーごとのファイル "traffic-*.jsonl" など）。
+    ローテーションされた path.1, path.2 ... も含める
+    """
+    files = set()
+    for file in glob.glob(path):
+        files.add(file)
+        files.update(glob.glob(f"{glob.escape(file)}.[0-9]*"))
+    records = []
+    for file in sorted(files):
+        with open(file, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: r['ts'])
+    return records[:limit] if limit else records
+
+def filler_text(shape, seed):
+    """記録された言語・文字数の代替テキスト（seedが同じなら同じテキスト）"""
+    if shape.get('text'):
+        return shape['text']
+    sentences = FILLER_SENTENCES.get(shape.get('lang'), FILLER_SENTENCES['a'])
+    joiner = "" if shape.get('lang') in ('j', 'z') else " "
+    chars = max(1, int(shape.get('chars', 0)))
+    start = int(hashlib.blake2b(str(seed).encode('utf-8'), digest_size=4).hexdigest(), 16)
+    parts, length, index = [], 0, start
+    while length < chars:
+        sentence = sentences[index % len(sentences)]
+        parts.append(sentence)
+        length += len(sentence) + len(joiner)
+        index += 1
+    return joiner.join(parts)[:chars].strip() or sentences[0]
+
+def build_payload(record, index):
+    """記録1行から再生用のリクエスト本文を作る"""
+    def item(shape, seed):
+        payload = {"text": filler_text(shape, shape.get('text_hash', seed)),
+                   "voice": shape.get('voice', 'af_heart'), "speed": shape.get('speed', 1.0)}
+        if shape.get('format'):
+            payload["format"] = shape['format']
+        return payload
+    if 'items' in record:
+        return {"items": [item(shape, f"{index}.{i}") for i, shape in enumerate(record['items'])]}
+    payload = item(record, index)
+    for key in ('first_segment', 'mixed_language'):
+        if key in record:
+            payload[key] = record[key]
+    return payload
+
+class HttpTarget:
+    """HTTPサーバーに記録と同じパスで送る"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+        self._requests = requests
+
+    def send(self, record, payload):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        try:
+            response = session.post(f"{self.base_url}{record['path']}", json=payload, timeout=300)
+            # ストリーミングレスポンスは最後まで受け取ってから完了とする
+            size = len(response.content)
+            return response.status_code < 400, response.status_code, size
+        except self._requests.RequestException as e:
+            return False, str(e), 0
+
+class CoreTarget:
+    """kokoro_core を同じプロセスで直接呼ぶ（HTTP・シリアライズを除いた合成だけの比較）"""
+
+    def __init__(self, records):
+        import kokoro_core
+        self.core = kokoro_core
+        languages = sorted({shape.get('lang', 'a') for r in records for shape in r.get('items', [r])})
+        kokoro_core.warm_up(languages, voices=sorted({
+            shape.get('voice', 'af_heart') for r in records for shape in r.get('items', [r])
+        }))
+
+    def send(self, record, payload):
+        if 'items' in payload:
+            results = self.core.generate_audio_batch(payload['items'])
+            samples = sum(len(audio) for audio, success, _ in results if success)
+            return all(success for _, success, _ in results), None, samples
+        audio, success, message = self.core.generate_audio_data(
+            payload['text'], payload['voice'], payload['speed'],
+            mixed_language=payload.get('mixed_language', False), first_segment=payload.get('first_segment')
+        )
+        return success, None if success else message, len(audio) if success else 0
+
+def replay(records, target, rate=1.0, concurrency=32):
+    """
+    記録を再生して1件ごとの結果を返す
+
+    rate は到着間隔の倍率（2なら2倍の速さ、0なら間隔を空けずに concurrency 件ずつ送る）
+    """
+    results = [None] * len(records)
+    origin = records[0]['ts'] if records else 0.0
+    start = time.time()
+
+    def run(index, record, scheduled):
+        payload = build_payload(record, index)
+        began = time.time()
+        try:
+            success, detail, size = target.send(record, payload)
+        except Exception as e:
+            # 送信側の例外も失敗として記録する（結果に欠けがあると集計できない）
+            success, detail, size = False, f"{type(e).__name__}: {e}", 0
+        finished = time.time()
+        shapes = record.get('items', [record])
+        results[index] = {
+            "index": index,
+            "path": record.get('path'),
+            "lang": shapes[0].get('lang') if shapes else None,
+            "items": len(shapes),
+            "chars": sum(s.get('chars', 0) for s in shapes),
+            "success": success,
+            "detail": detail,
+            "size": size,
+            # 予定時刻からの送信の遅れ（同時実行数が足りないと増える）
+            "lag_ms": round((began - start - scheduled) * 1000, 1),
+            "latency_ms": round((finished - began) * 1000, 1),
+            "recorded_ms": record.get('duration_ms')
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, record in enumerate(records):
+            scheduled = (record['ts'] - origin) / rate if rate > 0 else 0.0
+            delay = start + scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, index, record, scheduled)
+    return results, time.time() - start
+
+def summarize(results, elapsed):
+    """全体と言語ごとのレイテンシ・スループット"""
+    def stats(rows):
+        latencies = np.array([r['latency_ms'] for r in rows if r['success']]) if rows else np.array([])
+        if latencies.size == 0:
+            latencies = np.array([0.0])
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if not r['success']),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 1)
+        }
+    summary = stats(results)
+    summary.update(
+        elapsed_s=round(elapsed, 2),
+        throughput_rps=round(len(results) / elapsed, 3) if elapsed > 0 else 0.0,
+        chars_per_s=round(sum(r['chars'] for r in results if r['success']) / elapsed, 1) if elapsed > 0 else 0.0,
+        max_lag_ms=max((r['lag_ms'] for r in results), default=0.0)
+    )
+    by_language = {}
+    for result in results:
+        by_language.setdefault(result['lang'] or '?', []).append(result)
+    summary["languages"] = {lang: stats(rows) for lang, rows in sorted(by_language.items())}
+    return summary
+
+def print_summary(summary):
+    print(f"件数 {summary['requests']}  エラー {summary['errors']}  経過 {summary['elapsed_s']}秒  "
+          f"{summary['throughput_rps']} req/s  {summary['chars_per_s']} 文字/s  最大送信遅れ {summary['max_lag_ms']}ms")
+    print(f"{'言語':<6} {'件数':>6} {'エラー':>6} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    for lang, stats in [('全体', summary)] + list(summary['languages'].items()):
+        print(f"{lang:<6} {stats['requests']:>6} {stats['errors']:>6} {stats['p50_ms']:>9.0f} "
+              f"{stats['p95_ms']:>9.0f} {stats['p99_ms']:>9.0f}")
+
+def compare(baseline, candidate):
+    """2つの結果の差分を表示（変化率は candidate / baseline - 1）"""
+    def delta(before, after):
+        if not before:
+            return "     -"
+        return f"{(after / before - 1) * 100:+6.1f}%"
+
+    print(f"基準: {baseline.get('label')}  比較: {candidate.get('label')}")
+    a, b = baseline['summary'], candidate['summary']
+    print(f"{'指標':<18} {'基準':>10} {'比較':>10} {'変化':>8}")
+    for key in ('throughput_rps', 'chars_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'errors', 'max_lag_ms'):
+        print(f"{key:<18} {a[key]:>10} {b[key]:>10} {delta(a[key], b[key]):>8}")
+    for lang in sorted(set(a['languages']) | set(b['languages'])):
+        before, after = a['languages'].get(lang), b['languages'].get(lang)
+        if before and after:
+            print(f"{lang + ' p95_ms':<18} {before['p95_ms']:>10} {after['p95_ms']:>10} "
+                  f"{delta(before['p95_ms'], after['p95_ms']):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Kokoroトラフィック再生")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help='記録を再生して結果を保存')
+    run.add_argument('traffic', help='traffic_recorder の記録ファイル')
+    run.add_argument('--target', default='http://localhost:8000', help='サーバーのURL、または core（kokoro_coreを直接呼ぶ）')
+    run.add_argument('--rate', type=float, default=1.0, help='到着間隔の倍率（2で2倍速、0で間隔なし）')
+    run.add_argument('--concurrency', type=int, default=32, help='同時に送る最大数')
+    run.add_argument('--limit', type=int, help='先頭から再生する件数')
+    run.add_argument('--label', help='結果に付ける名前（ビルド名など）')
+    run.add_argument('--output', help='結果を保存するJSONファイル')
+    diff = subparsers.add_parser('compare', help='2つの結果を比較')
+    diff.add_argument('baseline', help='基準の結果JSON')
+    diff.add_argument('candidate', help='比較する結果JSON')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.candidate, encoding='utf-8') as f:
+            candidate = json.load(f)
+        compare(baseline, candidate)
+        return 0
+
+    records = load_traffic(args.traffic, args.limit)
+    if not records:
+        print(f"❌ 記録がありません: {args.traffic}")
+        return 1
+    if args.target == 'core':
+        # /jobs は非同期の受付のみのため、合成だけを比べる場合は対象外
+        records = [r for r in records if r.get('path') != '/jobs']
+        if not records:
+            print(f"❌ 直接呼べる記録がありません（/jobs 以外の記録がありません）: {args.traffic}")
+            return 1
+        target = CoreTarget(records)
+    else:
+        target = HttpTarget(args.target)
+    span = records[-1]['ts'] - records[0]['ts']
+    print(f"▶ 再生開始: {len(records)}件 (記録期間 {span:.1f}秒, 倍率 {args.rate}) → {args.target}")
+    results, elapsed = replay(records, target, args.rate, args.concurrency)
+    summary = summarize(results, elapsed)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"label": args.label or args.output, "target": args.target, "rate": args.rate,
+                       "summary": summary, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+構造化リクエストログ
+リクエストごとの情報をprintで逐次出力する代わりに、1リクエスト1行（JSON）にまとめて
+キュー経由で別スレッドから出力する
+
+- リクエストスレッドはキューに積むだけ（満杯なら破棄してブロックしない）
+- リクエストIDを付与し（X-Request-IDヘッダーがあれば引き継ぐ）、ステージごとの所要時間をまとめる
+- サンプリング率を設定可能（失敗したリクエストは常に出力）
+- テキストは既定で文字数のみ出力（KOKORO_LOG_TEXT=hash でハッシュ、full で先頭部分）
+- KOKORO_REQUEST_LOG=0 でリクエストごとのログを無効化
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('KOKORO_LOG_LEVEL', 'INFO').upper()
+# json または text
+LOG_FORMAT = os.environ.get('KOKORO_LOG_FORMAT', 'json')
+REQUEST_LOG = os.environ.get('KOKORO_REQUEST_LOG', '1') != '0'
+SAMPLE_RATE = float(os.environ.get('KOKORO_LOG_SAMPLE_RATE', '1.0'))
+# テキストの出力方法: redact（文字数のみ）, hash, full
+LOG_TEXT = os.environ.get('KOKORO_LOG_TEXT', 'redact')
+LOG_QUEUE_SIZE = 10000
+FULL_TEXT_CHARS = 100
+
+# ログを出力しないパス（ヘルスチェック等の定期アクセス）
+IGNORED_PATHS = {'/health', '/tts/health', '/metrics', '/tts/metrics'}
+
+logger = logging.getLogger('kokoro')
+
+_current = contextvars.ContextVar('kokoro_request_log', default=None)
+_queue = None
+_listener = None
+_dropped = 0
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """キューが満杯なら待たずに破棄し、フォーマットは出力スレッドで行う"""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """1レコード1行のJSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "pid": record.process,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """人が読む用（key=value）"""
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def setup_logging():
+    """キューと出力スレッドを作成（fork後の子プロセスでも呼び直す）"""
+    global _queue, _listener
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    _queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue, handler)
+    logger.handlers[:] = [_NonBlockingQueueHandler(_queue)]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    _listener.start()
+
+def _flush():
+    """終了時にキューに残ったログを出力"""
+    try:
+        _listener.stop()
+    except Exception:
+        pass
+
+setup_logging()
+atexit.register(_flush)
+# 出力スレッドはforkで引き継がれないため、子プロセスで作り直す
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=setup_logging)
+
+def text_fields(text):
+    """ログに出すテキスト関連の項目（KOKORO_LOG_TEXT に従って秘匿）"""
+    fields = {"chars": len(text)}
+    if LOG_TEXT == 'hash':
+        fields["text_hash"] = hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+    elif LOG_TEXT == 'full':
+        fields["text"] = text[:FULL_TEXT_CHARS]
+    return fields
+
+class RequestLog:
+    """1リクエスト分の記録（ステージ別の所要時間と付加情報）"""
+
+    def __init__(self, kind, request_id=None):
+        self.kind = kind
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.sampled = REQUEST_LOG and random.random() < SAMPLE_RATE
+        self.fields = {}
+        self.stages = {}
+        self._start = time.perf_counter()
+        self._last = self._start
+        self._finished = False
+
+    def stage(self, name):
+        """直前のステージからの経過時間を記録（ミリ秒）"""
+        now = time.perf_counter()
+        self.stages[name] = round((now - self._last) * 1000, 1)
+        self._last = now
+
+    def annotate(self, **fields):
+        self.fields.update(fields)
+
+    def finish(self, status=None, error=None):
+        """まとめて1行出力（サンプリング対象外でも失敗時は出力）"""
+        if self._finished or not REQUEST_LOG:
+            return
+        self._finished = True
+        failed = error is not None or (status is not None and status >= 500) or self.fields.get('success') is False
+        if not (self.sampled or failed):
+            return
+        entry = {"request_id": self.request_id, "kind": self.kind}
+        if status is not None:
+            entry["status"] = status
+        entry["duration_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+        entry["stages"] = self.stages
+        entry.update(self.fields)
+        if error is not None:
+            entry["error"] = error
+        logger.log(logging.WARNING if failed else logging.INFO, "request", extra={"fields": entry})
+
+def current():
+    """実行中のリクエストの記録（なければNone）"""
+    return _current.get()
+
+def stage(name):
+    log = _current.get()
+    if log is not None:
+        log.stage(name)
+
+def annotate(**fields):
+    log = _current.get()
+    if log is not None:
+        log.annotate(**fields)
+
+def log_exception(message):
+    """例外をトレースバック付きで出力（実行中のリクエストIDを付ける）"""
+    log = _current.get()
+    fields = {"request_id": log.request_id} if log is not None else {}
+    logger.exception(message, extra={"fields": fields})
+
+@contextmanager
+def request_context(kind, request_id=None):
+    """
+    リクエストの記録を開始
+
+    既に記録中（HTTPハンドラー内など）ならそれを使い、出力も外側に任せる
+    """
+    log = _current.get()
+    if log is not None:
+        yield log
+        return
+    log = RequestLog(kind, request_id)
+    token = _current.set(log)
+    try:
+        yield log
+    except Exception as e:
+        log.finish(error=str(e))
+        raise
+    else:
+        log.finish()
+    finally:
+        _current.reset(token)
+
+def init_app(app, kind='http'):
+    """Flaskアプリにリクエストごとの記録とX-Request-IDヘッダーを追加"""
+    from flask import g, request
+
+    @app.before_request
+    def _begin_request_log():
+        if request.path in IGNORED_PATHS:
+            return
+        log = RequestLog(kind, request.headers.get('X-Request-ID'))
+        log.annotate(method=request.method, path=request.path)
+        g.request_log = log
+        g.request_log_token = _current.set(log)
+
+    @app.after_request
+    def _finish_request_log(response):
+        log = g.get('request_log')
+        if log is not None:
+            response.headers['X-Request-ID'] = log.request_id
+            log.finish(status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _reset_request_log(exc):
+        log = g.pop('request_log', None)
+        if log is None:
+            return
+        if exc is not None:
+            log.finish(status=500, error=str(exc))
+        try:
+            _current.reset(g.pop('request_log_token'))
+        except ValueError:
+            # before_request と別のコンテキストで呼ばれた場合
+            _current.set(None)
+
+def get_status():
+    return {
+        "request_log": REQUEST_LOG,
+        "sample_rate": SAMPLE_RATE,
+        "text": LOG_TEXT,
+        "queued": _queue.qsize() if _queue is not None else 0,
+        "dropped": _dropped
+    }
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+キャッシュ親和性ルーター
+複数の server_prod.py レプリカの前段に置き、同じリクエスト（テキスト・音声・速度）
+または同じ言語を一貫して同じノードに振り分ける
+
+- 仮想ノード付きのコンシステントハッシュで振り分け先を決定
+- 負荷上限付きハッシュ（bounded-load）で特定ノードへの偏りを防ぐ
+- 各ノードの /health（queue_depth, estimated_wait_ms, loaded_languages）を
+  定期的に取得し、停止・混雑中のノードを避ける
+- ジョブ（/jobs/<id>）・保存済み音声（/audio/<hash>.wav）はIDごとに保存したノードへ送る
+  （登録・合成時のレスポンスから保存先を覚え、不明なら404以外が返るまで各ノードに問い合わせる）
+"""
+
+import os
+import re
+import math
+import time
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
+import requests
+from flask import Flask, Response, jsonify, request
+from voices import detect_language, normalize_voice, validate_voice
+
+BACKENDS = [b.strip().rstrip('/') for b in
+            os.environ.get('KOKORO_BACKENDS', 'http://127.0.0.1:8001,http://127.0.0.1:8002').split(',')
+            if b.strip()]
+# 振り分けキー: request（テキスト・音声・速度）または language
+ROUTE_BY = os.environ.get('KOKORO_ROUTE_BY', 'request')
+# 負荷上限係数: 各ノードの負荷を平均の何倍までに抑えるか
+LOAD_FACTOR = float(os.environ.get('KOKORO_ROUTER_LOAD_FACTOR', '1.25'))
+# この推定待ち時間を超えるノードは他に候補があれば避ける
+MAX_WAIT_MS = float(os.environ.get('KOKORO_ROUTER_MAX_WAIT_MS', '5000'))
+HEALTH_INTERVAL = float(os.environ.get('KOKORO_ROUTER_HEALTH_INTERVAL', '1'))
+VIRTUAL_NODES = 100
+REQUEST_TIMEOUT = 120
+ROUTER_PORT = int(os.environ.get('KOKORO_ROUTER_PORT', '8080'))
+# 保存先を覚えておくジョブ・音声の数
+LOCATION_CACHE_SIZE = 100000
+
+# ノードごとに保存されるリソース（ジョブ・保存済み音声）のパス
+_RESOURCE_PATTERNS = [
+    re.compile(r'^/?jobs/([0-9a-f]{32})(?:/audio)?$'),
+    re.compile(r'^/?(?:tts/)?audio/([0-9a-f]{32})\.wav$')
+]
+
+# 転送しないホップバイホップヘッダー
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length'
+}
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def routing_key(data, route_by=ROUTE_BY):
+    """
+    リクエストボディから振り分けキーを作成
+
+    不正な音声・速度はノードが400を返すため、ここでは振り分けに使える値に寄せるだけにする
+    """
+    voice = data.get('voice', 'af_heart')
+    if not isinstance(voice, str) or validate_voice(voice):
+        voice = 'af_heart'
+    if route_by == 'language':
+        return f"lang:{detect_language('', voice)}"
+    speed = data.get('speed', 1.0)
+    if not isinstance(speed, (int, float)) or isinstance(speed, bool):
+        speed = 1.0
+    return f"{data.get('text', '')}\0{normalize_voice(voice)}\0{float(speed):.2f}"
+
+def resource_id(path):
+    """ノードごとに保存されるリソースのパスならそのID"""
+    for pattern in _RESOURCE_PATTERNS:
+        match = pattern.match(path)
+        if match:
+            return match.group(1)
+    return None
+
+class BackendState:
+    """ノードごとの状態（ルーター内の処理中数と /health の内容）"""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.estimated_wait_ms = 0.0
+        self.loaded_languages = []
+        self.last_error = None
+
+    def load(self):
+        # 他のルーターや直接アクセスの分も含め、大きい方を負荷とみなす
+        return max(self.in_flight, self.queue_depth)
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "estimated_wait_ms": self.estimated_wait_ms,
+            "loaded_languages": self.loaded_languages,
+            "last_error": self.last_error
+        }
+
+class ConsistentHashRouter:
+    """負荷上限付きコンシステントハッシュ"""
+
+    def __init__(self, backends, load_factor=LOAD_FACTOR, virtual_nodes=VIRTUAL_NODES):
+        self.backends = {url: BackendState(url) for url in backends}
+        self.load_factor = load_factor
+        self._lock = threading.Lock()
+        self._ring = sorted(
+            (_hash(f"{url}#{i}"), url) for url in backends for i in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in self._ring]
+        # リソースID → 保存先のノード
+        self._locations = OrderedDict()
+
+    def candidates(self, key):
+        """キーのハッシュ位置からリング上を時計回りにたどったノードの順序"""
+        start = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        seen = []
+        for i in range(len(self._ring)):
+            url = self._ring[(start + i) % len(self._ring)][1]
+            if url not in seen:
+                seen.append(url)
+                if len(seen) == len(self.backends):
+                    break
+        return seen
+
+    def acquire(self, key, exclude=()):
+        """
+        振り分け先を決めて処理中数を加算
+
+        平均負荷 × load_factor 未満のノードのうち、リング順で最初のものを選ぶ。
+        推定待ち時間が長いノードは、他に受け付け可能なノードがあれば避ける。
+        """
+        with self._lock:
+            healthy = [b for b in self.backends.values() if b.healthy and b.url not in exclude]
+            if not healthy:
+                return None
+            total_load = sum(b.load() for b in healthy) + 1
+            capacity = math.ceil(self.load_factor * total_load / len(healthy))
+
+            fallback = None
+            for url in self.candidates(key):
+                backend = self.backends[url]
+                if backend not in healthy or backend.load() >= capacity:
+                    continue
+                if backend.estimated_wait_ms > MAX_WAIT_MS:
+                    fallback = fallback or backend
+                    continue
+                break
+            else:
+                backend = fallback or min(healthy, key=lambda b: b.load())
+            backend.in_flight += 1
+            return backend
+
+    def acquire_for_resource(self, rid, exclude=()):
+        """
+        リソースを保存したノードを選んで処理中数を加算
+
+        覚えている保存先、なければIDのハッシュ位置からのリング順で選ぶ（負荷による振り分けはしない）
+        """
+        with self._lock:
+            order = self.candidates(f"id:{rid}")
+            known = self._locations.get(rid)
+            if known in self.backends:
+                order = [known] + [url for url in order if url != known]
+            for url in order:
+                backend = self.backends[url]
+                if backend.healthy and url not in exclude:
+                    backend.in_flight += 1
+                    return backend
+            return None
+
+    def remember(self, rid, backend):
+        """リソースの保存先を記録"""
+        with self._lock:
+            self._locations[rid] = backend.url
+            self._locations.move_to_end(rid)
+            while len(self._locations) > LOCATION_CACHE_SIZE:
+                self._locations.popitem(last=False)
+
+    def release(self, backend):
+        with self._lock:
+            backend.in_flight -= 1
+
+    def mark_failed(self, backend, error):
+        with self._lock:
+            backend.healthy = False
+            backend.last_error = str(error)
+
+    def poll_health(self):
+        """各ノードの /health を取得して状態を更新"""
+        for backend in list(self.backends.values()):
+            try:
+                response = requests.get(f"{backend.url}/health", timeout=2)
+                response.raise_for_status()
+                info = response.json()
+            except Exception as e:
+                self.mark_failed(backend, e)
+                continue
+            with self._lock:
+                backend.healthy = True
+                backend.last_error = None
+                backend.queue_depth = info.get('queue_depth', 0)
+                backend.estimated_wait_ms = info.get('estimated_wait_ms', 0.0)
+                backend.loaded_languages = info.get('loaded_languages', [])
+
+    def health_loop(self, interval=HEALTH_INTERVAL):
+        while True:
+            self.poll_health()
+            time.sleep(interval)
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "route_by": ROUTE_BY,
+                "load_factor": self.load_factor,
+                "backends": [b.to_dict() for b in self.backends.values()]
+            }
+
+app = Flask(__name__)
+router = ConsistentHashRouter(BACKENDS)
+
+@app.route('/router/status', methods=['GET'])
+def router_status():
+    """ルーターと各ノードの状態"""
+    return jsonify(router.get_status())
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """ヘルスチェック（受け付け可能なノードが1つ以上あればok）"""
+    status = router.get_status()
+    healthy = [b for b in status["backends"] if b["healthy"]]
+    return jsonify({"status": "ok" if healthy else "unavailable",
+                    "healthy_backends": len(healthy)}), 200 if healthy else 503
+
+def remember_locations(backend, upstream, content):
+    """レスポンスに含まれるジョブID・保存済み音声のURLから保存先を記録"""
+    urls = [upstream.headers.get('Content-Location', '')]
+    if content:
+        try:
+            data = upstream.json()
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            urls += [data.get('audio_url'), data.get('status_url')]
+            if isinstance(data.get('id'), str):
+                urls.append(f"jobs/{data['id']}")
+    for url in urls:
+        rid = resource_id(url) if isinstance(url, str) else None
+        if rid:
+            router.remember(rid, backend)
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'HEAD', 'POST', 'DELETE'])
+@app.route('/<path:path>', methods=['GET', 'HEAD', 'POST', 'DELETE'])
+def proxy(path):
+    """リクエストを振り分け先のノードに転送"""
+    body = request.get_data()
+    data = request.get_json(silent=True)
+    rid = resource_id(path)
+    key = routing_key(data) if isinstance(data, dict) and data else f"path:{path}"
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+    tried = []
+    not_found = False
+    # 接続エラーの場合は次の候補で1回だけ再試行
+    # ジョブ・保存済み音声は、保存先がわからなければ404以外が返るまで全ノードに問い合わせる
+    for _ in range(len(router.backends) if rid else 2):
+        backend = router.acquire_for_resource(rid, exclude=tried) if rid else router.acquire(key, exclude=tried)
+        if backend is None:
+            break
+        try:
+            upstream = requests.request(
+                request.method,
+                f"{backend.url}/{path}",
+                params=request.args,
+                data=body,
+                headers=headers,
+                stream=True,
+                timeout=REQUEST_TIMEOUT
+            )
+        except requests.ConnectionError as e:
+            print(f"⚠️  ノード接続エラー: {backend.url}: {e}")
+            router.mark_failed(backend, e)
+            router.release(backend)
+            tried.append(backend.url)
+            continue
+        except Exception:
+            router.release(backend)
+            raise
+
+        if rid and upstream.status_code == 404:
+            upstream.close()
+            router.release(backend)
+            tried.append(backend.url)
+            not_found = True
+            continue
+
+        # JSON（ジョブ登録・return_url 等の小さいレスポンス）は読み込んで保存先を記録する
+        is_json = upstream.headers.get('Content-Type', '').startswith('application/json')
+        content = upstream.content if is_json else None
+        if upstream.ok:
+            remember_locations(backend, upstream, content)
+            if rid:
+                router.remember(rid, backend)
+
+        response_headers = [(k, v) for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+        response_headers.append(('X-Kokoro-Backend', backend.url))
+        body_iter = [content] if content is not None else upstream.iter_content(chunk_size=64 * 1024)
+        response = Response(body_iter, status=upstream.status_code, headers=response_headers)
+
+        def finish(backend=backend, upstream=upstream):
+            upstream.close()
+            router.release(backend)
+        response.call_on_close(finish)
+        return response
+
+    if not_found:
+        return jsonify({"error": "見つかりません"}), 404
+    return jsonify({"error": "利用可能なノードがありません"}), 503
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    print("Kokoro-82Mルーター起動中...")
+    print(f"- ノード: {', '.join(BACKENDS)}")
+    print(f"- 振り分けキー: {ROUTE_BY}")
+    print(f"- 負荷上限係数: {LOAD_FACTOR}")
+
+    threading.Thread(target=router.health_loop, daemon=True).start()
+    serve(app, host='0.0.0.0', port=ROUTER_PORT, threads=32, connection_limit=200)
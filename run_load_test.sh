@@ -0,0 +1,5 @@
+#!/bin/bash
+# 過負荷テスト実行スクリプト（別端末でサーバーを起動しておく）
+
+source "$(dirname "$0")/common.sh"
+run_python_script "load_test.py" "🧪 Kokoro-82M 過負荷テスト実行中..."
\ No newline at end of file
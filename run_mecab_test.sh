@@ -26,4 +26,4 @@ if command -v mecab &> /dev/null; then
 fi
 
 source "$(dirname "$0")/common.sh"
-run_python_script "mecab_test.py" "🧪 MeCab動作テスト実行中..."
\ No newline at end of file
+run_python_script "mecab_test.py" "🧪 MeCab動作テスト・ベンチマーク実行中..."
\ No newline at end of file
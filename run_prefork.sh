@@ -0,0 +1,5 @@
+#!/bin/bash
+# Pre-fork本番サーバー起動スクリプト
+
+source "$(dirname "$0")/common.sh"
+run_python_script "prefork_server.py" "🏭 Kokoro-82M Pre-forkサーバー起動中..."
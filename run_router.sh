@@ -0,0 +1,5 @@
+#!/bin/bash
+# ルーター起動スクリプト（KOKORO_BACKENDSでノードを指定）
+
+source "$(dirname "$0")/common.sh"
+run_python_script "router.py" "🔀 Kokoro-82M ルーター起動中..."
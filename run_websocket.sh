@@ -0,0 +1,5 @@
+#!/bin/bash
+# WebSocketストリーミングサーバー起動スクリプト
+
+source "$(dirname "$0")/common.sh"
+run_python_script "websocket_tts.py" "🔌 Kokoro-82M WebSocketストリーミングサーバー起動中..."
@@ -3,9 +3,15 @@
 本番用Waitressサーバー起動スクリプト
 """
 
+import os
 import multiprocessing
 from waitress import serve
 from lightweight_tts import app
+from jobs import get_job_queue
+from overload import overload_controller
+
+# 複数レプリカを同一ホストで起動する場合はポートを変更
+PORT = int(os.environ.get('KOKORO_PORT', '8000'))
 
 if __name__ == '__main__':
     print("Kokoro-82M本番サーバー起動中...")
@@ -13,13 +19,21 @@ if __name__ == '__main__':
     # CPU最大活用
     cpu_count = multiprocessing.cpu_count()
     print(f"CPU最適化設定: {cpu_count}コア使用")
+    if overload_controller.enabled:
+        print(f"過負荷制御: 有効 (SLO p95 {overload_controller.slo_p95 * 1000:.0f}ms, "
+              f"待ち時間 {overload_controller.slo_queue_wait * 1000:.0f}ms, "
+              f"失敗率 {overload_controller.slo_error_rate:.0%})")
+    
+    # 非同期ジョブのワーカーを起動（対話リクエストとは別枠）
+    get_job_queue().start()
     
     # Waitressで起動（CPU最大活用）
     serve(
         app, 
         host='0.0.0.0', 
-        port=8000,
+        port=PORT,
         threads=cpu_count,  # CPU最大活用
         connection_limit=50,  # 適度な同時接続制限
-        cleanup_interval=30  # メモリクリーンアップ間隔
+        cleanup_interval=30,  # メモリクリーンアップ間隔
+        channel_request_lookahead=5  # クライアント切断を検知して合成を中断
     )
\ No newline at end of file
@@ -119,6 +119,7 @@ pip install -r requirements.txt
 # 実行権限付与
 chmod +x lightweight_tts.py
 chmod +x server_prod.py
+chmod +x prefork_server.py
 chmod +x test_client.py
 
 echo "セットアップ完了!"
@@ -131,6 +132,10 @@ echo "4. 本番用サーバー: ./run_production.sh"
 echo "5. Swaggerテスト: ./run_test.sh"
 echo "6. シンプルテスト: ./run_client_test.sh"
 echo "7. 🧪 MeCabテスト: ./run_mecab_test.sh"
+echo "8. Pre-forkサーバー: ./run_prefork.sh (KOKORO_MAX_REQUESTS / KOKORO_MAX_WORKER_RSS_MB でワーカー入れ替え)"
+echo "9. 🔌 WebSocketストリーミング: ./run_websocket.sh (ws://localhost:8765/ws/tts, KOKORO_WS_PORT で変更)"
+echo "10. 🔀 ルーター: KOKORO_BACKENDS=http://127.0.0.1:8001,http://127.0.0.1:8002 ./run_router.sh"
+echo "11. 🧪 過負荷テスト: KOKORO_OVERLOAD_CONTROL=1 でサーバー起動後 ./run_load_test.sh"
 echo ""
 echo "または仮想環境をアクティベートしてから:"
 echo "source venv/bin/activate"
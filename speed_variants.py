@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+速度違いの音声をタイムストレッチで生成
+合成済みの音声（レンディション）を保持し、同じテキスト・音声で速度だけが違う
+リクエストはWSOLAで伸縮して返す（再合成しない）
+
+- ピッチを保ったまま長さだけを変える（WSOLA: 波形類似度に基づく重畳加算）
+- 伸縮率が大きすぎる場合や、重ね合わせの類似度（品質スコア）が低い場合は
+  呼び出し側で通常の合成にフォールバックする
+"""
+
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 有効化（既定は無効）
+SPEED_VARIANTS = os.environ.get('KOKORO_SPEED_VARIANTS', '0') == '1'
+# レンディションキャッシュの上限（MB）
+RENDITION_CACHE_MB = float(os.environ.get('KOKORO_RENDITION_CACHE_MB', '64'))
+# 元の速度に対する伸縮率の上限（1.5なら元の速度の1/1.5倍〜1.5倍まで）
+STRETCH_MAX_RATIO = float(os.environ.get('KOKORO_STRETCH_MAX_RATIO', '1.5'))
+# これ未満の品質スコアは通常の合成にフォールバック
+STRETCH_MIN_QUALITY = float(os.environ.get('KOKORO_STRETCH_MIN_QUALITY', '0.7'))
+
+# 24kHzで約43msのフレーム、±10ms（100Hzの1周期）の探索範囲
+FRAME_LENGTH = 1024
+TOLERANCE = 240
+# 直前のフレームに対してこれ未満のエネルギーの候補は無音として扱う
+MIN_RELATIVE_ENERGY = 1e-3
+
+def time_stretch(audio, rate, frame_length=FRAME_LENGTH, tolerance=TOLERANCE):
+    """
+    WSOLAで音声の長さを 1/rate 倍にする（rate > 1 で速く、ピッチは変えない）
+
+    各フレームは、直前のフレームの自然な続きと最も相関が高い位置を
+    探索範囲内から選んで重ね合わせる。候補位置の相関は行列積でまとめて計算する。
+
+    Args:
+        audio (np.ndarray): 1次元の音声
+        rate (float): 速度の倍率
+        frame_length (int): フレーム長（サンプル数、偶数）
+        tolerance (int): 位置の探索範囲（サンプル数）
+
+    Returns:
+        tuple: (stretched: np.ndarray, quality: float)
+            quality は選んだ位置の正規化相関をフレームのエネルギーで重み付け平均したもの（1が最良）
+    """
+    audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+    if rate == 1.0 or len(audio) == 0:
+        return audio, 1.0
+
+    n = frame_length
+    synthesis_hop = n // 2
+    analysis_hop = synthesis_hop * rate
+    output_length = int(round(len(audio) / rate))
+    frames = output_length // synthesis_hop + 2
+
+    # 周期Hann窓（hop = n/2 で重ね合わせると総和が1）
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n) / n)).astype(np.float32)
+    window_sq = window * window
+    # フレーム中心を元の位置に合わせるため先頭に n/2、探索用に両端に tolerance を足す
+    front = synthesis_hop + tolerance
+    back = int(np.ceil(frames * analysis_hop)) + 2 * n + 2 * tolerance - len(audio)
+    x = np.pad(audio, (front, max(back, 0)))
+
+    # 全位置の窓付きエネルギー（各候補の正規化に使う）をFFTで一度に計算
+    size = 1 << int(np.ceil(np.log2(len(x) + n)))
+    energy = np.fft.irfft(np.fft.rfft(x * x, size) * np.fft.rfft(window_sq[::-1], size), size)
+    energy = np.sqrt(np.maximum(energy[n - 1:len(x)], 0.0))
+
+    output = np.zeros(frames * synthesis_hop + n, dtype=np.float32)
+    position = tolerance
+    output[:n] += x[position:position + n] * window
+    scores = np.empty(frames - 1, dtype=np.float64)
+    weights = np.empty(frames - 1, dtype=np.float64)
+
+    for k in range(1, frames):
+        # 直前のフレームの自然な続き（窓を掛けた候補との相関を取るため窓の2乗を掛ける）
+        natural = x[position + synthesis_hop:position + synthesis_hop + n]
+        natural_norm = float(np.sqrt(np.dot(natural * natural, window_sq)))
+        nominal = int(round(k * analysis_hop))
+        candidates = sliding_window_view(x[nominal:nominal + 2 * tolerance + n], n)
+        correlation = candidates @ (natural * window_sq)
+        # 無音（末尾のゼロ埋めなど）の候補はFFTの誤差で正規化相関が発散するため除外し、
+        # 正規化の分母も直前のフレームのエネルギーに対する下限を設ける
+        candidate_norms = energy[nominal:nominal + 2 * tolerance + 1]
+        audible = candidate_norms > natural_norm * MIN_RELATIVE_ENERGY
+        if natural_norm > 0 and audible.any():
+            norms = np.maximum(candidate_norms, natural_norm * MIN_RELATIVE_ENERGY) * natural_norm
+            similarity = np.where(audible, np.minimum(correlation / norms, 1.0), -np.inf)
+            best = int(np.argmax(similarity))
+            scores[k - 1] = similarity[best]
+            weights[k - 1] = natural_norm
+        else:
+            # 比べるものがない（無音）フレームは元の位置のまま、品質スコアには含めない
+            best = tolerance
+            scores[k - 1] = 0.0
+            weights[k - 1] = 0.0
+
+        position = nominal + best
+        start = k * synthesis_hop
+        output[start:start + n] += x[position:position + n] * window
+
+    total_weight = weights.sum()
+    quality = float(np.dot(scores, weights) / total_weight) if total_weight > 0 else 1.0
+    return output[synthesis_hop:synthesis_hop + output_length], quality
+
+def stretch_ratio(source_speed, target_speed):
+    """元の速度に対する伸縮率（1以上、速くする・遅くするの区別なし）"""
+    rate = target_speed / source_speed
+    return max(rate, 1 / rate)
+
+class RenditionCache:
+    """
+    合成済み音声のキャッシュ（合計サイズで上限、古いものから削除）
+
+    キー（テキスト・音声・言語など）ごとに、実際に合成した速度の音声を保持する。
+    伸縮で作った音声は劣化が重なるため保持しない。
+    """
+
+    def __init__(self, max_mb=RENDITION_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, key, speed, audio):
+        """実際に合成した音声を登録"""
+        if audio.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            renditions = self._entries.setdefault(key, {})
+            previous = renditions.get(float(speed))
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            renditions[float(speed)] = audio
+            self._bytes += audio.nbytes
+            self._entries.move_to_end(key)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= sum(a.nbytes for a in evicted.values())
+
+    def nearest(self, key, speed, max_ratio=STRETCH_MAX_RATIO):
+        """
+        伸縮率が最も小さいレンディションを取得
+
+        Returns:
+            tuple: (source_speed, audio)、伸縮率が max_ratio 以内のものがなければ None
+        """
+        with self._lock:
+            renditions = self._entries.get(key)
+            if not renditions:
+                return None
+            self._entries.move_to_end(key)
+            source_speed = min(renditions, key=lambda s: stretch_ratio(s, speed))
+            audio = renditions[source_speed]
+        if stretch_ratio(source_speed, speed) > max_ratio:
+            return None
+        return source_speed, audio
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "renditions": sum(len(r) for r in self._entries.values()),
+                "mb": round(self._bytes / 1024 / 1024, 1),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 1)
+            }
+
+rendition_cache = RenditionCache()
@@ -4,17 +4,47 @@ Swagger UI付きKokoro-82M TTS API
 """
 
 import io
+import os
+import gc
+import json
+import time
+import zipfile
 import soundfile as sf
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file
 from flask_restx import Api, Resource, fields
+from werkzeug.exceptions import HTTPException
 from kokoro_core import (
     generate_audio_data,
+    iter_audio_batch,
+    get_error_status,
+    is_degraded,
+    get_metrics,
+    increment_metric,
+    get_load_info,
     get_voice_info,
     get_system_info,
-    ALL_VOICES
+    get_saved_voices,
+    is_voice_blend,
+    normalize_voice,
+    output_audio,
+    save_voice,
+    validate_voice,
+    cpu_count,
+    ALL_VOICES,
+    SAMPLE_RATE,
+    FIRST_SEGMENT_POLICIES
 )
+from phrase_bank import lookup_phrase_wav
+from audio_store import audio_store, rendition_response, request_key
+from overload import overload_controller, LEVEL_SHED_BULK, SHED_MESSAGE
+import request_log
+import traffic_recorder
+from request_log import log_exception
+from memory_guard import get_memory_report, set_tracemalloc
 
 app = Flask(__name__)
+request_log.init_app(app)
+traffic_recorder.init_app(app)
 api = Api(
     app,
     version='1.0',
@@ -26,37 +56,58 @@ api = Api(
 # API名前空間
 ns = api.namespace('tts', description='音声合成操作')
 
-# グローバル変数でパイプラインをキャッシュ
-_pipeline = None
-_pipeline_lock = threading.Lock()
-
-@lru_cache(maxsize=1)
-def get_pipeline(lang_code='a'):
-    """パイプラインをキャッシュして再利用"""
-    global _pipeline
-    if _pipeline is None:
-        with _pipeline_lock:
-            if _pipeline is None:
-                print(f"Kokoroパイプライン初期化中... (言語: {lang_code})")
-                _pipeline = KPipeline(lang_code=lang_code)
-                print("初期化完了")
-    return _pipeline
-
 # APIモデル定義
 tts_model = api.model('TTSRequest', {
     'text': fields.String(required=True, description='音声化するテキスト', example='こんにちは、これはテストです。'),
-    'voice': fields.String(required=False, description='音声タイプ', default='af_heart', 
-                          enum=['af_heart', 'af_sky', 'af_grace', 'af_heaven', 'am_adam', 'am_mike', 'bf_iris', 'bf_rose']),
-    'speed': fields.Float(required=False, description='再生速度', default=1.0, min=0.5, max=2.0)
+    'voice': fields.String(required=False, default='af_heart', example='af_heart',
+                          description='音声タイプ。"af_heart:0.7,af_bella:0.3" 形式のブレンドや保存済みブレンド音声名も指定可能'),
+    'speed': fields.Float(required=False, description='再生速度', default=1.0, min=0.5, max=2.0),
+    'first_segment': fields.String(required=False, description='最初のセグメントの分割方針（短くすると最初の音声が早く出る）',
+                                   enum=list(FIRST_SEGMENT_POLICIES)),
+    'timeout_ms': fields.Integer(required=False, description='期限（ミリ秒）。超過するとチャンク間で合成を中断して504を返す', min=1),
+    'return_url': fields.Boolean(required=False, default=False,
+                                 description='音声の代わりに内容ハッシュのURL（/tts/audio/<hash>.wav）を返す（KOKORO_AUDIO_STORE=1 のとき）')
 })
 
 health_model = api.model('HealthResponse', {
     'status': fields.String(description='サービス状態'),
-    'model': fields.String(description='使用モデル')
+    'model': fields.String(description='使用モデル'),
+    'queue_depth': fields.Integer(description='処理中・待機中のリクエスト数'),
+    'capacity': fields.Integer(description='同時処理数'),
+    'estimated_wait_ms': fields.Float(description='新しいリクエストの推定待ち時間（ミリ秒）'),
+    'degradation_level': fields.Integer(description='過負荷による切り下げレベル（0は通常）'),
+    'loaded_languages': fields.List(fields.String, description='読み込み済みの言語')
 })
 
 voices_model = api.model('VoicesResponse', {
-    'voices': fields.List(fields.String, description='利用可能な音声一覧')
+    'voices': fields.List(fields.String, description='利用可能な音声一覧'),
+    'saved_voices': fields.Raw(description='保存済みブレンド音声（名前: ブレンド式）')
+})
+
+voice_blend_model = api.model('VoiceBlendRequest', {
+    'name': fields.String(required=True, description='保存する音声名（英小文字・数字・_）', example='warm_mix'),
+    'voice': fields.String(required=True, description='ブレンド式', example='af_heart:0.7,af_bella:0.3')
+})
+
+# バッチ合成の項目数の上限
+BATCH_MAX_ITEMS = int(os.environ.get('KOKORO_BATCH_MAX_ITEMS', '500'))
+# バッチ合成の出力形式: 形式名 → (soundfileの形式, 拡張子)
+BATCH_FORMATS = {
+    'wav': ('WAV', 'wav'),
+    'flac': ('FLAC', 'flac'),
+    'ogg': ('OGG', 'ogg')
+}
+
+batch_item_model = api.model('TTSBatchItem', {
+    'text': fields.String(required=True, description='音声化するテキスト', example='こんにちは。'),
+    'voice': fields.String(required=False, default='af_heart', example='jf_alpha', description='音声タイプ（ブレンド式も可）'),
+    'speed': fields.Float(required=False, description='再生速度', default=1.0, min=0.5, max=2.0),
+    'format': fields.String(required=False, description='出力形式', default='wav', enum=list(BATCH_FORMATS))
+})
+
+batch_model = api.model('TTSBatchRequest', {
+    'items': fields.List(fields.Nested(batch_item_model), required=True,
+                         description=f'合成する項目（最大{BATCH_MAX_ITEMS}件）')
 })
 
 @ns.route('/health')
@@ -65,7 +116,7 @@ class Health(Resource):
     @api.marshal_with(health_model)
     def get(self):
         """ヘルスチェック"""
-        return {"status": "ok", "model": "Kokoro-82M"}
+        return {"status": "ok", "model": "Kokoro-82M", **get_load_info()}
 
 @ns.route('/voices')
 class Voices(Resource):
@@ -77,7 +128,81 @@ class Voices(Resource):
             'af_heart', 'af_sky', 'af_grace', 'af_heaven',
             'am_adam', 'am_mike', 'bf_iris', 'bf_rose'
         ]
-        return {"voices": voices}
+        return {"voices": voices, "saved_voices": get_saved_voices()}
+    
+    @api.doc('create_voice')
+    @api.expect(voice_blend_model)
+    def post(self):
+        """ブレンド音声に名前を付けて保存"""
+        data = request.get_json(silent=True) or {}
+        _, success, message = save_voice(data.get('name'), data.get('voice'))
+        if not success:
+            # 入力の誤りは400、ファイル保存の失敗は500
+            api.abort(500 if "保存エラー" in message else 400, message)
+        return {"name": data['name'], "voice": get_saved_voices()[data['name']], "message": message}, 201
+
+tracemalloc_model = api.model('TracemallocRequest', {
+    'enabled': fields.Boolean(required=False, description='サンプリングを有効にする', default=True),
+    'frames': fields.Integer(required=False, description='記録するスタックフレーム数', default=1)
+})
+
+@ns.route('/metrics')
+class Metrics(Resource):
+    @api.doc('metrics')
+    def get(self):
+        """リクエスト・中断数などのメトリクス"""
+        return {**get_metrics(), "logging": request_log.get_status(), "traffic": traffic_recorder.get_status(),
+                "audio_store": audio_store.get_status() if audio_store else None}
+
+@ns.route('/memory')
+class Memory(Resource):
+    @api.doc('memory_report', params={'recent': '直近のリクエスト記録数', 'top': 'tracemalloc上位件数'})
+    def get(self):
+        """メモリ使用状況（リクエスト・ステージ別のRSS増分、tracemalloc上位）"""
+        recent = request.args.get('recent', 20, type=int)
+        top = request.args.get('top', 10, type=int)
+        return get_memory_report(recent=recent, top=top)
+
+@ns.route('/memory/tracemalloc')
+class MemoryTracemalloc(Resource):
+    @api.doc('memory_tracemalloc')
+    @api.expect(tracemalloc_model)
+    def post(self):
+        """tracemallocサンプリングの開始・停止"""
+        data = request.get_json(silent=True) or {}
+        frames = data.get('frames', 1)
+        if not isinstance(frames, int) or isinstance(frames, bool) or frames < 1:
+            api.abort(400, "framesは1以上の整数です")
+        try:
+            tracing = set_tracemalloc(bool(data.get('enabled', True)), frames)
+        except ValueError as e:
+            api.abort(400, f"framesが不正です: {e}")
+        return {"tracing": tracing}
+
+def stored_audio_response(content_hash, return_url, download_name):
+    """保存済み音声のレスポンス（return_url なら内容ハッシュのURLのみ、なければNone）"""
+    audio_url = api.url_for(StoredAudio, content_hash=content_hash)
+    if return_url:
+        return {"audio_url": audio_url, "etag": f'"{content_hash}"'}
+    response = rendition_response(content_hash, download_name=download_name)
+    if response is not None:
+        response.headers['Content-Location'] = audio_url
+    return response
+
+@ns.route('/audio/<string:content_hash>.wav')
+class StoredAudio(Resource):
+    @api.doc('stored_audio')
+    @api.produces(['audio/wav'])
+    def get(self, content_hash):
+        """保存済みの音声を取得
+        
+        内容のハッシュをURL・強いETagに使います。If-None-Match による304と、
+        Range による部分取得（206）に対応します。
+        """
+        response = rendition_response(content_hash)
+        if response is None:
+            api.abort(404, "音声が見つかりません")
+        return response
 
 @ns.route('/generate')
 class TTSGenerate(Resource):
@@ -98,64 +223,203 @@ class TTSGenerate(Resource):
             text = data['text']
             voice = data.get('voice', 'af_heart')
             speed = data.get('speed', 1.0)
+            first_segment = data.get('first_segment')
+            timeout_ms = data.get('timeout_ms')
+            return_url = bool(data.get('return_url'))
             
             if len(text) > 1000:
                 api.abort(400, "テキストが長すぎます（1000文字以下）")
             
-            print(f"TTS生成中: {text[:50]}...")
-            
-            # パイプライン取得
-            pipeline = get_pipeline()
+            error = validate_voice(voice)
+            if error:
+                api.abort(400, error)
+            voice = normalize_voice(voice)
+            download_name = f'kokoro_output_{"blend" if is_voice_blend(voice) else voice}.wav'
             
-            # 音声生成
-            audio_generator = pipeline(text, voice=voice, speed=speed)
+            if first_segment is not None and first_segment not in FIRST_SEGMENT_POLICIES:
+                api.abort(400, f"first_segmentは {', '.join(FIRST_SEGMENT_POLICIES)} のいずれかです")
             
-            # 音声チャンクを収集
-            audio_chunks = []
-            for chunk in audio_generator:
-                if chunk is not None:
-                    audio_chunks.append(chunk)
+            if not isinstance(speed, (int, float)) or isinstance(speed, bool):
+                api.abort(400, "speedは数値です")
             
-            if not audio_chunks:
-                api.abort(500, "音声生成に失敗しました")
+            if timeout_ms is not None and (not isinstance(timeout_ms, (int, float)) or timeout_ms <= 0):
+                api.abort(400, "timeout_msは正の数値です")
+            deadline = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+            # Waitressのchannel_request_lookahead有効時のみ切断を検知できる
+            client_disconnected = request.environ.get('waitress.client_disconnected')
             
-            # 音声データを結合
-            import numpy as np
-            if len(audio_chunks) == 1:
-                audio_data = audio_chunks[0]
-            else:
-                audio_data = np.concatenate(audio_chunks, axis=0)
+            if return_url and audio_store is None:
+                api.abort(400, "return_urlには音声ストアの有効化（KOKORO_AUDIO_STORE=1）が必要です")
+            # 同じリクエストの音声が保存済みなら合成しない
+            store_key = request_key(text, voice, speed, first_segment=first_segment) if audio_store else None
+            if store_key:
+                content_hash = audio_store.lookup(store_key)
+                response = stored_audio_response(content_hash, return_url, download_name) if content_hash else None
+                if response is not None:
+                    return response
             
-            # numpy配列であることを確認
-            if not isinstance(audio_data, np.ndarray):
-                audio_data = np.array(audio_data, dtype=np.float32)
+            # フレーズバンクに完全一致があればモデルを使わずにPCMスライスを返す
+            wav = lookup_phrase_wav(text, voice, speed)
+            if wav is not None and not return_url:
+                return send_file(
+                    io.BytesIO(wav),
+                    mimetype='audio/wav',
+                    as_attachment=True,
+                    download_name=download_name
+                )
             
-            # 1次元配列に変換（必要に応じて）
-            if audio_data.ndim > 1:
-                audio_data = audio_data.flatten()
-            
-            print(f"音声データ形状: {audio_data.shape}, データ型: {audio_data.dtype}")
+            # 音声生成（言語別パイプラインはkokoro_coreで共有）
+            audio_data, success, message = generate_audio_data(
+                text, voice, speed,
+                first_segment=first_segment,
+                should_cancel=client_disconnected,
+                deadline=deadline
+            )
+            if not success:
+                api.abort(get_error_status(message), message)
             
-            # メモリ上でWAVファイル作成
+            # メモリ上でWAVファイル作成（過負荷時はサンプルレートを下げる）
+            audio_data, sample_rate = output_audio(audio_data)
             buffer = io.BytesIO()
-            sf.write(buffer, audio_data, 24000, format='WAV')
+            sf.write(buffer, audio_data, sample_rate, format='WAV')
             buffer.seek(0)
             
             # メモリ解放
-            del audio_data, audio_chunks
+            del audio_data
             gc.collect()
             
+            # 切り下げていない（通常のサンプルレート・通常のモデルの）音声だけを保存して内容ハッシュのURLで返す
+            if store_key and sample_rate == SAMPLE_RATE and not is_degraded(message):
+                response = stored_audio_response(audio_store.put(store_key, buffer.getvalue()), return_url,
+                                                 download_name)
+                if response is not None:
+                    return response
+            
             return send_file(
                 buffer,
                 mimetype='audio/wav',
                 as_attachment=True,
-                download_name=f'kokoro_output_{voice}.wav'
+                download_name=download_name
             )
             
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"エラー: {str(e)}")
+            log_exception("リクエスト処理エラー")
             api.abort(500, str(e))
 
+class _ZipStream:
+    """ZipFileの書き込み先（書き込まれたバイト列を取り出してレスポンスに流す）"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def validate_batch_item(item):
+    """バッチ項目を検証（問題があればエラーメッセージ）"""
+    if not isinstance(item, dict):
+        return "項目はオブジェクトで指定してください"
+    text = item.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return "textフィールドが必要です"
+    if len(text) > 1000:
+        return "テキストが長すぎます（1000文字以下）"
+    if not isinstance(item.get('speed', 1.0), (int, float)):
+        return "speedは数値です"
+    if item.get('format', 'wav') not in BATCH_FORMATS:
+        return f"formatは {', '.join(BATCH_FORMATS)} のいずれかです"
+    return validate_voice(item.get('voice', 'af_heart'))
+
+def stream_batch_zip(items):
+    """
+    バッチ合成の結果を完了した順にZIPに追加しながら返す
+    
+    音声は "{番号}_{音声}.{拡張子}"、各項目の成否は最後の manifest.json に記録する
+    （1つの項目の失敗でバッチ全体を失敗させない）
+    """
+    stream = _ZipStream()
+    archive = zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED)
+    manifest = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        error = validate_batch_item(item)
+        if error:
+            manifest[index] = {"index": index, "success": False, "message": error}
+        else:
+            pending.append(index)
+    
+    jobs = [{**items[index], "voice": normalize_voice(items[index].get('voice', 'af_heart'))} for index in pending]
+    results = iter_audio_batch(jobs)
+    try:
+        for position, (audio_data, success, message) in results:
+            index = pending[position]
+            entry = {"index": index, "success": success, "message": message}
+            if success:
+                voice = jobs[position]['voice']
+                sf_format, extension = BATCH_FORMATS[jobs[position].get('format', 'wav')]
+                name = f'{index:04d}_{"blend" if is_voice_blend(voice) else voice}.{extension}'
+                duration = len(audio_data) / SAMPLE_RATE
+                audio_data, sample_rate = output_audio(audio_data)
+                buffer = io.BytesIO()
+                sf.write(buffer, audio_data, sample_rate, format=sf_format)
+                archive.writestr(name, buffer.getvalue())
+                entry.update(file=name, duration=round(duration, 2), sample_rate=sample_rate)
+                del audio_data, buffer
+            manifest[index] = entry
+            yield stream.pop()
+    finally:
+        # クライアントが切断した場合は残りの合成を打ち切る
+        results.close()
+    
+    succeeded = sum(1 for entry in manifest if entry["success"])
+    archive.writestr('manifest.json', json.dumps({
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "items": manifest
+    }, ensure_ascii=False, indent=2))
+    archive.close()
+    yield stream.pop()
+
+@ns.route('/batch')
+class TTSBatch(Resource):
+    @api.doc('text_to_speech_batch')
+    @api.expect(batch_model)
+    @api.produces(['application/zip'])
+    def post(self):
+        """複数のテキストをまとめて音声に変換
+        
+        言語ごとにまとめて合成し、完了した順にZIP（音声ファイル + manifest.json）で返します。
+        失敗した項目は manifest.json に理由が記録され、他の項目はそのまま返されます。
+        """
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('items'), list) or not data['items']:
+            api.abort(400, "itemsフィールド（1件以上のリスト）が必要です")
+        items = data['items']
+        if len(items) > BATCH_MAX_ITEMS:
+            api.abort(400, f"項目が多すぎます（{BATCH_MAX_ITEMS}件以下）")
+        # 過負荷時は対話リクエストを優先して一括処理を断る
+        if overload_controller.at_least(LEVEL_SHED_BULK):
+            increment_metric('overload_shed')
+            api.abort(503, SHED_MESSAGE)
+        request_log.annotate(batch_items=len(items))
+        
+        return Response(
+            stream_batch_zip(items),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=kokoro_batch.zip'}
+        )
+
 # ルートパスはSwagger UIが自動的に処理します
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+ルーター統合テスト
+ローカルで複数のバックエンド（server_prod.py）とルーターを起動し、
+同じリクエストが同じノードに振り分けられることを確認する
+"""
+
+import os
+import sys
+import time
+import subprocess
+import requests
+
+BACKEND_PORTS = [8001, 8002, 8003]
+ROUTER_URL = "http://localhost:8080"
+
+def python_command():
+    """仮想環境のPythonを優先"""
+    return "venv/bin/python" if os.path.exists("venv/bin/python") else sys.executable
+
+def wait_for(url, timeout=120):
+    """URLが応答するまで待機"""
+    for _ in range(timeout):
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return True
+        except Exception:
+            pass
+        time.sleep(1)
+    return False
+
+def start_cluster():
+    """バックエンドとルーターを起動"""
+    processes = []
+    backends = [f"http://127.0.0.1:{port}" for port in BACKEND_PORTS]
+    for port in BACKEND_PORTS:
+        env = dict(os.environ, KOKORO_PORT=str(port))
+        processes.append(subprocess.Popen([python_command(), "server_prod.py"], env=env))
+    env = dict(os.environ, KOKORO_BACKENDS=",".join(backends))
+    processes.append(subprocess.Popen([python_command(), "router.py"], env=env))
+
+    print("クラスター起動待機中...")
+    for url in backends + [ROUTER_URL]:
+        if not wait_for(f"{url}/health"):
+            print(f"❌ 起動に失敗しました: {url}")
+            stop_cluster(processes)
+            return None
+    print("✅ クラスター起動完了!")
+    return processes
+
+def stop_cluster(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+def test_affinity():
+    """同じリクエストは同じノードに振り分けられる"""
+    payloads = [
+        {"text": "Hello, this is a router test.", "voice": "af_heart", "speed": 1.0},
+        {"text": "こんにちは、ルーターのテストです。", "voice": "jf_alpha", "speed": 1.0},
+        {"text": "Another prompt for the router.", "voice": "am_adam", "speed": 1.2}
+    ]
+    ok = True
+    for payload in payloads:
+        backends = set()
+        for _ in range(3):
+            response = requests.post(f"{ROUTER_URL}/tts", json=payload, timeout=60)
+            backends.add(response.headers.get('X-Kokoro-Backend'))
+        status = "✅" if len(backends) == 1 else "❌"
+        ok = ok and len(backends) == 1
+        print(f"{status} {payload['text'][:30]}... → {', '.join(sorted(b or '?' for b in backends))}")
+    return ok
+
+def test_spread():
+    """異なるリクエストは複数のノードに分散される"""
+    backends = {}
+    for i in range(12):
+        payload = {"text": f"Prompt number {i}.", "voice": "af_heart", "speed": 1.0}
+        response = requests.post(f"{ROUTER_URL}/tts", json=payload, timeout=60)
+        backend = response.headers.get('X-Kokoro-Backend')
+        backends[backend] = backends.get(backend, 0) + 1
+    print(f"振り分け結果: {backends}")
+    return len(backends) > 1
+
+def test_job_routing():
+    """ジョブの状態確認・キャンセルは登録したノードに送られる"""
+    response = requests.post(f"{ROUTER_URL}/jobs", json={"text": "A job routed through the router."}, timeout=60)
+    if response.status_code != 202:
+        print(f"❌ ジョブ登録失敗: {response.status_code}")
+        return False
+    job_id = response.json()['id']
+    submitted = response.headers.get('X-Kokoro-Backend')
+    status = requests.get(f"{ROUTER_URL}/jobs/{job_id}", timeout=10)
+    cancel = requests.delete(f"{ROUTER_URL}/jobs/{job_id}", timeout=10)
+    ok = (status.status_code == 200 and status.headers.get('X-Kokoro-Backend') == submitted
+          and cancel.status_code in (200, 404))
+    print(f"{'✅' if ok else '❌'} ジョブ {job_id[:8]}: 登録 {submitted} → 状態 {status.headers.get('X-Kokoro-Backend')} "
+          f"({status.status_code}), キャンセル {cancel.status_code}")
+    return ok
+
+def main():
+    print("🔀 Kokoro-82M ルーター統合テスト")
+    print("=" * 50)
+    processes = start_cluster()
+    if not processes:
+        return
+    try:
+        test_affinity()
+        test_spread()
+        test_job_routing()
+        status = requests.get(f"{ROUTER_URL}/router/status").json()
+        for backend in status["backends"]:
+            print(f"- {backend['url']}: healthy={backend['healthy']}, "
+                  f"queue={backend['queue_depth']}, languages={backend['loaded_languages']}")
+    finally:
+        stop_cluster(processes)
+        print("✅ クラスター停止完了")
+
+if __name__ == "__main__":
+    main()
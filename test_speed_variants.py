@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+タイムストレッチ（speed_variants.py）の品質スコアのテスト
+モデルを使わず合成した波形で、品質スコアが 0〜1 に収まり
+無音の区間で発散しないことを確認する
+"""
+
+import sys
+import numpy as np
+from speed_variants import time_stretch, STRETCH_MIN_QUALITY
+
+SAMPLE_RATE = 24000
+RATES = [0.67, 0.8, 1.25, 1.5]
+
+def sine(frequency, seconds):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+def main():
+    print("🧪 タイムストレッチ品質テスト開始...")
+    rng = np.random.default_rng(0)
+    silence = np.zeros(SAMPLE_RATE // 5, dtype=np.float32)
+    signals = {
+        "正弦波": sine(220, 1.0),
+        "前後に無音": np.concatenate([silence, sine(220, 1.0), silence]),
+        "途中に無音": np.concatenate([sine(220, 0.5), silence, sine(330, 0.5)]),
+        "無音のみ": silence,
+        "ノイズ": (0.1 * rng.standard_normal(SAMPLE_RATE)).astype(np.float32)
+    }
+
+    failures = 0
+    for name, audio in signals.items():
+        for rate in RATES:
+            stretched, quality = time_stretch(audio, rate)
+            expected_length = int(round(len(audio) / rate))
+            ok = 0.0 <= quality <= 1.0 and len(stretched) == expected_length
+            # 周期的な信号は高品質のまま伸縮できる
+            if name in ("正弦波", "前後に無音"):
+                ok = ok and quality >= STRETCH_MIN_QUALITY
+            failures += not ok
+            print(f"{'✅' if ok else '❌'} {name:<8} rate={rate:<5} 品質={quality:.3f} 長さ={len(stretched)}")
+
+    if failures:
+        print(f"❌ {failures}件失敗")
+        sys.exit(1)
+    print("🧪 タイムストレッチ品質テスト完了")
+
+if __name__ == "__main__":
+    main()
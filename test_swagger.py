@@ -117,6 +117,30 @@ def test_api_endpoints():
         except Exception as e:
             print(f"❌ TTS Test {i+1} エラー: {e}")
     
+    # バッチ生成テスト（1件は不正な項目）
+    try:
+        print("\n📦 Batch Test: 3件")
+        batch_items = [
+            {"text": "Batch item one.", "voice": "af_heart"},
+            {"text": "バッチの二件目です。", "voice": "jf_alpha", "format": "flac"},
+            {"text": "", "voice": "af_heart"}
+        ]
+        start_time = time.time()
+        response = requests.post(f"{base_url}/tts/batch", json={"items": batch_items}, timeout=60)
+        if response.status_code == 200:
+            import io
+            import zipfile
+            archive = zipfile.ZipFile(io.BytesIO(response.content))
+            manifest = json.loads(archive.read('manifest.json'))
+            elapsed = time.time() - start_time
+            print(f"✅ 成功: {manifest['succeeded']}件 / 失敗: {manifest['failed']}件 ({elapsed:.2f}秒)")
+            for entry in manifest['items']:
+                print(f"   {entry['index']}: {entry.get('file', '-')} {entry['message']}")
+        else:
+            print(f"❌ エラー: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"❌ Batch Test エラー: {e}")
+    
     return True
 
 def main():
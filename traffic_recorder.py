@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+本番トラフィックの記録（replay.py で再生する）
+合成リクエストの形（文字数・言語・音声・速度・到着/完了時刻など）をローテーションする
+JSONLファイルに1リクエスト1行で書き出す
+
+- KOKORO_TRAFFIC_RECORD にファイルパスを指定すると有効（既定は無効）
+  Pre-forkサーバーでは "{pid}" を含めるとワーカーごとに別ファイルになる
+- テキストは既定で記録しない（KOKORO_TRAFFIC_TEXT=hash でハッシュ、full で全文）
+- リクエストスレッドはキューに積むだけで、書き込み・ローテーションは別スレッドで行う
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from voices import detect_language
+
+TRAFFIC_RECORD = os.environ.get('KOKORO_TRAFFIC_RECORD', '')
+# テキストの記録方法: redact（文字数のみ）, hash, full
+TRAFFIC_TEXT = os.environ.get('KOKORO_TRAFFIC_TEXT', 'redact')
+# 1ファイルの上限（MB）と残す世代数
+TRAFFIC_MAX_MB = float(os.environ.get('KOKORO_TRAFFIC_MAX_MB', '50'))
+TRAFFIC_BACKUPS = int(os.environ.get('KOKORO_TRAFFIC_BACKUPS', '5'))
+TRAFFIC_QUEUE_SIZE = 10000
+
+# 記録する合成エンドポイント
+RECORDED_PATHS = {'/tts', '/tts/generate', '/tts/batch', '/jobs'}
+
+logger = logging.getLogger('kokoro.traffic')
+
+_listener = None
+_dropped = 0
+_recorded = 0
+
+class _DroppingQueueHandler(QueueHandler):
+    """キューが満杯なら待たずに破棄（記録のためにリクエストを遅らせない）"""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+def setup_recorder():
+    """書き込みスレッドを作成（fork後の子プロセスでも呼び直す）"""
+    global _listener
+    if not TRAFFIC_RECORD:
+        return
+    path = TRAFFIC_RECORD.format(pid=os.getpid())
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=int(TRAFFIC_MAX_MB * 1024 * 1024),
+                                  backupCount=TRAFFIC_BACKUPS, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.Queue(TRAFFIC_QUEUE_SIZE)
+    _listener = QueueListener(records, handler)
+    logger.handlers[:] = [_DroppingQueueHandler(records)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _listener.start()
+
+def _flush():
+    try:
+        if _listener is not None:
+            _listener.stop()
+    except Exception:
+        pass
+
+setup_recorder()
+atexit.register(_flush)
+if TRAFFIC_RECORD and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=setup_recorder)
+
+def item_shape(text, voice='af_heart', speed=1.0, language=None):
+    """1件の合成リクエストの形（テキストは TRAFFIC_TEXT に従って秘匿）"""
+    text = text if isinstance(text, str) else ''
+    voice = voice if isinstance(voice, str) and voice else 'af_heart'
+    shape = {
+        "chars": len(text),
+        "lang": language or detect_language(text, voice),
+        "voice": voice,
+        "speed": speed
+    }
+    if TRAFFIC_TEXT == 'hash':
+        shape["text_hash"] = hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+    elif TRAFFIC_TEXT == 'full':
+        shape["text"] = text
+    return shape
+
+def record(entry):
+    """1行書き出す"""
+    global _recorded
+    _recorded += 1
+    logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+def init_app(app):
+    """Flaskアプリの合成リクエストを1件1行で記録（ストリーミングレスポンスは送信完了時）"""
+    if not TRAFFIC_RECORD:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _mark_arrival():
+        if request.path in RECORDED_PATHS and request.method == 'POST':
+            g.traffic_arrival = time.time()
+
+    @app.after_request
+    def _record_request(response):
+        arrival = g.pop('traffic_arrival', None)
+        if arrival is None:
+            return response
+        data = request.get_json(silent=True)
+        entry = {"ts": round(arrival, 3), "path": request.path, "status": response.status_code}
+        try:
+            if isinstance(data, dict) and isinstance(data.get('items'), list):
+                entry["items"] = [
+                    {**item_shape(item.get('text'), item.get('voice'), item.get('speed', 1.0)),
+                     "format": item.get('format', 'wav')}
+                    for item in data['items'] if isinstance(item, dict)
+                ]
+            elif isinstance(data, dict):
+                entry.update(item_shape(data.get('text'), data.get('voice'), data.get('speed', 1.0),
+                                        data.get('language')))
+                for key in ('first_segment', 'mixed_language', 'timeout_ms'):
+                    if data.get(key) is not None:
+                        entry[key] = data[key]
+        except Exception:
+            # 記録の失敗でレスポンスを失敗させない
+            return response
+
+        def _finish():
+            finished = time.time()
+            entry["finished"] = round(finished, 3)
+            entry["duration_ms"] = round((finished - arrival) * 1000, 1)
+            record(entry)
+
+        # ストリーミングレスポンス（バッチのZIP等）は送信完了時に記録する
+        # （send_file の direct_passthrough ではclose時のコールバックが呼ばれないためその場で記録）
+        if response.is_streamed and not response.direct_passthrough:
+            response.call_on_close(_finish)
+        else:
+            _finish()
+        return response
+
+def get_status():
+    return {
+        "enabled": bool(TRAFFIC_RECORD),
+        "text": TRAFFIC_TEXT,
+        "recorded": _recorded,
+        "dropped": _dropped
+    }
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+音声・言語の定義と音声指定の解析
+モデルやtorchに依存しないため、ルーターなど軽量なプロセスからも使用できる
+"""
+
+import os
+import json
+import math
+
+# 言語と音声の定義
+LANGUAGES = {
+    'a': 'American English',
+    'b': 'British English', 
+    'j': 'Japanese',
+    'z': 'Mandarin Chinese',
+    'e': 'Spanish',
+    'f': 'French',
+    'h': 'Hindi',
+    'i': 'Italian',
+    'p': 'Brazilian Portuguese'
+}
+
+VOICES = {
+    "🇺🇸 American English": [
+        'af_heart', 'af_alloy', 'af_aoede', 'af_bella', 'af_jessica', 'af_kore', 
+        'af_nicole', 'af_nova', 'af_river', 'af_sarah', 'af_sky',
+        'am_adam', 'am_echo', 'am_eric', 'am_fenrir', 'am_liam', 
+        'am_michael', 'am_onyx', 'am_puck', 'am_santa'
+    ],
+    "🇬🇧 British English": [
+        'bf_alice', 'bf_emma', 'bf_isabella', 'bf_lily',
+        'bm_daniel', 'bm_fable', 'bm_george', 'bm_lewis'
+    ],
+    "🇯🇵 Japanese": [
+        'jf_alpha', 'jf_gongitsune', 'jf_nezumi', 'jf_tebukuro',
+        'jm_kumo'
+    ],
+    "🇨🇳 Mandarin Chinese": [
+        'zf_xiaobei', 'zf_xiaoni', 'zf_xiaoxiao', 'zf_xiaoyi',
+        'zm_yunjian', 'zm_yunxi', 'zm_yunxia', 'zm_yunyang'
+    ],
+    "🇪🇸 Spanish": [
+        'ef_dora', 'em_alex', 'em_santa'
+    ],
+    "🇫🇷 French": [
+        'ff_siwis'
+    ],
+    "🇮🇳 Hindi": [
+        'hf_alpha', 'hf_beta', 'hm_omega', 'hm_psi'
+    ],
+    "🇮🇹 Italian": [
+        'if_sara', 'im_nicola'
+    ],
+    "🇧🇷 Brazilian Portuguese": [
+        'pf_dora', 'pm_alex', 'pm_santa'
+    ]
+}
+
+# フラットな音声リスト
+ALL_VOICES = []
+for voice_list in VOICES.values():
+    ALL_VOICES.extend(voice_list)
+
+def detect_language(text, voice):
+    """テキストと音声から言語を自動検出"""
+    # 音声名のプレフィックスから言語を検出（ブレンド音声は重みが最大の音声）
+    voice_prefix = primary_voice(voice).split('_')[0]
+    if voice_prefix.startswith('j'):
+        return 'j'  # Japanese
+    elif voice_prefix.startswith('z'):
+        return 'z'  # Mandarin Chinese
+    elif voice_prefix.startswith('b'):
+        return 'b'  # British English
+    elif voice_prefix.startswith('e'):
+        return 'e'  # Spanish
+    elif voice_prefix.startswith('f'):
+        return 'f'  # French
+    elif voice_prefix.startswith('h'):
+        return 'h'  # Hindi
+    elif voice_prefix.startswith('i'):
+        return 'i'  # Italian
+    elif voice_prefix.startswith('p'):
+        return 'p'  # Brazilian Portuguese
+    else:
+        return 'a'  # American English (default)
+
+# 名前を付けて保存したブレンド音声の保存先
+VOICES_DIR = os.environ.get('KOKORO_VOICES_DIR', 'voices')
+
+_saved_voices = {}
+_saved_voices_mtime = None
+
+def is_voice_blend(voice):
+    """複数音声または重み付きの指定か"""
+    return ',' in voice or ':' in voice
+
+def parse_voice_blend(expression):
+    """
+    ブレンド式を解析して重みを正規化
+
+    "af_heart:0.7,af_bella:0.3" の形式で、重みを省略した音声は1として扱う
+    （kokoro本来の "af_heart,af_bella" は等分の混合になる）
+
+    Returns:
+        list: [(voice, weight)]（重みの降順、合計1）
+
+    Raises:
+        ValueError: 不明な音声・不正な重みの場合
+    """
+    components = {}
+    for part in expression.split(','):
+        name, _, weight = part.strip().partition(':')
+        name = name.strip()
+        if name not in ALL_VOICES:
+            raise ValueError(f"不明な音声です: {name or part}")
+        try:
+            value = float(weight) if weight.strip() else 1.0
+        except ValueError:
+            raise ValueError(f"重みが不正です: {part.strip()}")
+        if not math.isfinite(value) or value <= 0:
+            raise ValueError(f"重みは正の数値です: {part.strip()}")
+        components[name] = components.get(name, 0.0) + value
+    total = sum(components.values())
+    return sorted(((name, value / total) for name, value in components.items()),
+                  key=lambda component: (-component[1], component[0]))
+
+def normalize_voice(voice):
+    """
+    音声指定を正規化（同じ混合は並び順・重みの書き方によらず同じ文字列になる）
+
+    単一音声・保存済み音声はそのまま返す
+    """
+    if not is_voice_blend(voice):
+        return voice
+    components = parse_voice_blend(voice)
+    if len(components) == 1:
+        return components[0][0]
+    return ",".join(f"{name}:{round(weight, 4):g}" for name, weight in components)
+
+def get_saved_voices():
+    """保存済みブレンド音声 {名前: 正規化した式}（他のプロセスでの保存も反映）"""
+    global _saved_voices, _saved_voices_mtime
+    path = os.path.join(VOICES_DIR, 'blends.json')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if mtime != _saved_voices_mtime:
+        with open(path, encoding='utf-8') as f:
+            _saved_voices = json.load(f)
+        _saved_voices_mtime = mtime
+    return _saved_voices
+
+def primary_voice(voice):
+    """ブレンド音声・保存済み音声で重みが最大の音声（言語判定に使用）"""
+    expression = get_saved_voices().get(voice, voice)
+    if not is_voice_blend(expression):
+        return expression
+    try:
+        return parse_voice_blend(expression)[0][0]
+    except ValueError:
+        return voice
+
+def validate_voice(voice):
+    """音声指定を検証（問題があればエラーメッセージ）"""
+    if not isinstance(voice, str) or not voice.strip():
+        return "❌ 音声を指定してください"
+    if is_voice_blend(voice):
+        try:
+            parse_voice_blend(voice)
+        except ValueError as e:
+            return f"❌ ブレンド音声の指定が不正です: {e}"
+    return None
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+WebSocketストリーミングKokoro-82M TTSサーバー
+LLMのトークンストリームなど逐次届くテキストを文・節ごとに合成して返す
+
+プロトコル（クライアント → サーバー、JSONテキストメッセージ）:
+    {"type": "start", "voice": "af_heart", "speed": 1.0, "language": null}
+    {"type": "text", "text": "テキスト差分"}
+    {"type": "flush"}   バッファ中の残りテキストも合成する
+    {"type": "cancel"}  未合成のテキストと合成中の音声を破棄する
+
+プロトコル（サーバー → クライアント）:
+    バイナリ: 16bitリトルエンディアンPCM（モノラル、24kHz）
+    {"type": "first_audio", "ttfa_ms": ...}  発話の最初の音声送信時
+    {"type": "segment_end", "index": ..., "text": ...}
+    {"type": "flushed"} / {"type": "cancelled"} / {"type": "error", "message": ...}
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+from flask import Flask, jsonify
+from flask_sock import Sock
+from kokoro_core import (
+    IncrementalSegmenter,
+    generate_audio_stream,
+    to_pcm16,
+    increment_metric,
+    observe_latency,
+    get_metrics,
+    get_system_info,
+    cpu_count,
+    SAMPLE_RATE
+)
+from request_log import request_context, log_exception
+
+# 待ち受けポート（ルーターのバックエンドの 8001, 8002... と重ならないように）
+WS_PORT = int(os.environ.get('KOKORO_WS_PORT', '8765'))
+
+app = Flask(__name__)
+sock = Sock(app)
+
+class StreamSession:
+    """1接続分の合成状態（受信スレッドと合成スレッドで共有）"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.voice = 'af_heart'
+        self.speed = 1.0
+        self.language = None
+        self.segmenter = IncrementalSegmenter()
+        self.queue = queue.Queue()
+        self.send_lock = threading.Lock()
+        # cancelのたびに世代を進め、古い世代のセグメントを捨てる
+        self.generation = 0
+        # 発話（flushまで）の開始時刻。セグメントと一緒にキューに積み、TTFAは発話ごとに測る
+        self.utterance_start = None
+        self.first_audio_utterance = None
+        self.segment_index = 0
+
+    def send_json(self, message):
+        with self.send_lock:
+            self.ws.send(json.dumps(message, ensure_ascii=False))
+
+    def send_audio(self, data):
+        with self.send_lock:
+            self.ws.send(data)
+
+    def enqueue(self, segments):
+        for segment in segments:
+            self.queue.put(('segment', self.generation, (segment, self.utterance_start)))
+
+    def synthesis_loop(self):
+        """合成スレッド: キューのセグメントを順番に合成して送信"""
+        while True:
+            kind, generation, payload = self.queue.get()
+            if kind == 'stop':
+                return
+            if generation != self.generation:
+                continue
+            if kind == 'flush':
+                self.send_json({"type": "flushed"})
+                continue
+            self.synthesize(generation, payload)
+
+    def synthesize(self, generation, payload):
+        segment, utterance_start = payload
+        with request_context('websocket') as log:
+            log.annotate(segment_index=self.segment_index)
+            self._synthesize(generation, segment, utterance_start, log)
+
+    def _synthesize(self, generation, segment, utterance_start, log):
+        segment_start = time.time()
+        stream = generate_audio_stream(segment, self.voice, self.speed, self.language)
+        try:
+            for chunk in stream:
+                # チャンク間でキャンセルを確認
+                if generation != self.generation:
+                    increment_metric('ws_segments_cancelled')
+                    log.annotate(cancelled='client')
+                    return
+                if utterance_start is not None and self.first_audio_utterance != utterance_start:
+                    ttfa = time.time() - utterance_start
+                    observe_latency('ws_ttfa', ttfa)
+                    self.send_json({"type": "first_audio", "ttfa_ms": round(ttfa * 1000, 1)})
+                    self.first_audio_utterance = utterance_start
+                    log.stage('first_audio')
+                self.send_audio(to_pcm16(chunk))
+            log.stage('synthesis')
+            observe_latency('ws_segment', time.time() - segment_start)
+            increment_metric('ws_segments')
+            self.send_json({"type": "segment_end", "index": self.segment_index, "text": segment})
+            self.segment_index += 1
+        except Exception as e:
+            # 切断・キャンセル済みの場合は通知しない
+            if generation != self.generation:
+                return
+            log_exception("WebSocket音声生成エラー")
+            log.annotate(success=False)
+            increment_metric('ws_errors')
+            self.send_json({"type": "error", "message": str(e)})
+        finally:
+            stream.close()
+
+    def handle(self, message):
+        """受信メッセージを処理"""
+        kind = message.get('type')
+        if kind == 'start':
+            self.voice = message.get('voice', self.voice)
+            self.speed = message.get('speed', self.speed)
+            self.language = message.get('language', self.language)
+        elif kind == 'text':
+            text = message.get('text', '')
+            if not isinstance(text, str):
+                self.send_json({"type": "error", "message": "textは文字列です"})
+                return
+            if self.utterance_start is None:
+                self.utterance_start = time.time()
+            self.enqueue(self.segmenter.feed(text))
+        elif kind == 'flush':
+            self.enqueue(self.segmenter.flush())
+            self.queue.put(('flush', self.generation, None))
+            self.utterance_start = None
+        elif kind == 'cancel':
+            self.generation += 1
+            self.segmenter.reset()
+            self.utterance_start = None
+            increment_metric('ws_cancels')
+            self.send_json({"type": "cancelled"})
+        else:
+            self.send_json({"type": "error", "message": f"不明なメッセージ: {kind}"})
+
+@sock.route('/ws/tts')
+def tts_stream(ws):
+    """逐次テキスト合成WebSocketエンドポイント"""
+    session = StreamSession(ws)
+    worker = threading.Thread(target=session.synthesis_loop, daemon=True)
+    worker.start()
+    increment_metric('ws_connections')
+    try:
+        while True:
+            raw = ws.receive()
+            if raw is None:
+                break
+            try:
+                message = json.loads(raw)
+            except (TypeError, ValueError):
+                message = None
+            if not isinstance(message, dict):
+                session.send_json({"type": "error", "message": "JSONオブジェクトのメッセージが必要です"})
+                continue
+            session.handle(message)
+    finally:
+        # 切断時は未合成のセグメントを破棄して合成スレッドを止める
+        session.generation += 1
+        session.queue.put(('stop', None, None))
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """ヘルスチェック"""
+    return jsonify({"status": "ok", "model": "Kokoro-82M", "sample_rate": SAMPLE_RATE})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """TTFA等のメトリクス"""
+    return jsonify({**get_metrics(), "loaded_languages": get_system_info()["loaded_languages"]})
+
+if __name__ == '__main__':
+    print("Kokoro-82M WebSocketストリーミングTTSサーバー起動中...")
+    print("最適化設定:")
+    print(f"- 検出CPUコア数: {cpu_count}")
+    print("- パイプラインキャッシュ: 有効")
+    print()
+    print("🌐 アクセス URL:")
+    print(f"- WebSocket: ws://localhost:{WS_PORT}/ws/tts")
+    print(f"- メトリクス: http://localhost:{WS_PORT}/metrics")
+
+    # WebSocketはWaitress非対応のためスレッド付き開発サーバーで起動
+    app.run(host='0.0.0.0', port=WS_PORT, debug=False, threaded=True)